@@ -0,0 +1,126 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from MTM import matchTemplates
+
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.provider.icon_replacer import IconReplacer
+
+from benchmarks.benchmark_utils import time_runs
+
+config = Config()
+logger = Logger()
+
+
+def make_synthetic_frames(template_files, count, size, seed=0):
+    # Noisy gradient backgrounds with a few templates pasted at random positions
+    rng = np.random.default_rng(seed)
+    width, height = size
+    templates = [cv2.imread(file) for file in template_files]
+
+    frames = []
+    for _ in range(count):
+        gradient = np.linspace(0, 160, width, dtype=np.float32)[None, :, None]
+        frame = np.clip(gradient + rng.normal(0, 20, (height, width, 3)), 0, 255).astype(np.uint8)
+
+        for index in rng.choice(len(templates), size=min(3, len(templates)), replace=False):
+            template = templates[index]
+            y = rng.integers(0, height - template.shape[0])
+            x = rng.integers(0, width - template.shape[1])
+            frame[y:y + template.shape[0], x:x + template.shape[1]] = template
+
+        frames.append(frame)
+
+    return frames
+
+
+def legacy_replace_icon(replacer, image_paths):
+    # Former replace_icon path: templates read for every frame, MTM matching and a JPEG write per frame, sequentially
+    replaced_images = []
+
+    for image_path in image_paths:
+        image = cv2.imread(image_path)
+
+        for template_file in replacer.template_paths:
+            template = cv2.imread(template_file)
+            template_name = os.path.splitext(os.path.basename(template_file))[0]
+
+            if 'left_mouse' in template_name:
+                template_name = 'LM'
+            elif 'right_mouse' in template_name:
+                template_name = 'RM'
+            elif 'mouse' in template_name:
+                template_name = 'MS'
+            elif 'enter' in template_name:
+                template_name = 'Ent'
+
+            detection = matchTemplates([(template_name, cv2.resize(template, (round(template.shape[1] * s), round(template.shape[0] * s)))) for s in [0.9, 1, 1.1]],
+                                       image,
+                                       N_object=1,
+                                       method=cv2.TM_CCOEFF_NORMED,
+                                       maxOverlap=0.1)
+
+            if detection['Score'].iloc[0] > 0.75:
+                image = replacer._drawBoxesOnRGB(image.copy(), [row for _, row in detection.iterrows()], boxThickness=-1, showLabel=True, boxColor=(255, 255, 255), labelColor=(0, 0, 0), labelScale=.62)
+
+        directory, filename = os.path.split(image_path)
+        save_path = os.path.join(directory, "icon_replace_" + filename)
+        cv2.imwrite(save_path, image)
+
+        replaced_images.append(image)
+
+    return replaced_images
+
+
+def main(args):
+
+    start = time.perf_counter()
+    replacer = IconReplacer(template_path=args.templates, max_workers=args.workers)
+    load_time = time.perf_counter() - start
+
+    frames = make_synthetic_frames(replacer.template_paths, args.frames, (args.width, args.height))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        image_paths = []
+        for i, frame in enumerate(frames):
+            path = os.path.join(work_dir, f"frame_{i:04d}.jpg")
+            cv2.imwrite(path, frame)
+            image_paths.append(path)
+
+        legacy_result, legacy_timings = time_runs(lambda: legacy_replace_icon(replacer, image_paths), args.repeat)
+        replacer_result, replacer_timings = time_runs(lambda: replacer.replace_icon(image_paths), args.repeat)
+
+        for handle in replacer_result:
+            handle.path # wait for the background writes before the directory is removed
+
+        # The labels drawn by both paths, compared before the JPEG encoding
+        same_labels = all([np.array_equal(handle.array, legacy_image) for handle, legacy_image in zip(replacer_result, legacy_result)])
+
+    logger.write(f'Templates: {len(replacer.templates)}, frames: {args.frames} at {args.width}x{args.height}, repeats: {args.repeat}, template preload: {load_time:.4f}s')
+    logger.write(f'Legacy replace_icon:        {args.frames / (sum(legacy_timings) / len(legacy_timings)):.1f} frames/s')
+    logger.write(f'IconReplacer ({args.workers} workers):  {args.frames / (sum(replacer_timings) / len(replacer_timings)):.1f} frames/s')
+    logger.write(f'Same labels as the legacy path: {same_labels}, frames returned: {len(legacy_result) == len(replacer_result)}')
+
+
+def get_args_parser():
+
+    parser = argparse.ArgumentParser("Cradle Icon Replacer Benchmark")
+    parser.add_argument("--templates", type=str, default="./res/rdr2/icons/keys", help="The directory of the icon templates")
+    parser.add_argument("--frames", type=int, default=16, help="The number of synthetic frames")
+    parser.add_argument("--width", type=int, default=1280, help="The width of the synthetic frames")
+    parser.add_argument("--height", type=int, default=720, help="The height of the synthetic frames")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of timed runs per implementation")
+    parser.add_argument("--workers", type=int, default=4, help="The thread pool size of the icon replacer")
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_args_parser()
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,89 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+from cradle import constants
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.environment.utils import serialize_skills, deserialize_skills
+from cradle.environment.skill_library_store import SkillLibraryStore
+from cradle.environment.skill_registry import LazySkillFunction
+from cradle.utils.file_utils import assemble_project_path
+from cradle.utils.json_utils import load_json, save_json
+
+from benchmarks.benchmark_utils import time_runs
+
+config = Config()
+logger = Logger()
+
+
+def load_json_library(file_path):
+    # Current format: parse the whole document, then unpickle every function and decode every embedding
+    return deserialize_skills(load_json(file_path))
+
+
+def load_store_library(store):
+    # Binary format: map the embedding table and wrap the code, functions are only compiled when used
+    stored_skills = store.load()
+    return {skill_name: LazySkillFunction(skill_name, stored_skill.skill_code) for skill_name, stored_skill in stored_skills.items()}
+
+
+def get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum([os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path)])
+
+
+def main(args):
+
+    library_path = args.library
+    if library_path is None:
+        library_path = os.path.join(config.skill_local_path, constants.SKILL_FULL_LIB_FILE)
+    library_path = assemble_project_path(library_path)
+
+    if not os.path.exists(library_path):
+        logger.error(f'Skill library {library_path} not found.')
+        return
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        skills = load_json_library(library_path)
+
+        store = SkillLibraryStore(os.path.join(work_dir, 'skill_lib' + constants.SKILL_LIB_STORE_SUFFIX))
+        store.write_all(skills)
+
+        _, json_timings = time_runs(lambda: load_json_library(library_path), args.repeat)
+        _, store_timings = time_runs(lambda: load_store_library(SkillLibraryStore(store.path)), args.repeat)
+
+        # Cost of persisting one newly registered skill
+        json_copy_path = os.path.join(work_dir, 'skill_lib.json')
+        new_skill = next(iter(skills.values()))
+        _, json_write_timings = time_runs(lambda: save_json(json_copy_path, serialize_skills(skills), indent=4), args.repeat)
+        _, store_append_timings = time_runs(lambda: store.append([new_skill]), args.repeat)
+
+        logger.write(f'Skills: {len(skills)}, repeats: {args.repeat}')
+        logger.write(f'Size:   json {get_size(library_path) / 1024:.1f} KiB, store {get_size(store.path) / 1024:.1f} KiB')
+        logger.write(f'Load:   json mean {sum(json_timings) / len(json_timings):.4f}s, store mean {sum(store_timings) / len(store_timings):.4f}s')
+        logger.write(f'Persist one skill: json rewrite mean {sum(json_write_timings) / len(json_write_timings):.4f}s, '
+                     f'store append mean {sum(store_append_timings) / len(store_append_timings):.4f}s')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def get_args_parser():
+
+    parser = argparse.ArgumentParser("Cradle Skill Library Loader Benchmark")
+    parser.add_argument("--envConfig", type=str, default="./conf/env_config_chrome.json", help="The path to the environment config file")
+    parser.add_argument("--library", type=str, default=None, help="The path to a json skill library, defaults to the environment one")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of timed runs per format")
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_args_parser()
+    args = parser.parse_args()
+
+    config.load_env_config(args.envConfig)
+
+    main(args)
@@ -0,0 +1,82 @@
+import argparse
+import math
+import time
+
+import cv2
+
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils.file_utils import assemble_project_path
+from cradle.utils.template_matching import match_template_image, TemplateLibrary
+
+from benchmarks.benchmark_utils import time_runs
+
+config = Config()
+logger = Logger()
+
+
+def legacy_icons_match(icon_list, image_path, confidence_threshold=0.90):
+    # Former icons_match path: one match_template_image call, screenshot decode and template pyramid per icon
+    matches = []
+
+    for icon in icon_list:
+        icon_template_file = f'./res/{config.env_sub_path}/icons/{icon}.png'
+        match_info = match_template_image(image_path, icon_template_file, save_matches=False, scale='full')
+
+        if match_info[0]['confidence'] >= confidence_threshold:
+            bb = match_info[0]['bounding_box']
+            matches.append({
+                "left": math.ceil(bb[0]),
+                "top": math.ceil(bb[1]),
+                "width": math.ceil(bb[2]),
+                "height": math.ceil(bb[3]),
+            })
+
+    return matches
+
+
+def library_icons_match(icon_list, image_path, max_workers=None):
+    image = cv2.imread(assemble_project_path(image_path))
+    return TemplateLibrary().match_icons(icon_list, image, scale='full', max_workers=max_workers)
+
+
+def main(args):
+
+    library = TemplateLibrary()
+
+    start = time.perf_counter()
+    icon_list = library.load_icons()
+    load_time = time.perf_counter() - start
+
+    if len(icon_list) == 0:
+        logger.error(f'No icons found for environment {config.env_sub_path}.')
+        return
+
+    legacy_result, legacy_timings = time_runs(lambda: legacy_icons_match(icon_list, args.screenshot), args.repeat)
+    library_result, library_timings = time_runs(lambda: library_icons_match(icon_list, args.screenshot), args.repeat)
+    pool_result, pool_timings = time_runs(lambda: library_icons_match(icon_list, args.screenshot, args.workers), args.repeat)
+
+    logger.write(f'Icons: {len(icon_list)}, repeats: {args.repeat}, library preload: {load_time:.4f}s')
+    logger.write(f'Legacy icons_match:            mean {sum(legacy_timings) / len(legacy_timings):.4f}s, min {min(legacy_timings):.4f}s')
+    logger.write(f'TemplateLibrary (sequential):  mean {sum(library_timings) / len(library_timings):.4f}s, min {min(library_timings):.4f}s')
+    logger.write(f'TemplateLibrary ({args.workers} workers):   mean {sum(pool_timings) / len(pool_timings):.4f}s, min {min(pool_timings):.4f}s')
+    logger.write(f'Same matches: {legacy_result == library_result == pool_result}')
+
+
+def get_args_parser():
+
+    parser = argparse.ArgumentParser("Cradle Template Matching Benchmark")
+    parser.add_argument("--envConfig", type=str, default="./conf/env_config_chrome.json", help="The path to the environment config file")
+    parser.add_argument("--screenshot", type=str, required=True, help="The path to the screenshot to match icons against")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of timed runs per implementation")
+    parser.add_argument("--workers", type=int, default=4, help="The thread pool size for the parallel run")
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_args_parser()
+    args = parser.parse_args()
+
+    config.load_env_config(args.envConfig)
+
+    main(args)
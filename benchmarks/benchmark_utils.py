@@ -0,0 +1,12 @@
+import time
+
+
+def time_runs(func, repeat):
+    # Wall time of each call, and the result of the last one
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, timings
@@ -1,6 +1,7 @@
 from collections import namedtuple
 import os
 import time
+import threading
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -93,33 +94,82 @@ class Config(metaclass=Singleton):
         self.temperature = float(os.getenv("TEMPERATURE", self.temperature))
         self.max_tokens = int(os.getenv("MAX_TOKENS", "1024"))
 
+        # LLM completion cache, keyed by model, messages, temperature and seed
+        self.completion_cache_mode = os.getenv("COMPLETION_CACHE_MODE", constants.COMPLETION_CACHE_MODE_OFF)
+        self.completion_cache_dir = os.getenv("COMPLETION_CACHE_DIR", "./cache/completions")
+        self.completion_cache_max_entries = 10000
+        self.completion_cache_max_bytes = 512 * 1024 * 1024
+
         # Memory parameters
         self.memory_backend = os.getenv("MEMORY_BACKEND", "local")
         self.max_recent_steps = 5
         self.event_count = 5
         self.memory_load_path = None
+        self.memory_log_enabled = True # append the memory deltas of each turn to a log instead of rewriting memory.json, see MemoryLog
+        self.memory_snapshot_interval = 20 # turns between compactions of the memory log into a snapshot
+
+        # Embeddings are cached on disk by model and text hash, shared across skill registries and runs
+        self.embedding_cache_enabled = True
+        self.embedding_cache_dir = "./cache/embeddings"
+
+        # In-process vector store, see NumpyVectorStore
+        self.vector_store_index_threshold = 50000 # live vectors from which an IVF index is used instead of exact search
+        self.vector_store_nprobe = 8 # IVF lists searched per query
 
         # Parallel request to LLM parameters
         self.parallel_request_gather_information = True
+        self.llm_max_concurrent_requests = 4 # in-flight requests of a parallel fan-out, see RequestScheduler
+        self.llm_rpm_limit = None # requests per minute, None for no limit, overridden by "rpm_limit" in the provider config
+        self.llm_tpm_limit = None # tokens per minute, None for no limit, overridden by "tpm_limit" in the provider config
+        self.llm_request_max_retries = 3
+        self.llm_retry_base_delay = 1.0 # seconds, doubled per retry, with full jitter
+        self.llm_retry_max_delay = 30.0
+        self.pipelined_turns = False # run independent stages of a turn concurrently, e.g. self-reflection and SOM augmentation
+
+        # Image encoding for LLM requests
+        self.image_encoding_cache_max_bytes = 256 * 1024 * 1024 # total size of the cached base64 strings
+        self.image_encoding_format = None # None keeps image files as they are, or re-encode to "jpeg" or "webp"
+        self.image_encoding_quality = 85
+        self.image_encoding_max_resolution = None # longest side in pixels of re-encoded images, None keeps the size
 
         # Video
         self.video_fps = 8
         self.duplicate_frames = 4
         self.frames_per_slice = 1000
+        self.frame_buffer_max_frames = 1000 # distinct frames kept in memory, duplicated frame ids do not count
+        self.frame_buffer_max_bytes = 2 * 1024 ** 3
+        self.video_encode_queue_size = 64 # captured frames waiting to be encoded
+        self.video_encode_backpressure = constants.VIDEO_BACKPRESSURE_DROP_OLDEST
+        self.frame_source_max_age = 0.2 # seconds a recorded frame can be reused as a screenshot
+        self.frame_source_keep_files = True # save screenshots to the work dir in the background, for the run logs
+
+        # Keyframe extraction for information gathering
+        self.frame_extractor_backend = constants.FRAME_EXTRACTOR_SUBFINDER # or FRAME_EXTRACTOR_NATIVE, which only diffs the keyframe_roi pixels and does not detect text
+        self.keyframe_roi = (0.0, 0.0, 1.0, 1.0) # x1, y1, x2, y2 fractions of the frame compared for changes
+        self.keyframe_change_threshold = 0.02 # fraction of the ROI pixels that must change to start a new keyframe
+        self.keyframe_workers = 4 # processes decoding a video file
+        self.icon_replacer_workers = 4 # threads replacing icons in the extracted keyframes
 
         # Self-reflection image count
         self.max_images_in_self_reflection = 4
+        self.self_reflection_frame_selector = constants.FRAME_SELECTOR_PHASH # or FRAME_SELECTOR_HISTOGRAM, FRAME_SELECTOR_STRIDE
+        self.self_reflection_change_threshold = 0.05 # frame distance, from 0 to 1, under which frames are the same
+        self.self_reflection_skip_unchanged = False # skip self-reflection when the frames of the last action are all the same, which often means the action failed
 
         # Decision-making image count
         self.action_planning_image_num = 2
         self.number_of_execute_skills = 1
         self.skill_library_with_code = False
+        self.skill_library_format = constants.SKILL_LIB_FORMAT_JSON # or SKILL_LIB_FORMAT_BINARY, see SkillLibraryStore
 
         # OCR local checks
         self.ocr_fully_ban = True # whether to fully turn-off OCR checks
         self.ocr_enabled = False # whether to enable OCR during composite skill loop
         self.ocr_similarity_threshold = 0.9  # cosine similarity, smaller than this threshold the text is considered to be different
-        self.ocr_different_previous_text = False # whether the text is different from the previous one
+        self.ocr_text_changed = threading.Event() # set by the recorder when the text is different from the previous one
+        self.ocr_sample_interval = 0.5 # seconds between frames checked by OCR
+        self.ocr_edit_same_threshold = 0.95 # normalized edit similarity, from this value texts are the same without spaCy
+        self.ocr_edit_different_threshold = 0.5 # normalized edit similarity, up to this value texts are different without spaCy
         self.ocr_check_composite_skill_names = [
             "shoot_people",
             "shoot_wolves",
@@ -128,6 +178,9 @@ class Config(metaclass=Singleton):
             "navigate_path"
         ]
 
+        # Heavy models are loaded on first use, these ones are loaded in the background at startup instead
+        self.prewarm_models = [] # e.g. [constants.MODEL_SAM], see ModelRegistry
+
         # Change max steps, Self-reflection image count for software
         self.max_turn_count = 50 if self.is_game == False else 999999
         self.max_images_in_self_reflection = 2 if self.is_game == False else 4
@@ -135,6 +188,10 @@ class Config(metaclass=Singleton):
         # SAM2SOM parameters
         self.use_sam_flag = True # @TODO load from config in augmentation configs?
         self.sam_model_name = "default"
+        self.sam_device = None # None for cuda when available, else cpu
+        self.som_backend = constants.SOM_BACKEND_SAM # or SOM_BACKEND_CONTOUR for CPU-only machines
+        self.som_tile_cache = None # only re-segment the screen tiles that changed since the previous screenshot, None for the contour backend only
+        self.som_tile_size = 256
 
         # Default parameters. Can be updated by environment specific configuration.
         self.sam2som_mode = constants.SAM2SOM_DEFAULT_MODE # SAM2SOM_DEFAULT_MODE for only use sam, SAM2SOM_OCR_MODE for sam combine ocr
@@ -159,6 +216,8 @@ class Config(metaclass=Singleton):
 
         # Parameters for comparing images
         self.pixel_diff_threshold = 100
+        self.pixel_diff_tolerance = 0 # per-channel difference still considered the same pixel
+        self.pixel_diff_downsample_stride = 4 # stride of the preview used to early-exit on clearly changed screens
 
         # @TODO To be moved to augmentation provider, just loaded from config
         self.draw_axis = False
@@ -183,6 +242,20 @@ class Config(metaclass=Singleton):
         self.disable_auto_pause: bool = False
 
 
+    @property
+    def ocr_different_previous_text(self) -> bool:
+        """Whether the text is different from the previous one, read from ocr_text_changed."""
+        return self.ocr_text_changed.is_set()
+
+
+    @ocr_different_previous_text.setter
+    def ocr_different_previous_text(self, value: bool) -> None:
+        if value:
+            self.ocr_text_changed.set()
+        else:
+            self.ocr_text_changed.clear()
+
+
     def load_env_config(self, env_config_path):
         """Load environment specific configuration."""
 
@@ -235,6 +308,7 @@ class Config(metaclass=Singleton):
         # SAM2SOM parameters for specific environment
         default_sam2som_config = {
             constants.SAM2SOM_MODE: self.sam2som_mode,
+            constants.SOM_BACKEND: self.som_backend,
             constants.SAM_PRED_IOU_THRESH: self.sam_pred_iou_thresh,
             constants.SAM_RESIZE_RATIO: self.sam_resize_ratio,
             constants.SAM_CONTRAST_LEVEL: self.sam_contrast_level,
@@ -250,6 +324,7 @@ class Config(metaclass=Singleton):
             sam2som_config = default_sam2som_config
 
         self.sam2som_mode = sam2som_config[constants.SAM2SOM_MODE]
+        self.som_backend = sam2som_config[constants.SOM_BACKEND]
         self.sam_pred_iou_thresh = sam2som_config[constants.SAM_PRED_IOU_THRESH]
         self.sam_resize_ratio = sam2som_config[constants.SAM_RESIZE_RATIO]
         self.sam_contrast_level = sam2som_config[constants.SAM_CONTRAST_LEVEL]
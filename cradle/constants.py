@@ -66,6 +66,9 @@ GET_ITEM_NUMBER = 'get_item_number'
 SKILL_CODE_HASH_KEY = "skill_code_base64"
 SKILL_FULL_LIB_FILE = "skill_lib.json"
 SKILL_BASIC_LIB_FILE = "skill_lib_basic.json"
+SKILL_LIB_STORE_SUFFIX = ".store" # directory of the binary skill library, next to the json file
+SKILL_LIB_FORMAT_JSON = "json"
+SKILL_LIB_FORMAT_BINARY = "binary"
 SKILL_LIB_MODE_BASIC = 'Basic'
 SKILL_LIB_MODE_FULL = 'Full'
 SKILL_LIB_MODE_NONE = None
@@ -106,6 +109,9 @@ PLOT_BBOX_MULTI_COLOR = 'plot_bbox_multi_color'
 DISABLE_CLOSE_APP_ICON = 'disable_close_app_icon'
 SAM2SOM_DEFAULT_MODE = 'default'
 SAM2SOM_OCR_MODE = 'enable_ocr'
+SOM_BACKEND = 'som_backend'
+SOM_BACKEND_SAM = 'sam'
+SOM_BACKEND_CONTOUR = 'contour' # edge contours on CPU, no model needed
 
 # Two instances of augmentation info dict
 PREVIOUS_AUGMENTATION_INFO = "previous_augmentation_info"
@@ -160,6 +166,30 @@ SUMMARIZATION_MEM_BUCKET = 'summarization'
 MESSAGE_CONSTRUCTION_MODE_TRIPART = 'tripartite'
 MESSAGE_CONSTRUCTION_MODE_PARAGRAPH = 'paragraph'
 
+# LLM completion cache modes
+COMPLETION_CACHE_MODE_OFF = 'off'
+COMPLETION_CACHE_MODE_READ_WRITE = 'read_write'
+COMPLETION_CACHE_MODE_REPLAY = 'replay' # only serve cached completions, fail on misses
+
+# Lazily loaded models, see ModelRegistry
+MODEL_SPACY = 'spacy_en_core_web_lg'
+MODEL_EASYOCR = 'easyocr_en'
+MODEL_SAM = 'sam'
+MODEL_GROUNDING_DINO = 'grounding_dino'
+
+# Keyframe extraction backends
+FRAME_EXTRACTOR_NATIVE = 'native'
+FRAME_EXTRACTOR_SUBFINDER = 'subfinder'
+
+# Self-reflection frame selection methods
+FRAME_SELECTOR_PHASH = 'phash'
+FRAME_SELECTOR_HISTOGRAM = 'histogram'
+FRAME_SELECTOR_STRIDE = 'stride' # fixed stride, frame content is not compared
+
+# Video recorder backpressure policies, when the encode queue is full
+VIDEO_BACKPRESSURE_DROP_OLDEST = 'drop_oldest'
+VIDEO_BACKPRESSURE_BLOCK = 'block' # capture waits for the encoder
+
 # Prompts when output is None
 NONE_TASK_OUTPUT = "null"
 NONE_TARGET_OBJECT_OUTPUT = "null"
@@ -12,7 +12,7 @@ from cradle.gameio.io_env import IOEnvironment
 from cradle.environment.rdr2.atomic_skills.combat import aim, shoot
 from cradle.environment.rdr2.atomic_skills.move import turn
 from cradle.environment.rdr2.skill_registry import register_skill
-from cradle.utils.image_utils import exec_clip_minimap
+from cradle.utils.image_utils import MinimapCapture
 from cradle import constants
 
 config = Config()
@@ -63,24 +63,23 @@ def keep_shooting_target(
 
     aim()  # aim before detection
 
+    capture = MinimapCapture(config.env_region, config.minimap_region)
+
     terminal_flags = []
     for step in range(1, 1 + iterations):
 
         if debug:
             logger.debug(f'Go into combat #{step}')
 
-        if config.ocr_different_previous_text:
+        if config.ocr_text_changed.is_set():
             logger.write("The text is different from the previous one.")
             config.ocr_enabled = False # disable ocr
-            config.ocr_different_previous_text = False # reset
+            config.ocr_text_changed.clear() # reset
             break
 
         timestep = time.time()
 
-        screen_image_filename, minimap_image_filename = exec_clip_minimap(timestep,
-                                                                          screen_region=config.env_region,
-                                                                          minimap_region=config.minimap_region)
-        screen = cv2.imread(screen_image_filename)
+        screen, _ = capture.capture(timestep)
         h, w, _ = screen.shape
 
         # center pointer
@@ -93,6 +92,9 @@ def keep_shooting_target(
             time.sleep(POST_WAIT_TIME)
             continue
 
+        # Target and enemy detection read the screenshot files, only written when the pointer is not on a target
+        screen_image_filename, minimap_image_filename = capture.save(timestep)
+
         if not detect_target.endswith(' .'):
             detect_target += ' .'
         _, boxes, logits, phrases = groundingdino_detect(screen_image_filename, detect_target, box_threshold=0.4)
@@ -201,6 +203,10 @@ def keep_shooting_target(
             if debug:
                 cv2.imwrite(os.path.join(save_dir, f"red_detect_{timestep}.jpg"), follow_info['vis'])
 
+    logger.write(f'Shooting control loop ran at {capture.get_frequency():.1f} Hz')
+    capture.close()
+
+
 __all__ = [
     "shoot_people",
     "shoot_wolves"
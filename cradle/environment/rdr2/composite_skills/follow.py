@@ -9,7 +9,7 @@ from cradle.log import Logger
 from cradle.utils.image_utils import minimap_movement_detection
 from cradle.environment.rdr2.atomic_skills.move import turn, move_forward
 from cradle.environment.rdr2.skill_registry import register_skill
-from cradle.utils.image_utils import exec_clip_minimap
+from cradle.utils.image_utils import MinimapCapture
 from cradle.utils.object_utils import circle_detector_detect
 from cradle import constants
 
@@ -45,21 +45,24 @@ def cv_follow_circles(
     minimap_image_filename_q = deque(maxlen=max_q_size)
     condition_q = deque(maxlen=max_q_size)
 
+    capture = MinimapCapture(config.env_region, config.minimap_region)
+
     for step in range(iterations):
 
         if debug:
             logger.write(f'Go into combat #{step}')
 
-        if config.ocr_different_previous_text:
+        if config.ocr_text_changed.is_set():
             logger.write("The text is different from the previous one.")
             config.ocr_enabled = False # disable ocr
-            config.ocr_different_previous_text = False  # reset
+            config.ocr_text_changed.clear()  # reset
             break
 
         timestep = time.time()
-        screen_image_filename, minimap_image_filename = exec_clip_minimap(timestep,
-                                                                          screen_region=config.env_region,
-                                                                          minimap_region=config.minimap_region)
+        capture.capture(timestep)
+
+        # The circle detector reads the minimap file
+        screen_image_filename, minimap_image_filename = capture.save(timestep)
         minimap_image_filename_q.append(minimap_image_filename)
 
         adjacent_minimaps = list(minimap_image_filename_q)[::max_q_size-1] if len(minimap_image_filename_q)>=max_q_size else None
@@ -118,6 +121,9 @@ def cv_follow_circles(
 
         previous_distance, previous_theta = follow_dis, follow_theta
 
+    logger.write(f'Follow control loop ran at {capture.get_frequency():.1f} Hz')
+    capture.close()
+
 
 __all__ = [
     "follow",
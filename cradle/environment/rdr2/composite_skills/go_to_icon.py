@@ -1,4 +1,5 @@
 import os, time, math
+from functools import lru_cache
 
 import cv2
 import numpy as np
@@ -9,7 +10,7 @@ from cradle.log import Logger
 from cradle.utils.file_utils import assemble_project_path
 from cradle.environment.rdr2.atomic_skills.move import turn, move_forward
 from cradle.environment.rdr2.skill_registry import register_skill
-from cradle.utils.image_utils import exec_clip_minimap
+from cradle.utils.image_utils import MinimapCapture
 from cradle import constants
 
 config = Config()
@@ -48,16 +49,30 @@ def get_theta(origin_x, origin_y, center_x, center_y):
 
 
 # @TODO: This should be merged with the one in utils/template_matching.py
-def match_template(src_file, template_file, template_resize_scale = 1, debug=False):
-    srcimg = cv2.imread(assemble_project_path(src_file))
-    template = cv2.imread(assemble_project_path(template_file))
+@lru_cache(maxsize=16)
+def load_template(template_file, template_resize_scale = 1):
 
-    origin = (srcimg.shape[0] // 2, srcimg.shape[1] //2)
+    template = cv2.imread(assemble_project_path(template_file))
 
     # resize
     if template_resize_scale != 1:
         template = cv2.resize(template, (0, 0), fx=template_resize_scale, fy=template_resize_scale)
 
+    return template
+
+
+def match_template(src_file, template_file, template_resize_scale = 1, debug=False):
+
+    # The source is a minimap file or an in-memory minimap from MinimapCapture
+    if isinstance(src_file, np.ndarray):
+        srcimg = src_file
+    else:
+        srcimg = cv2.imread(assemble_project_path(src_file))
+
+    template = load_template(template_file, template_resize_scale)
+
+    origin = (srcimg.shape[0] // 2, srcimg.shape[1] //2)
+
     detection = matchTemplates([('', cv2.resize(template, (0, 0), fx=s, fy=s)) for s in [1]],
                                srcimg,
                                N_object=1,
@@ -99,56 +114,61 @@ def cv_go_to_icon(
 
     check_success, prev_dis, prev_theta, counter, ride_attempt, ride_mod, dis_stat = False, 0, 0, 0, 0, 10, []
 
-    for step in range(iterations):
+    capture = MinimapCapture(config.env_region, config.minimap_region, debug=debug)
+
+    try:
+        for step in range(iterations):
+
+            logger.write(f'Go to icon iter #{step}')
 
-        logger.write(f'Go to icon iter #{step}')
+            if config.ocr_text_changed.is_set():
+                logger.write("The text is different from the previous one.")
+                config.ocr_enabled = False # disable ocr
+                config.ocr_text_changed.clear()  # reset
+                break
 
-        if config.ocr_different_previous_text:
-            logger.write("The text is different from the previous one.")
-            config.ocr_enabled = False # disable ocr
-            config.ocr_different_previous_text = False  # reset
-            break
+            timestep = time.time()
 
-        timestep = time.time()
+            # 1. Get observation screenshot
+            _, minimap = capture.capture(timestep)
+            theta, info = match_template(minimap, template_file, config.resolution_ratio, debug)
+            dis, confidence = info['distance'], info['confidence']
 
-        # 1. Get observation screenshot
-        screen_image_filename, minimap_image_filename = exec_clip_minimap(timestep,
-                                                                          screen_region=config.env_region,
-                                                                          minimap_region=config.minimap_region)
-        theta, info = match_template(minimap_image_filename, template_file, config.resolution_ratio, debug)
-        dis, confidence = info['distance'], info['confidence']
+            if debug:
+                cv2.imwrite(os.path.join(save_dir, f"minimap_{timestep}_detect.jpg"), info['vis'])
 
-        if debug:
-            cv2.imwrite(os.path.join(save_dir, f"minimap_{timestep}_detect.jpg"), info['vis'])
+            if dis < terminal_threshold and abs(theta) < 90:  # begin to settle
+                logger.write('Success! Reached the icon.')
+                return True
 
-        if dis < terminal_threshold and abs(theta) < 90:  # begin to settle
-            logger.write('Success! Reached the icon.')
-            return True
+            # 2. Check stuck
+            if abs(prev_dis - dis) < 0.5 and abs(prev_theta - theta) < 0.5:
+                counter += 1
+                if counter >= 1:
+                    if debug:
+                        logger.debug('Move randomly to get unstuck')
+                    for _ in range(2):
+                        turn(np.random.randint(30, 60) if np.random.rand()<0.5 else -np.random.randint(30, 60))
+                        move_forward(np.random.randint(2, 4))
+            else:
+                counter = 0
 
-        # 2. Check stuck
-        if abs(prev_dis - dis) < 0.5 and abs(prev_theta - theta) < 0.5:
-            counter += 1
-            if counter >= 1:
-                if debug:
-                    logger.debug('Move randomly to get unstuck')
-                for _ in range(2):
-                    turn(np.random.randint(30, 60) if np.random.rand()<0.5 else -np.random.randint(30, 60))
-                    move_forward(np.random.randint(2, 4))
-        else:
-            counter = 0
+            # 3. Move
+            turn(theta)
+            move_forward(1.5)
+            time.sleep(0.5)
 
-        # 3. Move
-        turn(theta)
-        move_forward(1.5)
-        time.sleep(0.5)
+            if debug:
+                logger.debug(f"step {step:03d} | timestep {timestep} done | theta: {theta:.2f} | distance: {dis:.2f} | confidence: {confidence:.3f} {'below threshold' if confidence < 0.5 else ''}")
 
-        if debug:
-            logger.debug(f"step {step:03d} | timestep {timestep} done | theta: {theta:.2f} | distance: {dis:.2f} | confidence: {confidence:.3f} {'below threshold' if confidence < 0.5 else ''}")
+            prev_dis, prev_theta = dis, theta
 
-        prev_dis, prev_theta = dis, theta
+        logger.error(f'Go to icon failed to reach icon.')
+        return False  # failed
 
-    logger.error(f'Go to icon failed to reach icon.')
-    return False  # failed
+    finally:
+        logger.write(f'Go to icon control loop ran at {capture.get_frequency():.1f} Hz')
+        capture.close()
 
 
 __all__ = [
@@ -10,7 +10,7 @@ from cradle.log import Logger
 from cradle.environment.rdr2.atomic_skills.move import turn, move_forward, stop_horse
 from cradle.environment.rdr2.skill_registry import register_skill
 from cradle.environment.rdr2.composite_skills.go_to_icon import match_template
-from cradle.utils.image_utils import exec_clip_minimap
+from cradle.utils.image_utils import MinimapCapture
 from cradle import constants
 
 config = Config()
@@ -45,13 +45,15 @@ def cv_navigation(total_iterations, terminal_threshold=NAVIGATION_TERMINAL_THRES
 
     waypoint_marker_filename = f'./res/{config.env_sub_path}/icons/red_marker.jpg'
 
+    capture = MinimapCapture(screen_region, minimap_region, debug=debug)
+
     try:
         for step in range(total_iterations):
 
-            if config.ocr_different_previous_text:
+            if config.ocr_text_changed.is_set():
                 logger.write("The text is different from the previous one.")
                 config.ocr_enabled = False  # disable ocr
-                config.ocr_different_previous_text = False  # reset
+                config.ocr_text_changed.clear()  # reset
                 break
 
             timestep = time.time()
@@ -69,11 +71,9 @@ def cv_navigation(total_iterations, terminal_threshold=NAVIGATION_TERMINAL_THRES
                     move_forward(0.3)
                 time.sleep(0.1) # avoid running too fast
 
-            _, minimap_image_filename = exec_clip_minimap(timestep,
-                                                          screen_region=screen_region,
-                                                          minimap_region=minimap_region)
+            _, minimap = capture.capture(timestep)
 
-            theta, measure = match_template(minimap_image_filename, waypoint_marker_filename, config.resolution_ratio, debug=False)
+            theta, measure = match_template(minimap, waypoint_marker_filename, config.resolution_ratio, debug=False)
 
             logger.debug(f"distance  {measure['distance']}")
 
@@ -84,24 +84,33 @@ def cv_navigation(total_iterations, terminal_threshold=NAVIGATION_TERMINAL_THRES
                 logger.debug('success! Reach the red marker.')
                 stop_horse()
                 time.sleep(1)
-                theta, measure = match_template(minimap_image_filename, waypoint_marker_filename, config.resolution_ratio, debug=False)
+                theta, measure = match_template(minimap, waypoint_marker_filename, config.resolution_ratio, debug=False)
                 turn(theta * 1.2)
                 break
 
-            turn_angle = calculate_turn_angle(timestep, debug)
+            turn_angle = calculate_turn_angle(timestep, debug, minimap=minimap)
 
     except Exception as e:
         logger.warn(f"Error in cv_navigation: {e}. Usually not a problem.")
         stop_horse()
 
+    finally:
+        logger.write(f"Navigation control loop ran at {capture.get_frequency():.1f} Hz")
+        capture.close()
+
 
-def calculate_turn_angle(tid, debug = False, show_image = False):
+def calculate_turn_angle(tid, debug = False, show_image = False, minimap = None):
 
     output_dir = config.work_dir
 
     minimap_path = output_dir + "/minimap_" + str(tid) + ".jpg"
     output_path = output_dir + "/direction_map_" + str(tid) + ".jpg"
-    image = cv2.imread(minimap_path)
+
+    # The direction lines are drawn on the image, so an in-memory minimap is copied first
+    if minimap is not None:
+        image = minimap.copy()
+    else:
+        image = cv2.imread(minimap_path)
 
     # Convert the image to HSV space
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
@@ -298,7 +307,8 @@ def calculate_turn_angle(tid, debug = False, show_image = False):
         color = (0, 255, 255)
         cv2.circle(image, point, 5, color, -1)
 
-    cv2.imwrite(output_path, image)
+    if debug:
+        cv2.imwrite(output_path, image)
 
     if show_image:
         cv2.imshow('upper', upper_bottom_img)
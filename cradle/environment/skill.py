@@ -46,7 +46,8 @@ class Skill(JSONWizard):
 
     def to_dict(self) -> JSONObject:
         skill_function_hex = dill.dumps(self.skill_function).hex() # Convert skill function to hex string
-        skill_embedding_base64 = base64.b64encode(self.skill_embedding).decode('utf-8')
+        skill_embedding = np.asarray(self.skill_embedding, dtype=np.float64) # from_dict reads float64, embeddings may be float32 views
+        skill_embedding_base64 = base64.b64encode(skill_embedding.tobytes()).decode('utf-8')
 
         return {
             'skill_name': self.skill_name,
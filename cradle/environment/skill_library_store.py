@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from cradle.log import Logger
+
+logger = Logger()
+
+STORE_VERSION = 1
+META_FILE = "meta.json"
+INDEX_FILE = "index.jsonl"
+EMBEDDINGS_FILE = "embeddings.f32"
+
+
+def hash_skill_code(skill_code: str) -> str:
+    return hashlib.sha256(skill_code.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class StoredSkill:
+
+    skill_name: str
+    skill_code: str
+    code_hash: str
+    skill_embedding: np.ndarray # read-only view into the memory-mapped embedding table
+
+
+class SkillLibraryStore():
+    """
+    Compact on-disk skill library, as an alternative to the single json document written by store_skills_to_file.
+
+    The store is a directory with a float32 embedding table, memory-mapped on load, and a json lines index with the
+    name, code and code hash of each skill pointing to its row in the table. Functions are not serialized, they are
+    taken from the registered skills or compiled from their code when first used. Registering a skill appends one
+    row and one index line. Records of a re-registered skill supersede the previous ones, and the store is compacted
+    when superseded records make up most of it.
+    """
+
+    def __init__(self, path: str):
+
+        self.path = path
+
+        self.dim = None
+        self.row_count = 0
+        self.record_count = 0
+        self.live_names = set()
+
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, META_FILE)) and os.path.exists(os.path.join(self.path, INDEX_FILE))
+
+
+    def load(self) -> Dict[str, StoredSkill]:
+        """Load the latest record of each skill, compacting the store first if superseded records dominate it."""
+
+        with open(os.path.join(self.path, META_FILE), mode='r', encoding='utf8') as fp:
+            meta = json.load(fp)
+
+        if meta["version"] != STORE_VERSION:
+            raise ValueError(f"Unsupported skill library store version {meta['version']} in {self.path}.")
+
+        self.dim = meta["dim"]
+
+        embeddings_path = os.path.join(self.path, EMBEDDINGS_FILE)
+        embeddings_size = os.path.getsize(embeddings_path) if os.path.exists(embeddings_path) else 0
+        self.row_count = embeddings_size // (4 * self.dim) if self.dim else 0
+
+        records = {}
+        self.record_count = 0
+        with open(os.path.join(self.path, INDEX_FILE), mode='r', encoding='utf8') as fp:
+            for line in fp:
+                if line.strip() == "":
+                    continue
+
+                record = json.loads(line)
+                self.record_count += 1
+
+                if record["row"] >= self.row_count:
+                    logger.warn(f"Skill {record['skill_name']} points past the embedding table in {self.path}, skipping it.")
+                    continue
+
+                records[record["skill_name"]] = record
+
+        self.live_names = set(records.keys())
+
+        # Compact before mapping the table, files mapped in memory cannot be replaced on every platform
+        if self.needs_compaction():
+            logger.write(f"Compacting skill library store {self.path}: {len(records)} skills in {self.record_count} records")
+            embeddings = np.fromfile(embeddings_path, dtype=np.float32, count=self.row_count * self.dim).reshape(self.row_count, self.dim)
+            self.write_all({skill_name: StoredSkill(skill_name, record["skill_code"], record["code_hash"], embeddings[record["row"]])
+                            for skill_name, record in records.items()})
+            return self.load()
+
+        embeddings = None
+        if self.row_count > 0:
+            embeddings = np.memmap(embeddings_path, dtype=np.float32, mode='r', shape=(self.row_count, self.dim))
+
+        return {skill_name: StoredSkill(skill_name, record["skill_code"], record["code_hash"], embeddings[record["row"]])
+                for skill_name, record in records.items()}
+
+
+    def append(self, skills: List) -> None:
+        """Append skills to the store, superseding earlier records with the same names."""
+
+        skills = [skill for skill in skills if skill.skill_embedding is not None]
+        if len(skills) == 0:
+            return
+
+        if not self.exists():
+            self.write_all({skill.skill_name: skill for skill in skills})
+            return
+
+        embeddings = np.stack([np.asarray(skill.skill_embedding, dtype=np.float32).reshape(-1) for skill in skills])
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(f"Skill embeddings have dimension {embeddings.shape[1]}, the store in {self.path} expects {self.dim}.")
+
+        with open(os.path.join(self.path, EMBEDDINGS_FILE), "ab") as fp:
+            fp.write(embeddings.tobytes())
+
+        with open(os.path.join(self.path, INDEX_FILE), mode='a', encoding='utf8') as fp:
+            for i, skill in enumerate(skills):
+                fp.write(self._index_line(skill, self.row_count + i))
+
+        self.row_count += len(skills)
+        self.record_count += len(skills)
+        self.live_names.update([skill.skill_name for skill in skills])
+
+
+    def needs_compaction(self) -> bool:
+        return self.record_count > 2 * max(len(self.live_names), 1)
+
+
+    def write_all(self, skills: Dict) -> None:
+        """
+        Rewrite the whole store with the given skills, replacing the files atomically.
+
+        Embeddings of the skills that are views into a memory-mapped table are replaced with in-memory copies first,
+        as files mapped in memory cannot be replaced on every platform.
+        """
+
+        skills = {skill_name: skill for skill_name, skill in skills.items() if skill.skill_embedding is not None}
+
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+
+        if len(skills) > 0:
+            embeddings = np.stack([np.asarray(skill.skill_embedding, dtype=np.float32).reshape(-1) for skill in skills.values()])
+        else:
+            embeddings = np.zeros((0, self.dim or 0), dtype=np.float32)
+
+        for row, skill in enumerate(skills.values()):
+            if isinstance(skill.skill_embedding, np.memmap):
+                skill.skill_embedding = embeddings[row]
+
+        self.dim = int(embeddings.shape[1])
+
+        self._write_file(EMBEDDINGS_FILE, embeddings.tobytes())
+        self._write_file(INDEX_FILE, "".join([self._index_line(skill, row) for row, skill in enumerate(skills.values())]).encode('utf-8'))
+        # The meta file is written last, so a store is only seen as existing once complete
+        self._write_file(META_FILE, json.dumps({"version": STORE_VERSION, "dim": self.dim}).encode('utf-8'))
+
+        self.row_count = len(skills)
+        self.record_count = len(skills)
+        self.live_names = set(skills.keys())
+
+
+    def _index_line(self, skill, row: int) -> str:
+
+        record = {
+            "skill_name": skill.skill_name,
+            "code_hash": hash_skill_code(skill.skill_code),
+            "row": row,
+            "skill_code": skill.skill_code,
+        }
+
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+    def _write_file(self, file_name: str, data: bytes) -> None:
+
+        path = os.path.join(self.path, file_name)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as fp:
+            fp.write(data)
+
+        os.replace(tmp_path, path)
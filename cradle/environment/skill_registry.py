@@ -5,6 +5,7 @@ import base64
 import re
 import ast
 import time
+from collections import OrderedDict
 from copy import deepcopy
 from typing import Type, AnyStr, List, Any, Dict, Tuple
 
@@ -17,8 +18,10 @@ from cradle.utils.json_utils import load_json, save_json
 from cradle.utils.dict_utils import kget
 from cradle.environment.skill import Skill
 from cradle.environment.utils import serialize_skills, deserialize_skills
+from cradle.environment.skill_library_store import SkillLibraryStore, hash_skill_code
 from cradle.utils.check import is_valid_value
 from cradle.gameio.io_env import IOEnvironment
+from cradle.memory.embedding_cache import EmbeddingCache
 from cradle.constants import *
 
 
@@ -26,6 +29,8 @@ config = Config()
 logger = Logger()
 io_env = IOEnvironment()
 
+QUERY_EMBEDDING_MEMO_SIZE = 128
+
 
 SKILLS = {}
 def register_skill(name):
@@ -88,11 +93,26 @@ class SkillRegistry():
             self.skill_from_default = True
 
         self.embedding_provider = embedding_provider
+        self.embedding_cache = EmbeddingCache()
+
+        # Contiguous float32 embeddings of self.skills, one row per skill in the order of the dict, for retrieval.
+        # The buffer grows by doubling, only the first len(self.embedding_names) rows are in use.
+        self.embedding_matrix = np.zeros((0, 0), dtype=np.float32)
+        self.embedding_names: List[str] = []
+        self.embedding_rows: Dict[str, int] = {}
+        self.query_embedding_memo: OrderedDict[str, np.ndarray] = OrderedDict()
 
         self.skills = {}
 
+        self.skill_store = None
+        if config.skill_library_format == constants.SKILL_LIB_FORMAT_BINARY:
+            library_name = os.path.splitext(self.skill_library_filename)[0]
+            self.skill_store = SkillLibraryStore(os.path.join(config.skill_local_path, library_name + constants.SKILL_LIB_STORE_SUFFIX))
+
         os.makedirs(config.skill_local_path, exist_ok=True)
-        if self.skill_from_default and os.path.exists(os.path.join(config.skill_local_path, self.skill_library_filename)):
+        if self.skill_from_default and self.skill_store is not None and self.skill_store.exists():
+            self.skills = self.load_skills_from_store()
+        elif self.skill_from_default and os.path.exists(os.path.join(config.skill_local_path, self.skill_library_filename)):
             self.skills = self.load_skills_from_file(os.path.join(config.skill_local_path, self.skill_library_filename))
         else:
             self.skills = self.load_skills_from_scripts()
@@ -105,7 +125,27 @@ class SkillRegistry():
 
 
     def get_embedding(self, skill_name, skill_doc):
-        return np.array(self.embedding_provider.embed_query('{}: {}'.format(skill_name, skill_doc)))
+        return self.get_embeddings([(skill_name, skill_doc)])[0]
+
+
+    def get_embeddings(self, skill_name_docs: List[Tuple[str, str]]) -> List[np.ndarray]:
+        """Embed (skill name, docstring) pairs in one batched request, skipping the ones already cached."""
+        texts = ['{}: {}'.format(skill_name, skill_doc) for skill_name, skill_doc in skill_name_docs]
+        return self.embedding_cache.embed_documents(self.embedding_provider, texts)
+
+
+    def fill_missing_embeddings(self, skills: Dict[str, Skill]) -> None:
+        """Compute the embeddings of all skills without one at once, instead of one request per skill."""
+
+        missing_skills = [skill for skill in skills.values() if not is_valid_value(skill.skill_embedding)]
+        if len(missing_skills) == 0:
+            return
+
+        embeddings = self.get_embeddings([(skill.skill_name, inspect.getdoc(skill.skill_function)) for skill in missing_skills])
+        for skill, embedding in zip(missing_skills, embeddings):
+            skill.skill_embedding = embedding
+            if skills is self.skills:
+                self.add_skill_embedding(skill.skill_name, embedding)
 
 
     def load_skills_from_file(self, file_path) -> Dict[str, Skill]:
@@ -142,9 +182,71 @@ class SkillRegistry():
                                            skill_code_base64)
             else: # skill_code has been modified, we should recompute embedding
                 logger.write(f"Regenerate skill {skill_name}")
-                self.register_skill_from_code(skill_local[skill_name].skill_code)
+                self.register_skill_from_code(skill_local[skill_name].skill_code, compute_embedding=False)
+
+        self.fill_missing_embeddings(self.skills)
+
+        # With the binary format, the json library is migrated to the store
+        self.store_skills_to_file(self.skill_store.path if self.skill_store is not None else file_path, skills)
+
+        return skills
+
+
+    def load_skills_from_store(self) -> Dict[str, Skill]:
+        """
+        Load skills from the binary skill library store.
+
+        Registered skills take their function from the scripts, other skills are compiled from their code on first
+        use. Only skills whose code changed, or that are new in the scripts, are embedded and appended to the store.
+        """
+
+        logger.write(f"Loading skills from {self.skill_store.path}")
+
+        stored_skills = self.skill_store.load()
+
+        skills = {}
+        regenerated_skills = []
+
+        for skill_name, stored_skill in stored_skills.items():
+
+            if skill_name in self.skill_registered.keys():
+                registered_skill = self.skill_registered[skill_name]
+                skill_code = registered_skill.skill_code
+                skill_function = registered_skill.skill_function
+            else:
+                skill_code = stored_skill.skill_code
+                skill_function = LazySkillFunction(skill_name, skill_code)
+
+            skill_code_base64 = base64.b64encode(skill_code.encode('utf-8')).decode('utf-8')
+
+            if hash_skill_code(skill_code) == stored_skill.code_hash:
+                logger.debug(f"No need to regenerate skill {skill_name}")
+                skill_embedding = stored_skill.skill_embedding
+            else: # skill_code has been modified, we should recompute embedding
+                logger.write(f"Regenerate skill {skill_name}")
+                skill_embedding = None
+
+            skills[skill_name] = Skill(skill_name,
+                                       skill_function,
+                                       skill_embedding,
+                                       skill_code,
+                                       skill_code_base64)
+
+            if skill_embedding is None:
+                regenerated_skills.append(skills[skill_name])
+
+        for skill_name, registered_skill in self.skill_registered.items():
+            if skill_name not in skills:
+                logger.write(f"Regenerate skill {skill_name}")
+                skills[skill_name] = Skill(skill_name,
+                                           registered_skill.skill_function,
+                                           None, # skill_embedding, computed below in one batch
+                                           registered_skill.skill_code,
+                                           base64.b64encode(registered_skill.skill_code.encode('utf-8')).decode('utf-8'))
+                regenerated_skills.append(skills[skill_name])
 
-        self.store_skills_to_file(file_path, skills)
+        self.fill_missing_embeddings(skills)
+        self.skill_store.append(regenerated_skills)
 
         return skills
 
@@ -178,11 +280,13 @@ class SkillRegistry():
                 logger.write(f"Regenerate skill {skill_name}")
                 skills[skill_name] = Skill(skill_name,
                                            self.skill_registered[skill_name].skill_function,
-                                           self.get_embedding(skill_name, inspect.getdoc(self.skill_registered[skill_name].skill_function)),
+                                           None, # skill_embedding, computed below in one batch
                                            self.skill_registered[skill_name].skill_code,
                                            skill_code_base64)
 
-        self.store_skills_to_file(os.path.join(config.skill_local_path, self.skill_library_filename), skills)
+        self.fill_missing_embeddings(skills)
+
+        self.store_skills(skills=skills)
 
         return skills
 
@@ -359,12 +463,14 @@ class SkillRegistry():
         time.sleep(2)
 
 
-    def register_skill_from_code(self, skill_code: str, overwrite = False) -> Tuple[bool, str]:
+    def register_skill_from_code(self, skill_code: str, overwrite = False, compute_embedding = True) -> Tuple[bool, str]:
         """Register the skill function from the code string.
 
         Args:
             skill_code: the code of skill.
             overwrite: the flag indicates whether to overwrite the skill with the same name or not.
+            compute_embedding: the flag indicates whether to embed the skill now. Callers registering many skills can
+                set it to False and embed them in one batch with fill_missing_embeddings.
 
         Returns:
             bool: the true value means that there is no problem in the skill_code. The false value means that we may need to re-generate it.
@@ -453,13 +559,18 @@ class SkillRegistry():
         skill_code_base64 = base64.b64encode(skill_code.encode('utf-8')).decode('utf-8')
         skill_ins = Skill(skill_name,
                           skill,
-                          self.get_embedding(skill_name, inspect.getdoc(skill)),
+                          self.get_embedding(skill_name, inspect.getdoc(skill)) if compute_embedding else None,
                           skill_code,
                           skill_code_base64)
 
         self.skills[skill_name] = skill_ins
         self.recent_skills.append(skill_name)
 
+        if compute_embedding:
+            self.add_skill_embedding(skill_name, skill_ins.skill_embedding)
+            if self.skill_store is not None:
+                self.skill_store.append([skill_ins])
+
         info = f"Skill '{skill_name}' has been registered."
         logger.write(info)
         return True, info
@@ -474,6 +585,7 @@ class SkillRegistry():
 
         if skill_name in self.skills:
             del self.skills[skill_name]
+            self.remove_skill_embedding(skill_name)
         if skill_name in self.recent_skills:
             position = self.recent_skills.index(skill_name)
             self.recent_skills.pop(position)
@@ -483,13 +595,9 @@ class SkillRegistry():
         skill_num = min(skill_num, len(self.skills))
         target_skills = [skill for skill in self.recent_skills]
 
-        task_emb = np.array(self.embedding_provider.embed_query(query_task))
-
-        sorted_skills = sorted(self.skills.items(), key=lambda x: -np.dot(x[1].skill_embedding, task_emb))
-
-        for skill in sorted_skills:
+        task_emb = self.get_query_embedding(query_task)
 
-            skill_name, skill = skill
+        for skill_name in self.rank_skills(task_emb, skill_num + len(target_skills)):
 
             if len(target_skills) >= skill_num:
                 break
@@ -510,6 +618,99 @@ class SkillRegistry():
         return target_skills
 
 
+    def get_query_embedding(self, query: str) -> np.ndarray:
+        """Embed a retrieval query, reusing the embedding of identical recent queries."""
+
+        if query in self.query_embedding_memo:
+            self.query_embedding_memo.move_to_end(query)
+            return self.query_embedding_memo[query]
+
+        # Queries are mostly one-off, so they are kept in the memo only, not in the persistent embedding cache
+        query_embedding = np.asarray(self.embedding_provider.embed_query(query), dtype=np.float32)
+
+        self.query_embedding_memo[query] = query_embedding
+        if len(self.query_embedding_memo) > QUERY_EMBEDDING_MEMO_SIZE:
+            self.query_embedding_memo.popitem(last=False)
+
+        return query_embedding
+
+
+    def rank_skills(self, query_embedding: np.ndarray, top_k: int) -> List[str]:
+        """Names of the top_k skills most similar to the query, most similar first, with one matrix-vector product."""
+
+        self.sync_embedding_matrix()
+
+        count = len(self.embedding_names)
+        top_k = min(top_k, count)
+        if top_k <= 0:
+            return []
+
+        scores = self.embedding_matrix[:count] @ np.asarray(query_embedding, dtype=np.float32)
+
+        if top_k < count:
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(count)
+
+        # Ties keep the registration order, like a stable sort over self.skills
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+
+        return [self.embedding_names[row] for row in order]
+
+
+    def sync_embedding_matrix(self) -> None:
+        """Rebuild the embedding matrix if self.skills was changed without going through the registry methods."""
+
+        if len(self.embedding_rows) == len(self.skills) and self.embedding_rows.keys() == self.skills.keys():
+            return
+
+        self.fill_missing_embeddings(self.skills)
+
+        self.embedding_names = []
+        self.embedding_rows = {}
+        self.embedding_matrix = np.zeros((0, 0), dtype=np.float32)
+
+        for skill_name, skill in self.skills.items():
+            self.add_skill_embedding(skill_name, skill.skill_embedding)
+
+
+    def add_skill_embedding(self, skill_name: str, skill_embedding: np.ndarray) -> None:
+
+        if skill_name in self.embedding_rows:
+            self.remove_skill_embedding(skill_name)
+
+        skill_embedding = np.asarray(skill_embedding, dtype=np.float32).reshape(-1)
+        count = len(self.embedding_names)
+
+        if count == 0 or self.embedding_matrix.shape[1] != skill_embedding.shape[0]:
+            if count > 0:
+                raise ValueError(f"Embedding of skill {skill_name} has dimension {skill_embedding.shape[0]}, expected {self.embedding_matrix.shape[1]}.")
+            self.embedding_matrix = np.zeros((max(len(self.skills), 16), skill_embedding.shape[0]), dtype=np.float32)
+        elif count == self.embedding_matrix.shape[0]:
+            grown_matrix = np.zeros((count * 2, self.embedding_matrix.shape[1]), dtype=np.float32)
+            grown_matrix[:count] = self.embedding_matrix
+            self.embedding_matrix = grown_matrix
+
+        self.embedding_matrix[count] = skill_embedding
+        self.embedding_rows[skill_name] = count
+        self.embedding_names.append(skill_name)
+
+
+    def remove_skill_embedding(self, skill_name: str) -> None:
+
+        row = self.embedding_rows.pop(skill_name, None)
+        if row is None:
+            return
+
+        # Shift the following rows up to keep the registration order
+        count = len(self.embedding_names)
+        self.embedding_matrix[row:count - 1] = self.embedding_matrix[row + 1:count]
+        self.embedding_names.pop(row)
+
+        for name in self.embedding_names[row:]:
+            self.embedding_rows[name] -= 1
+
+
     def register_available_skills(self, candidates:List[str]) -> None:
         for skill_key in candidates:
             if skill_key not in self.skills:
@@ -518,6 +719,7 @@ class SkillRegistry():
         for skill_key in list(self.skills.keys()):
             if skill_key not in candidates:
                 del self.skills[skill_key]
+                self.remove_skill_embedding(skill_key)
 
 
     def get_all_skills(self) -> List[str]:
@@ -533,5 +735,59 @@ class SkillRegistry():
     def store_skills_to_file(self,
                              file_path: str,
                              skills: Dict[str, Skill]) -> None:
+        """Store skills as a json file, or as a skill library store for a path ending with SKILL_LIB_STORE_SUFFIX."""
+
+        if file_path.endswith(constants.SKILL_LIB_STORE_SUFFIX):
+            if self.skill_store is not None and os.path.abspath(file_path) == os.path.abspath(self.skill_store.path):
+                skill_store = self.skill_store
+            else:
+                skill_store = SkillLibraryStore(file_path)
+            skill_store.write_all(skills)
+            return
+
         serialized_skills = serialize_skills(skills)
         save_json(file_path, serialized_skills, indent=4)
+
+
+    def store_skills(self, file_path: str = None, skills: Dict[str, Skill] = None) -> None:
+        """Store the skills to file_path, by default to the skill library store if enabled, else to the json file."""
+        if file_path is None:
+            if self.skill_store is not None:
+                file_path = self.skill_store.path
+            else:
+                file_path = os.path.join(config.skill_local_path, self.skill_library_filename)
+        self.store_skills_to_file(file_path, skills if skills is not None else self.skills)
+
+
+class LazySkillFunction():
+    # Stands for a skill function loaded from the skill library store, compiling its code on first use like
+    # convert_str_to_func does. inspect.getdoc and inspect.signature see the compiled function through
+    # __doc__ and __wrapped__, so unused skills are never compiled.
+
+    def __init__(self, skill_name: str, skill_code: str):
+        self.skill_name = skill_name
+        self.skill_code = skill_code
+        self._function = None
+
+
+    @property
+    def function(self):
+        if self._function is None:
+            namespace = {}
+            exec(self.skill_code, globals(), namespace)
+            self._function = namespace[self.skill_name]
+        return self._function
+
+
+    @property
+    def __wrapped__(self):
+        return self.function
+
+
+    @property
+    def __doc__(self):
+        return self.function.__doc__
+
+
+    def __call__(self, *args, **kwargs):
+        return self.function(*args, **kwargs)
@@ -1,10 +1,8 @@
 import time
 
-from PIL import Image
-import mss
-
 from cradle.config import Config
 from cradle.log import Logger
+from cradle.utils.frame_source import FrameSource
 from cradle.gameio.io_env import IOEnvironment
 from cradle import constants
 from cradle.environment import UIControl
@@ -83,25 +81,4 @@ class SkylinesUIControl(UIControl, metaclass=Singleton):
                         tid: float,
                         screen_region: tuple[int, int, int, int] = None) -> str:
 
-        if screen_region is None:
-            screen_region = config.env_region
-
-        region = screen_region
-        region = {
-            "left": region[0],
-            "top": region[1],
-            "width": region[2],
-            "height": region[3],
-        }
-
-        output_dir = config.work_dir
-
-        # Save screenshots
-        screen_image_filename = output_dir + "/screen_" + str(tid) + ".jpg"
-
-        with mss.mss() as sct:
-            screen_image = sct.grab(region)
-            image = Image.frombytes("RGB", screen_image.size, screen_image.bgra, "raw", "BGRX")
-            image.save(screen_image_filename)
-
-        return screen_image_filename
+        return FrameSource().grab(tid, screen_region).path
@@ -156,10 +156,10 @@ def cv_go_to_icon(
 
         logger.write(f'Go to icon iter #{step}')
 
-        if config.ocr_different_previous_text:
+        if config.ocr_text_changed.is_set():
             logger.write("The text is different from the previous one.")
             config.ocr_enabled = False # disable ocr
-            config.ocr_different_previous_text = False  # reset
+            config.ocr_text_changed.clear()  # reset
             break
 
         timestep = time.time()
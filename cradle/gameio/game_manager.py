@@ -8,6 +8,7 @@ from cradle.log import Logger
 from cradle.gameio import IOEnvironment
 from cradle.gameio.lifecycle.ui_control import check_active_window
 from cradle.utils.file_utils import assemble_project_path
+from cradle.utils.frame_source import FrameSource
 
 config = Config()
 logger = Logger()
@@ -172,10 +173,10 @@ class GameManager:
                 # Enable OCR for composite skills, start the ocr check
                 if skill_name in config.ocr_check_composite_skill_names:
                     if not config.ocr_fully_ban:
-                        config.ocr_different_previous_text = False
+                        config.ocr_text_changed.clear()
                         config.enable_ocr = True
                     else:
-                        config.ocr_different_previous_text = False
+                        config.ocr_text_changed.clear()
                         config.enable_ocr = False
 
                 skill_response = self.skill_registry.execute_skill(skill_name=skill_name, skill_params=skill_params)
@@ -217,6 +218,14 @@ class GameManager:
         return self.ui_control.take_screenshot(tid)
 
 
+    def capture_frame(self):
+        """Capture the environment as an in-memory FrameHandle, which can be used in place of a screenshot path."""
+        frame = FrameSource().grab(time.time())
+        if config.frame_source_keep_files:
+            frame.save_async()
+        return frame
+
+
     def get_mouse_position(self, absolute = False) -> Tuple[int, int]:
         return io_env.get_mouse_position(absolute)
 
@@ -13,6 +13,7 @@ from cradle.config import Config
 from cradle.gameio.gui_utils import TargetWindow, _get_active_window, check_window_conditions, is_top_level_window
 from cradle.log import Logger
 from cradle.gameio import IOEnvironment
+from cradle.utils.frame_source import FrameSource
 from cradle.utils.image_utils import draw_mouse_pointer_file_, crop_grow_image
 from cradle.utils.os_utils import getProcessIDByWindowHandle, getProcessNameByPID
 
@@ -167,29 +168,15 @@ def take_screenshot(tid: float,
                     draw_axis: bool = False,
                     crop_border: bool = False) -> Tuple[str, str]:
 
-    if screen_region is None:
-        screen_region = config.env_region
-
-    region = screen_region
-    region = {
-        "left": region[0],
-        "top": region[1],
-        "width": region[2],
-        "height": region[3],
-    }
-
     output_dir = config.work_dir
 
     # Save screenshots
-    screen_image_filename = output_dir + "/screen_" + str(tid) + ".jpg"
-
-    with mss.mss() as sct:
-        screen_image = sct.grab(region)
-        image = Image.frombytes("RGB", screen_image.size, screen_image.bgra, "raw", "BGRX")
-        image.save(screen_image_filename)
+    frame = FrameSource().grab(tid, screen_region)
+    screen_image_filename = frame.path
 
     if draw_axis:
         # Draw axis on the screenshot
+        screen_image = frame.to_image()
         draw = ImageDraw.Draw(screen_image)
         width, height = screen_image.size
         cx, cy = width // 2, height // 2
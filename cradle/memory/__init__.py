@@ -1,11 +1,16 @@
 from .base import BaseMemory
-from .vector_store import VectorStore
+from .vector_store import VectorStore, NumpyVectorStore
 from .basic_vector_memory import BasicVectorMemory
 from .local_memory import LocalMemory
+from .memory_log import MemoryLog
+from .embedding_cache import EmbeddingCache
 
 __all__ = [
     "VectorStore",
+    "NumpyVectorStore",
     "BaseMemory",
     "BasicVectorMemory",
-    "LocalMemory"
+    "LocalMemory",
+    "MemoryLog",
+    "EmbeddingCache"
 ]
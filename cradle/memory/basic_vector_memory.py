@@ -48,10 +48,11 @@ class BasicVectorMemory(BaseMemory):
         """
 
         keys: List[str] = list(data.keys())
-        embeddings = []
+
+        # All descriptions are embedded in one request, the vector store keeps the embeddings
+        embeddings = self.embedding_provider.embed_documents([data[k]["description"] for k in keys]) if len(keys) > 0 else []
 
         for k in keys:
-            embeddings.append(self.embedding_provider.embed_query(data[k]["description"]))
             instruction = data[k]["instruction"]
             screenshot = data[k]["screenshot"]
             timestep = data[k]["timestep"]
@@ -0,0 +1,170 @@
+import os
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils import Singleton
+from cradle.utils.file_utils import assemble_project_path
+
+config = Config()
+logger = Logger()
+
+
+class EmbeddingCache(metaclass=Singleton):
+    """
+    Persistent cache of text embeddings, keyed by embedding model and text hash.
+
+    Embeddings of one model are stored in the cache directory as float32 rows appended to a .f32 file, with their
+    text hashes appended to a .keys file, so a miss only writes the new rows. They are loaded on first use and shared
+    by all skill registries, across runs. Texts missing from the cache are embedded in a single embed_documents call.
+    The cache does not evict entries, so one-off texts such as retrieval queries should not go through it.
+    """
+
+    def __init__(self, cache_dir: str = None, enabled: bool = None):
+
+        self.enabled = enabled if enabled is not None else config.embedding_cache_enabled
+        self.cache_dir = assemble_project_path(cache_dir if cache_dir is not None else config.embedding_cache_dir)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._embeddings: Dict[str, Dict[str, np.ndarray]] = {} # model -> text hash -> embedding
+        self._dimensions: Dict[str, int] = {} # model -> dimension of the stored rows
+        self._lock = threading.Lock()
+
+
+    def embed_documents(self, embedding_provider: Any, texts: List[str]) -> List[np.ndarray]:
+        """Embed texts with the provider, only requesting the ones not cached yet, in one batch."""
+
+        if len(texts) == 0:
+            return []
+
+        model = self._get_model_name(embedding_provider)
+        keys = [hashlib.sha256(text.encode()).hexdigest() for text in texts]
+
+        with self._lock:
+            cached = self._get_model_cache(model)
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached and key not in missing:
+                    missing[key] = text
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if len(missing) > 0:
+            logger.debug(f"Embedding {len(missing)} of {len(texts)} texts with {model}")
+            embeddings = _embed_batch(embedding_provider, list(missing.values()))
+
+            with self._lock:
+                new_embeddings = {}
+                for key, embedding in zip(missing.keys(), embeddings):
+                    new_embeddings[key] = np.asarray(embedding, dtype=np.float32).reshape(-1)
+                cached.update(new_embeddings)
+                self._append(model, new_embeddings)
+
+        return [cached[key] for key in keys]
+
+
+    def embed_query(self, embedding_provider: Any, text: str) -> np.ndarray:
+        return self.embed_documents(embedding_provider, [text])[0]
+
+
+    def get_stats(self) -> Dict[str, int]:
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": sum([len(cached) for cached in self._embeddings.values()]),
+            }
+
+
+    def _get_model_name(self, embedding_provider: Any) -> str:
+
+        model = getattr(embedding_provider, "embedding_model", None)
+        if not model:
+            model = type(embedding_provider).__name__
+
+        return model
+
+
+    def _get_model_paths(self, model: str) -> Tuple[str, str]:
+        file_name = "".join([c if c.isalnum() or c in "-_." else "_" for c in model])
+        return os.path.join(self.cache_dir, f"{file_name}.keys"), os.path.join(self.cache_dir, f"{file_name}.f32")
+
+
+    def _get_model_cache(self, model: str) -> Dict[str, np.ndarray]:
+
+        if model in self._embeddings:
+            return self._embeddings[model]
+
+        cached = {}
+        keys_path, embeddings_path = self._get_model_paths(model)
+
+        if self.enabled and os.path.exists(keys_path) and os.path.exists(embeddings_path):
+            try:
+                with open(keys_path, "r", encoding="utf-8") as fp:
+                    lines = fp.read().split("\n")
+
+                # The first line holds the dimension, the last one is empty unless an append was torn
+                dimension = int(lines[0])
+                keys = lines[1:-1]
+
+                embeddings = np.fromfile(embeddings_path, dtype=np.float32)
+                count = min(len(keys), embeddings.shape[0] // dimension)
+                rows = embeddings[:count * dimension].reshape(count, dimension)
+
+                for key, embedding in zip(keys, rows):
+                    cached[key] = embedding
+
+                if lines[-1] == "" and len(keys) == count and embeddings.shape[0] == count * dimension:
+                    self._dimensions[model] = dimension
+                else:
+                    logger.warn(f"Embedding cache {keys_path} has a torn append, it will be rewritten")
+
+                logger.debug(f"Loaded {len(cached)} cached embeddings of {model}")
+            except (OSError, ValueError) as e:
+                logger.warn(f"Ignoring unreadable embedding cache {keys_path}: {e}")
+
+        self._embeddings[model] = cached
+        return cached
+
+
+    def _append(self, model: str, embeddings: Dict[str, np.ndarray]) -> None:
+
+        if not self.enabled or len(embeddings) == 0:
+            return
+
+        keys_path, embeddings_path = self._get_model_paths(model)
+        dimension = next(iter(embeddings.values())).shape[0]
+
+        if self._dimensions.get(model) != dimension:
+            # New or torn store, or the provider changed its dimension: the store is rewritten from the cache
+            Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+            with open(keys_path, "w", encoding="utf-8") as fp:
+                fp.write(f"{dimension}\n")
+            open(embeddings_path, "wb").close()
+
+            self._dimensions[model] = dimension
+            embeddings = {key: embedding for key, embedding in self._embeddings[model].items() if embedding.shape[0] == dimension}
+
+        rows = np.stack(list(embeddings.values()))
+
+        # Rows first, so the keys never get ahead of them if the process dies between the writes
+        with open(embeddings_path, "ab") as fp:
+            fp.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+        with open(keys_path, "a", encoding="utf-8") as fp:
+            fp.write("".join([f"{key}\n" for key in embeddings.keys()]))
+
+
+def _embed_batch(embedding_provider: Any, texts: List[str]) -> List[List[float]]:
+
+    if hasattr(embedding_provider, "embed_documents"):
+        return embedding_provider.embed_documents(texts)
+
+    return [embedding_provider.embed_query(text) for text in texts]
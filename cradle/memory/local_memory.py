@@ -11,7 +11,8 @@ from cradle.config import Config
 from cradle import constants
 from cradle.log import Logger
 from cradle.memory.base import BaseMemory, Image
-from cradle.utils.json_utils import load_json, save_json
+from cradle.memory.memory_log import MemoryLog, OP_APPEND, OP_SET, OP_SET_ITEM, OP_RESET
+from cradle.utils.json_utils import load_json, save_json, serialize_data
 from cradle.utils.singleton import Singleton
 
 config = Config()
@@ -58,6 +59,22 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             constants.SUCCESS_DETECTION: [],
             }
 
+        # Deltas of recent_history since the last save, written to the memory log
+        self._pending_deltas: List[Tuple[str, str, Any]] = []
+        # Last mutable entries of the buckets, as (key, entry, logged value), checked for in-place changes on save
+        self._logged_entries: List[Tuple[str, Any, Any]] = []
+        self.memory_log = None
+
+
+    def _record(self, op: str, key: str, value: Any) -> None:
+        if config.memory_log_enabled:
+            if op == OP_APPEND:
+                # Appended entries, e.g. the augmentation dicts, are still filled in during the turn, so they are
+                # converted when saved
+                self._pending_deltas.append((op, key, value))
+            else:
+                self._pending_deltas.append((op, key, serialize_data(value)))
+
 
     def add_recent_history_kv(
         self,
@@ -70,6 +87,7 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             self.recent_history[key] = []
 
         self.recent_history[key].append(info)
+        self._record(OP_APPEND, key, info)
 
         if len(self.recent_history[key]) > self.max_recent_steps:
             self.recent_history[key].pop(0)
@@ -85,6 +103,7 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             if key not in self.recent_history:
                 self.recent_history[key] = []
             self.recent_history[key].append(value)
+            self._record(OP_APPEND, key, value)
 
             if len(self.recent_history[key]) > self.max_recent_steps:
                 self.recent_history[key].pop(0)
@@ -114,6 +133,7 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
 
     def add_summarization(self, summary: str) -> None:
         self.recent_history[constants.SUMMARIZATION_MEM_BUCKET] = [summary]
+        self._record(OP_SET, constants.SUMMARIZATION_MEM_BUCKET, [summary])
 
 
     def get_summarization(self) -> str:
@@ -123,8 +143,11 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
     def add_task_guidance(self, task_description: str, long_horizon: bool) -> None:
         self.recent_history[constants.LAST_TASK_GUIDANCE] = task_description
         self.recent_history[constants.LAST_TASK_DURATION] = self.task_duration
+        self._record(OP_SET, constants.LAST_TASK_GUIDANCE, task_description)
+        self._record(OP_SET, constants.LAST_TASK_DURATION, self.task_duration)
         if long_horizon:
             self.recent_history['long_horizon_task'] = task_description
+            self._record(OP_SET, 'long_horizon_task', task_description)
 
 
     def get_task_guidance(self, use_last = True) -> str:
@@ -132,6 +155,7 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
             return self.recent_history[constants.LAST_TASK_GUIDANCE]
         else:
             self.recent_history[constants.LAST_TASK_DURATION] -= 1
+            self._record(OP_SET, constants.LAST_TASK_DURATION, self.recent_history[constants.LAST_TASK_DURATION])
             if self.recent_history[constants.LAST_TASK_DURATION] >= 0:
                 return self.recent_history[constants.LAST_TASK_GUIDANCE]
             else:
@@ -139,21 +163,112 @@ class LocalMemory(BaseMemory, metaclass=Singleton):
 
 
     def load(self, load_path=None) -> None:
-        """Load the memory from the local file."""
+        """
+        Load the memory from a local file, or from the directory of a previous run.
+
+        Directories are rebuilt from their memory log snapshot and deltas, falling back to their memory.json.
+        """
         # @TODO load and store whole memory
         if load_path != None:
-            if os.path.exists(os.path.join(load_path)):
+            if os.path.isdir(load_path):
+                recent_history = MemoryLog.rebuild(load_path, self.max_recent_steps)
+                if recent_history is None and os.path.exists(os.path.join(load_path, self.storage_filename)):
+                    recent_history = load_json(os.path.join(load_path, self.storage_filename))
+
+                if recent_history is None:
+                    logger.error(f"{load_path} has no memory to load.")
+                    return
+
+                self.recent_history = recent_history
+                self._record(OP_RESET, "", self.recent_history)
+                logger.write(f"{load_path} has been loaded.")
+            elif os.path.exists(os.path.join(load_path)):
                 self.recent_history = load_json(load_path)
+                self._record(OP_RESET, "", self.recent_history)
                 logger.write(f"{load_path} has been loaded.")
             else:
                 logger.error(f"{load_path} does not exist.")
 
 
     def save(self, local_path=None) -> None:
-        """Save the memory to the local file."""
+        """
+        Save the memory to the local file.
+
+        With config.memory_log_enabled, the deltas since the last save are appended to the memory log in the
+        background instead of rewriting memory.json, and local_path, e.g. a checkpoint, is written from the logged
+        state, also in the background.
+        """
         # @TODO load and store whole memory
-        if local_path:
+        if config.memory_log_enabled:
+            if self.memory_log is None:
+                self.memory_log = MemoryLog(self.memory_path, self.max_recent_steps, config.memory_snapshot_interval)
+                # The log starts from the whole current state, which already holds the deltas so far
+                self._pending_deltas = [(OP_RESET, "", self.recent_history)]
+                self._logged_entries = []
+
+            deltas = self._get_deltas()
+            if len(deltas) > 0:
+                self.memory_log.append(deltas)
+
+            if local_path:
+                self.memory_log.export(local_path)
+
+        elif local_path:
             save_json(file_path=local_path, json_dict=self.recent_history, indent=4)
         else:
             save_json(file_path=os.path.join(self.memory_path, self.storage_filename), json_dict=self.recent_history,
                       indent=4)
+
+
+    def _get_deltas(self) -> List[Tuple[str, str, Any]]:
+        """Convert the pending deltas, and add the entries logged by the last save that were changed since."""
+
+        deltas, logged_entries = [], []
+
+        for op, key, value in self._pending_deltas:
+            if op == OP_APPEND:
+                serialized = serialize_data(value)
+                deltas.append((op, key, serialized))
+                if isinstance(value, (dict, list)):
+                    logged_entries.append((key, value, serialized))
+            elif op == OP_RESET:
+                serialized = serialize_data(value)
+                deltas.append((op, key, serialized))
+                logged_entries.extend([(bucket_key, bucket[-1], serialized[bucket_key][-1])
+                                       for bucket_key, bucket in value.items()
+                                       if isinstance(bucket, list) and len(bucket) > 0 and isinstance(bucket[-1], (dict, list))])
+            else:
+                deltas.append((op, key, value))
+
+        # Entries can still be changed in place after the save that logged them, e.g. by a stage of the next turn
+        for key, entry, logged in self._logged_entries:
+            bucket = self.recent_history.get(key)
+            if not isinstance(bucket, list):
+                continue
+
+            positions = [i for i in range(len(bucket) - 1, -1, -1) if bucket[i] is entry]
+            if len(positions) == 0:
+                continue
+
+            serialized = serialize_data(entry)
+            if serialized != logged:
+                deltas.append((OP_SET_ITEM, key, [positions[0] - len(bucket), serialized]))
+
+            logged_entries.append((key, entry, serialized))
+
+        # Entries are checked until a newer one is added to their bucket
+        self._pending_deltas = []
+        self._logged_entries = [(key, entry, logged) for key, entry, logged in logged_entries
+                                if isinstance(self.recent_history.get(key), list)
+                                and len(self.recent_history[key]) > 0 and self.recent_history[key][-1] is entry]
+
+        return deltas
+
+
+    def close(self) -> None:
+        """Save the last deltas and wait for the memory log writes."""
+        if self.memory_log is not None:
+            self.save()
+            self.memory_log.close()
+            logger.write(f"Memory log: {self.memory_log.get_stats()}")
+            self.memory_log = None
@@ -0,0 +1,191 @@
+import os
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from cradle.log import Logger
+from cradle.utils.json_utils import load_json, save_json
+
+logger = Logger()
+
+OP_APPEND = "append" # append to a bucket, dropping the oldest entries over max_recent_steps
+OP_SET = "set" # replace a bucket
+OP_RESET = "reset" # replace the whole history, e.g. after loading a previous run
+OP_SET_ITEM = "set_item" # replace one entry of a bucket, the value is [negative index, entry]
+
+
+def apply_delta(state: Dict[str, Any], op: str, key: str, value: Any, max_recent_steps: int) -> None:
+    """Apply a logged delta to a recent history dict, as LocalMemory does."""
+
+    if op == OP_APPEND:
+        bucket = state.setdefault(key, [])
+        bucket.append(value)
+        if len(bucket) > max_recent_steps:
+            del bucket[:len(bucket) - max_recent_steps]
+    elif op == OP_SET:
+        state[key] = value
+    elif op == OP_SET_ITEM:
+        index, item = value
+        bucket = state.get(key, [])
+        if -len(bucket) <= index < 0:
+            bucket[index] = item
+    elif op == OP_RESET:
+        state.clear()
+        state.update(value)
+    else:
+        raise ValueError(f"Unknown memory log operation {op}.")
+
+
+class MemoryLog():
+    """
+    Append-only log of the recent history deltas of LocalMemory, compacted into snapshots in the background.
+
+    Each delta is one JSON line with a sequence number. Writes, and the replay of the deltas into the state kept
+    for compaction, happen on a single writer thread, so the agent loop only converts the new values. Every
+    snapshot_interval batches, the state is written to the snapshot file with the last sequence number it covers
+    and the log is truncated. rebuild() reads the snapshot and replays the deltas after it, skipping a torn last
+    line, so a crash between the snapshot and the truncation does not apply deltas twice.
+    """
+
+    snapshot_filename = "memory.snapshot.json"
+    log_filename = "memory.log.jsonl"
+
+    def __init__(self, log_dir: str, max_recent_steps: int, snapshot_interval: int = 20):
+
+        self.log_dir = log_dir
+        self.max_recent_steps = max_recent_steps
+        self.snapshot_interval = snapshot_interval
+
+        self.snapshot_path = os.path.join(log_dir, self.snapshot_filename)
+        self.log_path = os.path.join(log_dir, self.log_filename)
+
+        os.makedirs(log_dir, exist_ok=True)
+
+        self.stats = {
+            "deltas": 0,
+            "bytes": 0,
+            "snapshots": 0,
+        }
+
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory_log")
+        self._lock = threading.Lock()
+
+        # Continue the log of this directory, if any
+        self.state, self.seq = self.rebuild(log_dir, max_recent_steps, return_seq=True)
+
+        self.batches_since_snapshot = 0
+        self._log_file = open(self.log_path, mode="a", encoding="utf8")
+
+        if self.state is None:
+            self.state = {}
+        else:
+            # Start from a fresh snapshot, so new deltas are not appended after a torn line
+            self._compact()
+
+
+    def append(self, deltas: List[Tuple[str, str, Any]]) -> Future:
+        """Log a batch of (op, key, value) deltas in the background. Values must be JSON-serializable copies."""
+        return self._writer.submit(self._write_batch, deltas)
+
+
+    def export(self, path: str) -> Future:
+        """Write the logged state as a plain recent history JSON file, e.g. a checkpoint, in the background."""
+        return self._writer.submit(self._export, path)
+
+
+    def flush(self) -> None:
+        """Wait for the scheduled writes."""
+        self._writer.submit(lambda: None).result()
+
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.shutdown(wait=True)
+        self._log_file.close()
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+
+    @classmethod
+    def rebuild(cls, log_dir: str, max_recent_steps: int, return_seq: bool = False):
+        """
+        Rebuild the recent history from the snapshot and the log of a directory.
+
+        Returns:
+            The recent history, or None if the directory has neither, and the last sequence number if return_seq.
+        """
+
+        snapshot_path = os.path.join(log_dir, cls.snapshot_filename)
+        log_path = os.path.join(log_dir, cls.log_filename)
+
+        state, seq = None, 0
+
+        if os.path.exists(snapshot_path):
+            snapshot = load_json(snapshot_path)
+            state, seq = snapshot["recent_history"], snapshot["seq"]
+
+        if os.path.exists(log_path):
+            if state is None:
+                state = {}
+
+            with open(log_path, mode="r", encoding="utf8") as fp:
+                for line_number, line in enumerate(fp, 1):
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warn(f"Skipping the torn line {line_number} of {log_path}.")
+                        continue
+
+                    if record["seq"] <= seq:
+                        continue
+
+                    apply_delta(state, record["op"], record["key"], record["value"], max_recent_steps)
+                    seq = record["seq"]
+
+        return (state, seq) if return_seq else state
+
+
+    def _write_batch(self, deltas: List[Tuple[str, str, Any]]) -> None:
+
+        lines = []
+        for op, key, value in deltas:
+            self.seq += 1
+            apply_delta(self.state, op, key, value, self.max_recent_steps)
+            lines.append(json.dumps({"seq": self.seq, "op": op, "key": key, "value": value}, ensure_ascii=False))
+
+        data = "".join([line + "\n" for line in lines])
+        self._log_file.write(data)
+        self._log_file.flush()
+
+        with self._lock:
+            self.stats["deltas"] += len(deltas)
+            self.stats["bytes"] += len(data)
+
+        self.batches_since_snapshot += 1
+        if self.batches_since_snapshot >= self.snapshot_interval or any([op == OP_RESET for op, _, _ in deltas]):
+            self._compact()
+
+
+    def _compact(self) -> None:
+
+        tmp_path = self.snapshot_path + ".tmp"
+        save_json(file_path=tmp_path, json_dict={"seq": self.seq, "recent_history": self.state})
+        os.replace(tmp_path, self.snapshot_path)
+
+        # The snapshot covers every logged delta, so the log can start over
+        self._log_file.close()
+        self._log_file = open(self.log_path, mode="w", encoding="utf8")
+
+        self.batches_since_snapshot = 0
+        with self._lock:
+            self.stats["snapshots"] += 1
+
+        logger.debug(f"Memory log compacted into {self.snapshot_path} at delta {self.seq}")
+
+
+    def _export(self, path: str) -> None:
+        save_json(file_path=path, json_dict=self.state)
@@ -1,4 +1,6 @@
 import abc
+import os
+from pathlib import Path
 from typing import (
     Any,
     Iterable,
@@ -9,6 +11,15 @@ from typing import (
     Optional,
 )
 
+import numpy as np
+
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils.json_utils import load_json, save_json
+
+config = Config()
+logger = Logger()
+
 
 class VectorStore(abc.ABC):
     """Interface for vector store."""
@@ -53,3 +64,290 @@ class VectorStore(abc.ABC):
     @abc.abstractmethod
     def save(self, name: str) -> None:
         """Save FAISS index and index_to_key to disk."""
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector store on a contiguous float32 matrix of normalized embeddings, searched by cosine similarity.
+
+    Rows are appended to a matrix grown by doubling, deleted or re-added keys leave a tombstone that is dropped by
+    compaction once tombstones make up compact_ratio of the rows. Queries are searched exactly with one matrix
+    product per batch, or through an IVF index (k-means lists, nprobe of them searched per query) once there are
+    more than index_threshold live vectors. The store is saved as a .npy matrix and a json file of keys, and the
+    matrix is memory-mapped on load, so it is only paged in as it is searched.
+    """
+
+    embeddings_filename = "embeddings.npy"
+    keys_filename = "keys.json"
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        index_threshold: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        compact_ratio: float = 0.25,
+    ):
+        self.dim = dim
+        self.index_threshold = index_threshold if index_threshold is not None else config.vector_store_index_threshold
+        self.nprobe = nprobe if nprobe is not None else config.vector_store_nprobe
+        self.compact_ratio = compact_ratio
+
+        self.matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        self.row_count = 0
+        self.keys: List[Optional[str]] = [] # key of each row, None for tombstones
+        self.key_to_row: Dict[str, int] = {}
+        self.deleted = np.zeros(0, dtype=bool)
+
+        self.centroids = None
+        self.lists: List[np.ndarray] = [] # rows of each IVF list
+        self.indexed_count = 0
+
+
+    def __len__(self) -> int:
+        return len(self.key_to_row)
+
+
+    def add_embeddings(
+        self,
+        keys: List[str],
+        embeddings: Iterable[List[float]],
+        **kwargs: Any,
+    ) -> None:
+        """Add embeddings in one batch. Keys already in the store are replaced."""
+
+        embeddings = self._normalize(np.asarray(list(embeddings), dtype=np.float32))
+        if len(keys) != len(embeddings):
+            raise ValueError(f"Got {len(keys)} keys for {len(embeddings)} embeddings.")
+        if len(keys) == 0:
+            return
+
+        if len(set(keys)) != len(keys):
+            raise ValueError("Keys added in one batch must be unique.")
+
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embeddings have dimension {embeddings.shape[1]}, the store expects {self.dim}.")
+
+        self._delete_rows([self.key_to_row[key] for key in keys if key in self.key_to_row])
+
+        self._reserve(self.row_count + len(keys))
+
+        start = self.row_count
+        self.matrix[start:start + len(keys)] = embeddings
+        self.deleted[start:start + len(keys)] = False
+        for i, key in enumerate(keys):
+            self.keys.append(key)
+            self.key_to_row[key] = start + i
+        self.row_count += len(keys)
+
+        if self.centroids is not None:
+            self._assign_to_lists(np.arange(start, self.row_count))
+
+        self._maybe_compact()
+        self._maybe_build_index()
+
+
+    def delete(self, keys: List[str] = None, **kwargs: Any) -> bool:
+
+        if keys is None:
+            return False
+
+        self._delete_rows([self.key_to_row[key] for key in keys if key in self.key_to_row])
+        self._maybe_compact()
+
+        return True
+
+
+    def similarity_search(
+        self,
+        embedding: List[float],
+        top_k: int,
+        **kwargs: Any,
+    ) -> List[Tuple[str, float]]:
+        return self.batch_similarity_search([embedding], top_k)[0]
+
+
+    def batch_similarity_search(
+        self,
+        embeddings: Iterable[List[float]],
+        top_k: int,
+    ) -> List[List[Tuple[str, float]]]:
+        """Return the (key, cosine similarity) of the top_k most similar vectors for each query."""
+
+        queries = self._normalize(np.asarray(list(embeddings), dtype=np.float32))
+        if len(queries) == 0:
+            return []
+
+        if len(self) == 0 or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        if self.centroids is not None:
+            return [self._search_index(query, top_k) for query in queries]
+
+        scores = queries @ self.matrix[:self.row_count].T
+        scores[:, self.deleted[:self.row_count]] = -np.inf
+
+        return [self._top_k(rows_scores, np.arange(self.row_count), top_k) for rows_scores in scores]
+
+
+    def compact(self) -> None:
+        """Drop the tombstoned rows, keeping the order of the live ones."""
+
+        live = np.flatnonzero(~self.deleted[:self.row_count])
+
+        self.matrix = np.ascontiguousarray(self.matrix[live])
+        self.keys = [self.keys[row] for row in live]
+        self.key_to_row = {key: row for row, key in enumerate(self.keys)}
+        self.row_count = len(live)
+        self.deleted = np.zeros(self.row_count, dtype=bool)
+
+        if self.centroids is not None:
+            self._build_index()
+
+
+    def save(self, name: str) -> None:
+        """Save the store to the directory name."""
+
+        self.compact()
+
+        Path(name).mkdir(parents=True, exist_ok=True)
+
+        embeddings_path = os.path.join(name, self.embeddings_filename)
+        tmp_path = embeddings_path + ".tmp.npy"
+        np.save(tmp_path, self.matrix[:self.row_count])
+        os.replace(tmp_path, embeddings_path)
+
+        save_json(file_path=os.path.join(name, self.keys_filename), json_dict={"dim": self.dim, "keys": self.keys})
+
+
+    @classmethod
+    def load(cls, name: str, **kwargs: Any) -> "NumpyVectorStore":
+        """Load a store saved in the directory name, memory-mapping its matrix."""
+
+        meta = load_json(os.path.join(name, cls.keys_filename))
+
+        store = cls(dim=meta["dim"], **kwargs)
+        store.matrix = np.load(os.path.join(name, cls.embeddings_filename), mmap_mode="r")
+        store.keys = meta["keys"]
+        store.key_to_row = {key: row for row, key in enumerate(store.keys)}
+        store.row_count = len(store.keys)
+        store.deleted = np.zeros(store.row_count, dtype=bool)
+
+        store._maybe_build_index()
+
+        return store
+
+
+    def _normalize(self, embeddings: np.ndarray) -> np.ndarray:
+
+        if embeddings.size == 0:
+            # No vectors, not one empty vector
+            return embeddings.reshape(0, self.dim or 0)
+
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+
+        return embeddings / norms
+
+
+    def _reserve(self, row_count: int) -> None:
+
+        # A memory-mapped matrix is read-only, it is copied on the first add
+        if row_count <= len(self.matrix) and not isinstance(self.matrix, np.memmap):
+            return
+
+        capacity = max(row_count, 2 * len(self.matrix), 64)
+
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        if self.row_count > 0:
+            matrix[:self.row_count] = self.matrix[:self.row_count]
+        self.matrix = matrix
+
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[:self.row_count] = self.deleted[:self.row_count]
+        self.deleted = deleted
+
+
+    def _delete_rows(self, rows: List[int]) -> None:
+
+        for row in rows:
+            del self.key_to_row[self.keys[row]]
+            self.keys[row] = None
+            self.deleted[row] = True
+
+
+    def _maybe_compact(self) -> None:
+
+        tombstones = self.row_count - len(self)
+        if tombstones > 0 and tombstones >= self.compact_ratio * self.row_count:
+            self.compact()
+
+
+    def _maybe_build_index(self) -> None:
+
+        if len(self) < self.index_threshold:
+            self.centroids = None
+            self.lists = []
+        elif self.centroids is None or len(self) > 2 * self.indexed_count:
+            # The lists get unbalanced as vectors are added, so the index is rebuilt when the store doubled
+            self._build_index()
+
+
+    def _build_index(self, iterations: int = 10, seed: int = 0) -> None:
+
+        live = np.flatnonzero(~self.deleted[:self.row_count])
+        nlist = max(int(np.sqrt(len(live))), 1)
+
+        # k-means on a sample of the live vectors, spherical as the vectors are normalized
+        rng = np.random.default_rng(seed)
+        sample = self.matrix[rng.choice(live, size=min(len(live), 64 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = sample[assignment == i]
+                if len(members) > 0:
+                    centroids[i] = members.sum(axis=0)
+            centroids = self._normalize(centroids)
+
+        self.centroids = centroids.astype(np.float32)
+        self.lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self._assign_to_lists(live)
+        self.indexed_count = len(live)
+
+        logger.debug(f"Built an IVF index with {nlist} lists for {len(live)} vectors")
+
+
+    def _assign_to_lists(self, rows: np.ndarray, batch_size: int = 65536) -> None:
+
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            assignment = np.argmax(self.matrix[batch] @ self.centroids.T, axis=1)
+            for i in np.unique(assignment):
+                self.lists[i] = np.concatenate([self.lists[i], batch[assignment == i]])
+
+
+    def _search_index(self, query: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+
+        probes = np.argpartition(-(self.centroids @ query), min(self.nprobe, len(self.centroids)) - 1)[:self.nprobe]
+        rows = np.concatenate([self.lists[i] for i in probes])
+        rows = rows[~self.deleted[rows]]
+
+        return self._top_k(self.matrix[rows] @ query, rows, top_k)
+
+
+    def _top_k(self, scores: np.ndarray, rows: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return []
+
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+
+        return [(self.keys[rows[i]], float(scores[i])) for i in top if scores[i] != -np.inf]
@@ -71,14 +71,14 @@ class Executor(BaseProvider):
         mouse_x, mouse_y = self.gm.get_mouse_position()
 
         if config.is_game == True:
-            cur_screenshot_path = self.gm.capture_screen()
+            cur_screenshot_path = self.gm.capture_frame()
         else:
             # First, check if interaction left the target environment
             if not self.gm.check_active_window():
                 logger.warn(f"Target environment window is no longer active!")
                 cur_screenshot_path = self.gm.get_out_screen()
             else:
-                cur_screenshot_path = self.gm.capture_screen()
+                cur_screenshot_path = self.gm.capture_frame()
 
         end_frame_id = self.video_recorder.get_current_frame_id()
 
@@ -7,6 +7,7 @@ import re
 from cradle.config import Config
 from cradle.log import Logger
 from cradle.planner.base import BasePlanner
+from cradle.provider.llm.request_scheduler import RequestScheduler
 from cradle.utils.check import check_planner_params
 from cradle.utils.file_utils import assemble_project_path, read_resource_file
 from cradle.utils.json_utils import load_json, parse_semi_formatted_text, JsonFrameStructure
@@ -31,7 +32,7 @@ async def gather_information_get_completion_parallel(llm_provider, text_input_ma
     # Set the last frame path as the current frame path
     image_introduction[-1] = {
         "introduction": image_introduction[-1]["introduction"],
-        "path": f"{current_frame_path}",
+        "path": current_frame_path,
         "assistant": image_introduction[-1]["assistant"]
     }
     text_input["image_introduction"] = image_introduction
@@ -39,21 +40,14 @@ async def gather_information_get_completion_parallel(llm_provider, text_input_ma
 
     logger.debug(f'{logger.UPSTREAM_MASK}{json.dumps(message_prompts, ensure_ascii=False)}\n')
 
-    success_flag = False
-    while not success_flag:
-        try:
-            response, info = await llm_provider.create_completion_async(message_prompts)
-            logger.debug(f'{logger.DOWNSTREAM_MASK}{response}\n')
-
-            # Convert the response to dict
-            processed_response = parse_semi_formatted_text(response)
-            success_flag = True
-        except Exception as e:
-            logger.error(f"Response is not in the correct format: {e}, retrying...")
-            success_flag = False
-
-            # wait 2 seconds for the next request and retry
-            await asyncio.sleep(2)
+    try:
+        # Malformed responses are retried by the scheduler, like failed requests
+        (response, processed_response), info = await RequestScheduler().request(
+            llm_provider, message_prompts, postprocess=lambda response: (response, parse_semi_formatted_text(response)))
+        logger.debug(f'{logger.DOWNSTREAM_MASK}{response}\n')
+    except Exception as e:
+        logger.error(f"Failed to gather text information from the {i + 1}th frame: {e}")
+        return False
 
     # Convert the response to dict
     if processed_response is None or len(response) == 0:
@@ -79,7 +73,7 @@ def gather_information_get_completion_sequence(llm_provider, text_input_map, cur
     # Set the last frame path as the current frame path
     image_introduction[-1] = {
         "introduction": image_introduction[-1]["introduction"],
-        "path": f"{current_frame_path}",
+        "path": current_frame_path,
         "assistant": image_introduction[-1]["assistant"]
     }
     text_input["image_introduction"] = image_introduction
@@ -127,9 +121,6 @@ async def get_completion_in_parallel(llm_provider, text_input_map, extracted_fra
 
         tasks.append(task)
 
-        # wait 2 seconds for the next request
-        time.sleep(2)
-
     return await asyncio.gather(*tasks)
 
 
@@ -163,9 +154,6 @@ async def get_completion_in_parallel_tool(
 
         tasks.append(task)
 
-        # wait 2 seconds for the next request
-        time.sleep(2)
-
     return await asyncio.gather(*tasks)
 
 def get_completion_in_sequence(llm_provider, text_input_map, extracted_frame_paths, text_input, get_text_template,
@@ -273,23 +261,16 @@ class InformationGathering():
                     # Create completions in parallel
                     logger.write(f"Start gathering text information from the whole video in parallel")
 
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-
+                    # Requests are bounded and rate limited on the long-lived scheduler loop
+                    request_scheduler = RequestScheduler()
                     try:
-                        loop.run_until_complete(
+                        request_scheduler.run(
                             get_completion_in_parallel(self.llm_provider, self.text_input_map, extracted_frame_paths,
                                                        text_input,self.get_text_template,video_prefix,frame_extractor_gathered_information))
-
                     except KeyboardInterrupt:
+                        logger.warn("Gathering text information was interrupted, the pending requests were cancelled")
 
-                        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
-                        for task in tasks:
-                            task.cancel()
-
-                        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
-                    finally:
-                        loop.close()
+                    request_scheduler.log_stats()
 
                 else:
                     logger.write(f"Start gathering text information from the whole video in sequence")
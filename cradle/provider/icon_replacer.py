@@ -1,38 +1,86 @@
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
 
 import cv2
 import numpy as np
-from MTM import matchTemplates
 
 from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils import Singleton
+from cradle.utils.frame_source import FrameHandle
 
 config = Config()
+logger = Logger()
 
+TEMPLATE_SCALES = [0.9, 1, 1.1]
+MATCH_THRESHOLD = 0.75
 
-class IconReplacer:
 
-    def __init__(self, template_path = f'./res/{config.env_sub_path}/icons/keys'):
+class IconReplacer(metaclass=Singleton):
+    """
+    Replaces the key and mouse icons of the frames with text labels, to mitigate VLM issues reading them.
+
+    Templates are read and scaled once, when the replacer is created. Frames are processed in a thread pool, as
+    OpenCV releases the GIL while matching, and each frame is matched against the templates in order, on the image
+    with the previous labels drawn. Results are FrameHandles named icon_replace_<frame file>, whose JPEGs are
+    written in the background, so consumers can use the pixels without waiting for the files.
+    """
+
+    def __init__(self, template_path = f'./res/{config.env_sub_path}/icons/keys', max_workers: int = None):
 
         if '/-/' in template_path:
             template_path = f'./res/{config.env_sub_path}/icons/keys'
 
         self.template_paths = [os.path.join(template_path, filename) for filename in os.listdir(template_path)]
+        self.templates = [self._load_template(template_file) for template_file in self.template_paths]
+
+        self.max_workers = max_workers if max_workers is not None else config.icon_replacer_workers
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="icon_replacer")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="icon_replacer_writer")
+
+        self.stats = {
+            "frames": 0,
+            "seconds": 0.0,
+        }
+        self._lock = threading.Lock()
 
 
     def __call__(self, image_paths):
         return self.replace_icon(image_paths)
 
 
+    def _load_template(self, template_file: str) -> Tuple[str, List[np.ndarray]]:
+
+        template = cv2.imread(template_file)
+        template_name = os.path.splitext(os.path.basename(template_file))[0]
+
+        if 'left_mouse' in template_name:
+            template_name = 'LM'
+        elif 'right_mouse' in template_name:
+            template_name = 'RM'
+        elif 'mouse' in template_name:
+            template_name = 'MS'
+        elif 'enter' in template_name:
+            template_name = 'Ent'
+
+        scaled_templates = [cv2.resize(template, (round(template.shape[1] * s), round(template.shape[0] * s))) for s in TEMPLATE_SCALES]
+
+        return template_name, scaled_templates
+
+
     def _drawBoxesOnRGB(self, image, tableHit, boxThickness=2, boxColor=(255, 255, 00), showLabel=False, labelColor=(255, 255, 0), labelScale=0.5):
         """
-        Return a copy of the image with predicted template locations as bounding boxes overlaid on the image
+        Draw the predicted template locations as bounding boxes on the image, in place
         The name of the template can also be displayed on top of the bounding box with showLabel=True
 
         Parameters
         ----------
-        - image  : image in which the search was performed
+        - image  : image in which the search was performed, writable and not grayscale
 
-        - tableHit: list of hit as returned by matchTemplates or findMatches
+        - tableHit: list of hits as returned by _get_match
 
         - boxThickness: int
                         thickness of bounding box contour in pixels
@@ -50,13 +98,9 @@ class IconReplacer:
         outImage: RGB image
                 original image with predicted template locations depicted as bounding boxes
         """
-        # Convert Grayscale to RGB to be able to see the color bboxes
-        if image.ndim == 2:
-            outImage = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB) # convert to RGB to be able to show detections as color box on grayscale image
-        else:
-            outImage = image.copy()
+        outImage = image
 
-        for _, row in tableHit.iterrows():
+        for row in tableHit:
 
             x,y,w,h = row['BBox']
             text = row['TemplateName']
@@ -75,17 +119,23 @@ class IconReplacer:
         return outImage
 
 
-    def _get_mtm_match(self, image: np.ndarray, template: np.ndarray, template_name):
-        detection = matchTemplates([(template_name, cv2.resize(template, (round(template.shape[1] * s), round(template.shape[0] * s)))) for s in [0.9, 1, 1.1]],
-                                image,
-                                N_object=1,
-                                method=cv2.TM_CCOEFF_NORMED,
-                                maxOverlap=0.1)
+    def _get_match(self, image: np.ndarray, scaled_templates: List[np.ndarray], template_name: str) -> Dict[str, Any]:
+        """Best match over the template scales, as the single hit of MTM matchTemplates with N_object=1."""
+
+        best = None
+        for template in scaled_templates:
 
-        if detection['Score'].iloc[0] > 0.75:
-            image = self._drawBoxesOnRGB(image, detection, boxThickness=-1, showLabel=True, boxColor=(255, 255, 255), labelColor=(0, 0, 0), labelScale=.62)
+            height, width = template.shape[:2]
+            if height > image.shape[0] or width > image.shape[1]:
+                continue
 
-        return {'info': detection, 'vis': image}
+            corr_map = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(corr_map)
+
+            if best is None or max_val > best['Score']:
+                best = {'TemplateName': template_name, 'BBox': (max_loc[0], max_loc[1], width, height), 'Score': max_val}
+
+        return best
 
 
     def _show(self, image, window_name='screen',show=True,save=''):
@@ -98,35 +148,63 @@ class IconReplacer:
             cv2.destroyAllWindows()
 
 
-    # Image augmentation to mitigate VLM issues
-    def replace_icon(self, image_paths):
+    def _read_image(self, image_path) -> np.ndarray:
 
-        replaced_image_paths = []
+        if isinstance(image_path, FrameHandle):
+            return image_path.array.copy()
 
-        for image_path in image_paths:
-            image = cv2.imread(image_path)
+        return cv2.imread(image_path)
 
-            for template_file in self.template_paths:
-                template = cv2.imread(template_file)
-                template_name = os.path.splitext(os.path.basename(template_file))[0]
 
-                if 'left_mouse' in template_name:
-                    template_name = 'LM'
-                elif 'right_mouse' in template_name:
-                    template_name = 'RM'
-                elif 'mouse' in template_name:
-                    template_name = 'MS'
-                elif 'enter' in template_name:
-                    template_name = 'Ent'
+    def replace_frame(self, image: np.ndarray) -> np.ndarray:
+        """Replace the icons of a BGR image, in place."""
 
-                detection = self._get_mtm_match(image, template, template_name)
-                image = detection['vis']
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
 
-            directory, filename = os.path.split(image_path)
-            save_path = os.path.join(directory, "icon_replace_"+filename)
+        for template_name, scaled_templates in self.templates:
+            detection = self._get_match(image, scaled_templates, template_name)
 
-            self._show(image, save=save_path, show=False)
+            if detection is not None and detection['Score'] > MATCH_THRESHOLD:
+                self._drawBoxesOnRGB(image, [detection], boxThickness=-1, showLabel=True, boxColor=(255, 255, 255), labelColor=(0, 0, 0), labelScale=.62)
 
-            replaced_image_paths.append(save_path)
+        return image
+
+
+    def _replace_one(self, image_path) -> FrameHandle:
+
+        image = self.replace_frame(self._read_image(image_path))
+
+        directory, filename = os.path.split(str(image_path))
+        save_path = os.path.join(directory, "icon_replace_"+filename)
+
+        handle = FrameHandle(save_path, image, source="icon_replacer", writer=self._writer)
+        handle.save_async()
+
+        return handle
+
+
+    # Image augmentation to mitigate VLM issues
+    def replace_icon(self, image_paths) -> List[FrameHandle]:
+
+        start = time.perf_counter()
+
+        if len(image_paths) > 1 and self.max_workers > 1:
+            replaced_image_paths = list(self._pool.map(self._replace_one, image_paths))
+        else:
+            replaced_image_paths = [self._replace_one(image_path) for image_path in image_paths]
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.stats["frames"] += len(image_paths)
+            self.stats["seconds"] += elapsed
+
+        if len(image_paths) > 0:
+            logger.debug(f"Replaced icons in {len(image_paths)} frames in {elapsed:.3f}s, {len(image_paths) / max(elapsed, 1e-9):.1f} frames/s")
 
         return replaced_image_paths
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
@@ -14,6 +14,7 @@ import json
 import re
 import io
 import asyncio
+import time
 
 import backoff
 import tiktoken
@@ -28,8 +29,9 @@ from cradle.provider.base import LLMProvider, EmbeddingProvider
 from cradle.config import Config
 from cradle.log import Logger
 from cradle.utils.json_utils import load_json
-from cradle.utils.encoding_utils import encode_data_to_base64_path
 from cradle.utils.file_utils import assemble_project_path
+from cradle.provider.llm.completion_cache import CompletionCache
+from cradle.provider.llm.image_preprocessor import ImagePreprocessor
 
 config = Config()
 logger = Logger()
@@ -43,6 +45,8 @@ MAX_TOKENS = {
 PROVIDER_SETTING_KEY_VAR = "key_var"
 PROVIDER_SETTING_COMP_MODEL = "comp_model"
 
+IMAGE_MAX_DIMENSION = 1568 # longest image side the API accepts without downscaling it on its side
+
 
 class ClaudeProvider(LLMProvider):
     """A class that wraps a given model"""
@@ -72,10 +76,12 @@ class ClaudeProvider(LLMProvider):
             None
         """
         self.retries = 5
+        self.completion_cache = CompletionCache()
 
 
     def init_provider(self, provider_cfg ) -> None:
         self.provider_cfg = self._parse_config(provider_cfg)
+        self.image_preprocessor = ImagePreprocessor("Claude", self.provider_cfg, default_max_dimension=IMAGE_MAX_DIMENSION)
 
 
     def _parse_config(self, provider_cfg) -> dict:
@@ -138,6 +144,11 @@ class ClaudeProvider(LLMProvider):
         if model is None:
             model = self.llm_model
 
+        cache_key = self.completion_cache.make_key(messages, model, temperature, seed, max_tokens)
+        cached_completion = self.completion_cache.get(cache_key)
+        if cached_completion is not None:
+            return cached_completion
+
         if config.debug_mode:
             logger.debug(f"Creating chat completion with model {model}, temperature {temperature}, max_tokens {max_tokens}")
         else:
@@ -196,7 +207,8 @@ class ClaudeProvider(LLMProvider):
 
             return message, info
 
-        return _generate_response_with_retry(
+        request_start = time.perf_counter()
+        message, info = _generate_response_with_retry(
             messages,
             model,
             temperature,
@@ -204,6 +216,12 @@ class ClaudeProvider(LLMProvider):
             max_tokens,
         )
 
+        logger.write(f"{model} request latency: {time.perf_counter() - request_start:.2f}s")
+
+        self.completion_cache.put(cache_key, message, info, model=model)
+
+        return message, info
+
 
     async def create_completion_async(
             self,
@@ -217,6 +235,11 @@ class ClaudeProvider(LLMProvider):
         if model is None:
             model = self.llm_model
 
+        cache_key = self.completion_cache.make_key(messages, model, temperature, seed, max_tokens)
+        cached_completion = self.completion_cache.get(cache_key)
+        if cached_completion is not None:
+            return cached_completion
+
         if config.debug_mode:
             logger.debug(
                 f"Creating chat completion with model {model}, temperature {temperature}, max_tokens {max_tokens}")
@@ -270,7 +293,8 @@ class ClaudeProvider(LLMProvider):
 
             return message, info
 
-        return await _generate_response_with_retry_async(
+        request_start = time.perf_counter()
+        message, info = await _generate_response_with_retry_async(
             messages,
             model,
             temperature,
@@ -278,6 +302,12 @@ class ClaudeProvider(LLMProvider):
             max_tokens,
         )
 
+        logger.write(f"{model} request latency: {time.perf_counter() - request_start:.2f}s")
+
+        self.completion_cache.put(cache_key, message, info, model=model)
+
+        return message, info
+
 
     def num_tokens_from_messages(self, messages, model):
         """Return the number of tokens used by a list of messages.
@@ -337,6 +367,8 @@ class ClaudeProvider(LLMProvider):
         <image introduction>
         <user message part 2 after image introduction>
         """
+        self.image_preprocessor.start_request()
+
         pattern = re.compile(r"(.+?)(?=\n\n|$)", re.DOTALL)
 
         paragraphs = re.findall(pattern, template_str)
@@ -439,11 +471,9 @@ class ClaudeProvider(LLMProvider):
                     }
 
                     if path is not None and path != "":
-                        media_type = f"image/jpeg"
-                        encoded_images = encode_data_to_base64_path(path)
-
+                        encoded_images = self.image_preprocessor.encode(path)
 
-                        for encoded_image in encoded_images:
+                        for _, media_type, encoded_image in encoded_images:
                             msg_content = {
                                     "type": "image",
                                     "source":
@@ -511,6 +541,8 @@ class ClaudeProvider(LLMProvider):
         # merge messages with the same role
         messages = self._merge_messages(messages)
 
+        self.image_preprocessor.finish_request()
+
         return messages
 
 
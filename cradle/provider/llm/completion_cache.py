@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from cradle import constants
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils import Singleton
+from cradle.utils.file_utils import assemble_project_path
+
+config = Config()
+logger = Logger()
+
+ENTRY_SUFFIX = ".json"
+IMAGE_DATA_PREFIX = "data:"
+
+
+class CompletionCacheMissError(RuntimeError):
+    """Raised in replay mode when a request has no cached completion."""
+    pass
+
+
+class CompletionCache(metaclass=Singleton):
+    """
+    Content-addressed on-disk cache of LLM completions, shared by all LLM providers.
+
+    Each entry is a json file named after the hash of the request: model, messages, temperature, seed and max_tokens.
+    Encoded images in the messages are replaced by the hash of their data, so the key stays small and only changes
+    when the image content does. Entries are evicted least-recently-used first once the entry count or the total
+    size exceeds the configured limits. In replay mode, misses raise instead of reaching the network, which lets a
+    whole session be re-run offline with the responses recorded in a previous run.
+    """
+
+    def __init__(self,
+                 cache_dir: str = None,
+                 mode: str = None,
+                 max_entries: int = None,
+                 max_bytes: int = None):
+
+        self.mode = mode if mode is not None else config.completion_cache_mode
+        self.cache_dir = assemble_project_path(cache_dir if cache_dir is not None else config.completion_cache_dir)
+        self.max_entries = max_entries if max_entries is not None else config.completion_cache_max_entries
+        self.max_bytes = max_bytes if max_bytes is not None else config.completion_cache_max_bytes
+
+        if self.mode not in (constants.COMPLETION_CACHE_MODE_OFF,
+                             constants.COMPLETION_CACHE_MODE_READ_WRITE,
+                             constants.COMPLETION_CACHE_MODE_REPLAY):
+            raise ValueError(f"Unknown completion cache mode: {self.mode}")
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict() # key -> entry size in bytes, oldest first
+        self._total_bytes = 0
+
+        if self.enabled:
+            Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+            self._load_index()
+            logger.write(f"Completion cache in {self.mode} mode with {len(self._entries)} entries at {self.cache_dir}")
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != constants.COMPLETION_CACHE_MODE_OFF
+
+
+    @property
+    def replay_only(self) -> bool:
+        return self.mode == constants.COMPLETION_CACHE_MODE_REPLAY
+
+
+    def make_key(self,
+                 messages: List[Dict[str, Any]],
+                 model: str,
+                 temperature: float,
+                 seed: int = None,
+                 max_tokens: int = None) -> Optional[str]:
+        """Hash a request into a cache key. Returns None when the cache is off, so callers can skip all work."""
+
+        if not self.enabled:
+            return None
+
+        request = {
+            "model": model,
+            "messages": _hash_image_data(messages),
+            "temperature": temperature,
+            "seed": seed,
+            "max_tokens": max_tokens,
+        }
+
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+    def get(self, key: Optional[str]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Return the cached (message, info) for the key, or None on a miss.
+
+        Raises:
+            CompletionCacheMissError: on a miss in replay mode.
+        """
+
+        if key is None:
+            return None
+
+        entry = None
+        with self._lock:
+            if key in self._entries:
+                entry = self._read_entry(key)
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            if self.replay_only:
+                raise CompletionCacheMissError(f"No cached completion for request {key} in replay mode.")
+            return None
+
+        logger.debug(f"Completion cache hit for request {key} ({self.hits} hits, {self.misses} misses)")
+
+        return entry["message"], entry["info"]
+
+
+    def put(self, key: Optional[str], message: str, info: Dict[str, Any], model: str = None) -> None:
+
+        if key is None or self.replay_only:
+            return
+
+        entry = {
+            "model": model,
+            "message": message,
+            "info": info,
+            "created": time.time(),
+        }
+        data = json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8")
+
+        with self._lock:
+            path = self._entry_path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+
+            self._evict()
+
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+    def clear(self) -> None:
+
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._remove_entry(key)
+
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+
+    def _load_index(self) -> None:
+        """Rebuild the LRU order from the entry files, using their modification time as last access time."""
+
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(ENTRY_SUFFIX):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, file_name))
+            entries.append((stat.st_mtime, file_name[:-len(ENTRY_SUFFIX)], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+
+        with self._lock:
+            self._evict()
+
+
+    def _read_entry(self, key: str) -> Optional[Dict[str, Any]]:
+
+        path = self._entry_path(key)
+        try:
+            with open(path, mode="r", encoding="utf8") as fp:
+                entry = json.load(fp)
+            os.utime(path) # persist the access for the LRU order of the next run
+            return entry
+        except (OSError, ValueError) as e:
+            logger.warn(f"Dropping unreadable completion cache entry {key}: {e}")
+            self._remove_entry(key)
+            return None
+
+
+    def _remove_entry(self, key: str) -> None:
+
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+
+    def _evict(self) -> None:
+
+        while len(self._entries) > 0 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove_entry(oldest_key)
+
+
+def _hash_image_data(item: Any) -> Any:
+    """Copy the messages replacing inline encoded images, e.g. OpenAI data urls or Claude base64 sources, by their hash."""
+
+    if isinstance(item, dict):
+        normalized = {}
+        for key, value in item.items():
+            if key == "data" and isinstance(value, str) and item.get("type") == "base64":
+                value = "sha256:" + hashlib.sha256(value.encode()).hexdigest()
+            else:
+                value = _hash_image_data(value)
+            normalized[key] = value
+        return normalized
+    elif isinstance(item, (list, tuple)):
+        return [_hash_image_data(value) for value in item]
+    elif isinstance(item, str) and item.startswith(IMAGE_DATA_PREFIX):
+        return "sha256:" + hashlib.sha256(item.encode()).hexdigest()
+
+    return item
@@ -0,0 +1,158 @@
+import os
+import time
+import threading
+from typing import Any, Dict, List, Tuple
+
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils.encoding_utils import get_image_encoding_settings, get_image_transform, encode_data_to_base64_path
+from cradle.utils.file_utils import assemble_project_path
+
+config = Config()
+logger = Logger()
+
+PROVIDER_SETTING_IMAGE_MAX_DIMENSION = "image_max_dimension"
+PROVIDER_SETTING_IMAGE_FORMAT = "image_format"
+PROVIDER_SETTING_IMAGE_QUALITY = "image_quality"
+PROVIDER_SETTING_IMAGE_CROP_TO_ENV_REGION = "image_crop_to_env_region"
+
+
+class ImagePreprocessor():
+    """
+    Prepare the images of a prompt for upload to a vision LLM.
+
+    Images are cropped to the environment window when they are full-screen captures and the provider config asks
+    for it, downscaled to the max dimension the provider accepts without resizing on its side, and re-encoded to
+    the provider's format and quality. The scale is uniform, so SOM labels and the mouse pointer drawn on a
+    screenshot stay where they were relative to its content, and get_transform describes the mapping if needed.
+
+    Bytes sent, bytes saved and preprocessing time are logged for each assembled request.
+    """
+
+    def __init__(self, provider_name: str, provider_cfg: Dict[str, Any] = None, default_max_dimension: int = None):
+
+        provider_cfg = provider_cfg if provider_cfg is not None else {}
+
+        self.provider_name = provider_name
+        self.max_dimension = provider_cfg.get(PROVIDER_SETTING_IMAGE_MAX_DIMENSION, default_max_dimension)
+        self.image_format = provider_cfg.get(PROVIDER_SETTING_IMAGE_FORMAT, None)
+        self.quality = provider_cfg.get(PROVIDER_SETTING_IMAGE_QUALITY, None)
+        self.crop_to_env_region = provider_cfg.get(PROVIDER_SETTING_IMAGE_CROP_TO_ENV_REGION, False)
+
+        self.stats = {
+            "requests": 0,
+            "images": 0,
+            "sent_bytes": 0,
+            "saved_bytes": 0,
+            "seconds": 0.0,
+        }
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+
+    def get_encoding_settings(self) -> Tuple:
+
+        crop_region = None
+        env_region = getattr(config, "env_region", None)
+        screen_resolution = getattr(config, "screen_resolution", None)
+
+        if self.crop_to_env_region and env_region is not None and screen_resolution is not None:
+            left, top, width, height = env_region
+            crop_region = ((left, top, left + width, top + height), tuple(screen_resolution))
+
+        return get_image_encoding_settings(image_format=self.image_format,
+                                           quality=self.quality,
+                                           max_resolution=self.max_dimension,
+                                           crop_region=crop_region)
+
+
+    def start_request(self) -> None:
+        self._local.request_stats = {"images": 0, "sent_bytes": 0, "saved_bytes": 0, "seconds": 0.0}
+
+
+    def encode(self, data: Any) -> List[Tuple[str, str, str]]:
+        """
+        Preprocess and encode the images in data, which may be a path, an in-memory image or a list of them.
+
+        Returns:
+            A (data url, media type, base64 data) tuple per image.
+        """
+
+        start = time.perf_counter()
+
+        items = data if isinstance(data, list) else [data]
+        encoding_settings = self.get_encoding_settings()
+
+        encoded_images = []
+        sent_bytes = 0
+        saved_bytes = 0
+        for item in items:
+
+            item_images = []
+            for data_url in encode_data_to_base64_path(item, encoding_settings):
+                if not data_url.startswith("data:"):
+                    item_images.append((data_url, None, data_url))
+                    continue
+                header, encoded_data = data_url.split(",", 1)
+                media_type = header[len("data:"):].split(";")[0]
+                item_images.append((data_url, media_type, encoded_data))
+
+            item_bytes = sum([len(encoded_data) * 3 // 4 for _, media_type, encoded_data in item_images if media_type is not None])
+            sent_bytes += item_bytes
+
+            # Savings are only known for image files, in-memory images have no encoded size to compare to
+            if isinstance(item, str) and os.path.exists(assemble_project_path(item)):
+                saved_bytes += os.path.getsize(assemble_project_path(item)) - item_bytes
+
+            encoded_images.extend(item_images)
+
+        self._record(len(encoded_images), sent_bytes, saved_bytes, time.perf_counter() - start)
+
+        return encoded_images
+
+
+    def finish_request(self) -> Dict[str, Any]:
+        """Log and return the metrics of the images of the request assembled since start_request."""
+
+        request_stats = getattr(self._local, "request_stats", None)
+        if request_stats is None or request_stats["images"] == 0:
+            return {}
+
+        self._local.request_stats = None
+
+        with self._lock:
+            self.stats["requests"] += 1
+
+        logger.write(f'{self.provider_name} request images: {request_stats["images"]}, '
+                     f'sent {request_stats["sent_bytes"] / 1024:.1f} KiB, '
+                     f'saved {request_stats["saved_bytes"] / 1024:.1f} KiB from image files, '
+                     f'preprocessing {request_stats["seconds"] * 1000:.1f} ms')
+
+        return request_stats
+
+
+    def get_transform(self, image_size: Tuple[int, int]) -> Dict[str, Any]:
+        return get_image_transform(image_size, self.get_encoding_settings())
+
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            return dict(self.stats)
+
+
+    def _record(self, images: int, sent_bytes: int, saved_bytes: int, seconds: float) -> None:
+
+        request_stats = getattr(self._local, "request_stats", None)
+        if request_stats is not None:
+            request_stats["images"] += images
+            request_stats["sent_bytes"] += sent_bytes
+            request_stats["saved_bytes"] += saved_bytes
+            request_stats["seconds"] += seconds
+
+        with self._lock:
+            self.stats["images"] += images
+            self.stats["sent_bytes"] += sent_bytes
+            self.stats["saved_bytes"] += saved_bytes
+            self.stats["seconds"] += seconds
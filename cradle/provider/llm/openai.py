@@ -13,19 +13,21 @@ from typing import (
 import json
 import re
 import asyncio
+import time
 
 import backoff
 import tiktoken
 import numpy as np
-from openai import OpenAI, AzureOpenAI, APIError, RateLimitError, APITimeoutError
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI, APIError, RateLimitError, APITimeoutError
 
 from cradle import constants
 from cradle.provider.base import LLMProvider, EmbeddingProvider
 from cradle.config import Config
 from cradle.log import Logger
 from cradle.utils.json_utils import load_json
-from cradle.utils.encoding_utils import encode_data_to_base64_path
 from cradle.utils.file_utils import assemble_project_path
+from cradle.provider.llm.completion_cache import CompletionCache
+from cradle.provider.llm.image_preprocessor import ImagePreprocessor
 
 config = Config()
 logger = Logger()
@@ -44,6 +46,8 @@ PROVIDER_SETTING_BASE_VAR = "base_var"       # Azure-speficic setting
 PROVIDER_SETTING_API_VERSION = "api_version" # Azure-speficic setting
 PROVIDER_SETTING_DEPLOYMENT_MAP = "models"   # Azure-speficic setting
 
+IMAGE_MAX_DIMENSION = 2048 # longest image side the API accepts without downscaling it on its side
+
 
 class OpenAIProvider(LLMProvider, EmbeddingProvider):
     """A class that wraps a given model"""
@@ -73,10 +77,12 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
             None
         """
         self.retries = 5
+        self.completion_cache = CompletionCache()
 
 
     def init_provider(self, provider_cfg ) -> None:
         self.provider_cfg = self._parse_config(provider_cfg)
+        self.image_preprocessor = ImagePreprocessor("OpenAI", self.provider_cfg, default_max_dimension=IMAGE_MAX_DIMENSION)
 
 
     def _parse_config(self, provider_cfg) -> dict:
@@ -98,14 +104,19 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
             endpoint_var_name = conf_dict[PROVIDER_SETTING_BASE_VAR]
             endpoint = os.getenv(endpoint_var_name)
 
-            self.client = AzureOpenAI(
-                api_key = key,
-                api_version = conf_dict[PROVIDER_SETTING_API_VERSION],
-                azure_endpoint = endpoint
-            )
+            self.client_kwargs = {
+                "api_key": key,
+                "api_version": conf_dict[PROVIDER_SETTING_API_VERSION],
+                "azure_endpoint": endpoint,
+            }
+            self.client = AzureOpenAI(**self.client_kwargs)
         else:
             key = os.getenv(key_var_name)
-            self.client = OpenAI(api_key=key)
+            self.client_kwargs = {"api_key": key}
+            self.client = OpenAI(**self.client_kwargs)
+
+        self._async_client = None
+        self._async_loop = None
 
         self.embedding_model = conf_dict[PROVIDER_SETTING_EMB_MODEL]
         self.llm_model = conf_dict[PROVIDER_SETTING_COMP_MODEL]
@@ -293,6 +304,11 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         if model is None:
             model = self.llm_model
 
+        cache_key = self.completion_cache.make_key(messages, model, temperature, seed, max_tokens)
+        cached_completion = self.completion_cache.get(cache_key)
+        if cached_completion is not None:
+            return cached_completion
+
         if config.debug_mode:
             logger.debug(f"Creating chat completion with model {model}, temperature {temperature}, max_tokens {max_tokens}")
         else:
@@ -346,7 +362,8 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
 
             return message, info
 
-        return _generate_response_with_retry(
+        request_start = time.perf_counter()
+        message, info = _generate_response_with_retry(
             messages,
             model,
             temperature,
@@ -354,6 +371,12 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
             max_tokens,
         )
 
+        logger.write(f"{model} request latency: {time.perf_counter() - request_start:.2f}s")
+
+        self.completion_cache.put(cache_key, message, info, model=model)
+
+        return message, info
+
     async def create_completion_async(
             self,
             messages: List[Dict[str, str]],
@@ -366,6 +389,11 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         if model is None:
             model = self.llm_model
 
+        cache_key = self.completion_cache.make_key(messages, model, temperature, seed, max_tokens)
+        cached_completion = self.completion_cache.get(cache_key)
+        if cached_completion is not None:
+            return cached_completion
+
         if config.debug_mode:
             logger.debug(
                 f"Creating chat completion with model {model}, temperature {temperature}, max_tokens {max_tokens}")
@@ -390,24 +418,13 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         ) -> Tuple[str, Dict[str, int]]:
 
             """Send a request to the OpenAI API."""
-            if self.provider_cfg[PROVIDER_SETTING_IS_AZURE]:
-                response = await asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    seed=seed,
-                    max_tokens=max_tokens,
-                )
-            else:
-                response = await asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    seed=seed,
-                    max_tokens=max_tokens,
-                )
+            response = await self._get_async_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                seed=seed,
+                max_tokens=max_tokens,
+            )
 
             if response is None:
                 logger.error("Failed to get a response from OpenAI. Try again.")
@@ -426,7 +443,8 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
 
             return message, info
 
-        return await _generate_response_with_retry_async(
+        request_start = time.perf_counter()
+        message, info = await _generate_response_with_retry_async(
             messages,
             model,
             temperature,
@@ -434,6 +452,26 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
             max_tokens,
         )
 
+        logger.write(f"{model} request latency: {time.perf_counter() - request_start:.2f}s")
+
+        self.completion_cache.put(cache_key, message, info, model=model)
+
+        return message, info
+
+
+    def _get_async_client(self):
+
+        # Async clients hold connections bound to the event loop they were first used in
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            if self.provider_cfg[PROVIDER_SETTING_IS_AZURE]:
+                self._async_client = AsyncAzureOpenAI(**self.client_kwargs)
+            else:
+                self._async_client = AsyncOpenAI(**self.client_kwargs)
+            self._async_loop = loop
+
+        return self._async_client
+
 
     def num_tokens_from_messages(self, messages, model):
         """Return the number of tokens used by a list of messages.
@@ -497,6 +535,8 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
         <image introduction>
         <user message part 2 after image introduction>
         """
+        self.image_preprocessor.start_request()
+
         pattern = re.compile(r"(.+?)(?=\n\n|$)", re.DOTALL)
 
         paragraphs = re.findall(pattern, template_str)
@@ -609,9 +649,9 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
                         })
 
                 if path is not None and path != "":
-                    encoded_images = encode_data_to_base64_path(path)
+                    encoded_images = self.image_preprocessor.encode(path)
 
-                    for encoded_image in encoded_images:
+                    for encoded_image, _, _ in encoded_images:
                         msg_content = {
                                 "type": "image_url",
                                 "image_url":
@@ -682,6 +722,8 @@ class OpenAIProvider(LLMProvider, EmbeddingProvider):
             ]
         }
 
+        self.image_preprocessor.finish_request()
+
         if user_messages_part1 is None:
             return [system_message] + image_introduction_messages + [user_messages_part2]
         else:
@@ -0,0 +1,341 @@
+import asyncio
+import bisect
+import random
+import threading
+import time
+import weakref
+from typing import Any, Callable, Coroutine, Dict, List, Tuple
+
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils import Singleton
+
+config = Config()
+logger = Logger()
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 20, 30, 60, 120]
+
+# Rough image cost for the token budget, the tokens of a 1024x1024 high detail image
+IMAGE_TOKEN_ESTIMATE = 765
+CHARS_PER_TOKEN = 4
+
+PROVIDER_SETTING_RPM_LIMIT = "rpm_limit"
+PROVIDER_SETTING_TPM_LIMIT = "tpm_limit"
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]], max_tokens: int = 0) -> int:
+    """Estimate the tokens a request counts against a TPM limit: prompt text, images and the completion budget."""
+
+    tokens = max_tokens
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            tokens += len(content) // CHARS_PER_TOKEN
+            continue
+
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+            else:
+                tokens += IMAGE_TOKEN_ESTIMATE
+
+    return tokens
+
+
+class TokenBucket():
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most one minute of tokens.
+
+    Buckets are shared by the requests of a provider on every loop, so the tokens are updated under a lock, which is
+    never held while waiting. A None rate means no limit.
+    """
+
+    def __init__(self, rate_per_minute: float = None):
+
+        self.rate_per_minute = rate_per_minute
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+        self._lock = threading.Lock()
+
+
+    def _refill(self) -> None:
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_minute / 60)
+        self.updated = now
+
+
+    async def acquire(self, amount: float = 1) -> float:
+        """Wait until amount tokens are available and take them. Return the seconds waited."""
+
+        if self.rate_per_minute is None:
+            return 0.0
+
+        # Requests larger than the bucket would never fit, they wait for a full bucket instead
+        amount = min(amount, self.capacity)
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+
+                wait = (amount - self.tokens) * 60 / self.rate_per_minute
+
+            await asyncio.sleep(wait)
+            waited += wait
+
+
+    def adjust(self, amount: float) -> None:
+        """Give back (negative amount) or take more tokens once the real usage of a request is known."""
+
+        if self.rate_per_minute is None:
+            return
+
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class LatencyHistogram():
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def record(self, seconds: float) -> None:
+
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the percentile, or the max latency for the last bucket."""
+
+        if self.count == 0:
+            return 0.0
+
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+
+        return self.max
+
+
+    def summary(self) -> Dict[str, Any]:
+
+        labels = [f"<={bound}s" for bound in self.buckets] + [f">{self.buckets[-1]}s"]
+
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class RequestScheduler(metaclass=Singleton):
+    """
+    Schedules concurrent LLM requests, such as the per-frame information gathering fan-out, on a long-lived loop.
+
+    The loop runs in a daemon thread, so provider async clients and their connections survive between calls.
+    request() can also be awaited on other loops. In-flight requests are bounded by config.llm_max_concurrent_requests
+    per loop, and each provider gets RPM and TPM token buckets, shared across loops, from the "rpm_limit" and
+    "tpm_limit" of its config, or config.llm_rpm_limit and config.llm_tpm_limit. Failed requests are retried up to
+    config.llm_request_max_retries times, with exponential backoff and full jitter. Latencies are kept in a histogram
+    per provider and model.
+    """
+
+    def __init__(self):
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="request_scheduler", daemon=True)
+        self._thread.start()
+
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._buckets: Dict[int, Tuple[TokenBucket, TokenBucket]] = {}
+
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "cancelled": 0,
+            "rate_limited_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+    def run(self, coroutine: Coroutine) -> Any:
+        """
+        Run a coroutine on the scheduler loop and wait for its result.
+
+        On KeyboardInterrupt, the coroutine and its pending requests are cancelled before the interrupt is raised
+        again. The loop keeps running for the next calls.
+        """
+
+        done = threading.Event()
+
+        async def run_until_done():
+            try:
+                return await coroutine
+            finally:
+                done.set()
+
+        future = asyncio.run_coroutine_threadsafe(run_until_done(), self.loop)
+
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            future.cancel()
+            # Wait for the cancelled requests to unwind, bounded so a second interrupt is not needed
+            done.wait(timeout=5)
+            raise
+
+
+    async def request(self,
+                      llm_provider: Any,
+                      messages: List[Dict[str, Any]],
+                      postprocess: Callable[[str], Any] = None,
+                      max_tokens: int = None) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Send one completion request, waiting for a concurrency slot and the provider rate limits.
+
+        Args:
+            llm_provider: Provider with create_completion_async.
+            messages: The assembled prompt.
+            postprocess: Applied to the response inside the retry loop, so malformed responses are retried too.
+            max_tokens: Completion budget of the provider, counted against the TPM limit. Defaults to config.max_tokens.
+
+        Returns:
+            The (postprocessed) response and the provider info. Raises the last error once retries are exhausted.
+        """
+
+        semaphore = self._get_semaphore()
+
+        if max_tokens is None:
+            max_tokens = config.max_tokens
+
+        rpm_bucket, tpm_bucket = self._get_buckets(llm_provider)
+        estimated_tokens = estimate_message_tokens(messages, max_tokens)
+        histogram = self._get_histogram(llm_provider)
+
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    waited = await rpm_bucket.acquire(1)
+                    waited += await tpm_bucket.acquire(estimated_tokens)
+
+                    start = time.perf_counter()
+                    response, info = await llm_provider.create_completion_async(messages)
+                    histogram.record(time.perf_counter() - start)
+
+                # Charge the real usage when the provider reports it
+                if isinstance(info, dict) and "total_tokens" in info:
+                    tpm_bucket.adjust(info["total_tokens"] - estimated_tokens)
+
+                result = postprocess(response) if postprocess is not None else response
+
+                with self._lock:
+                    self.stats["requests"] += 1
+                    self.stats["rate_limited_seconds"] += waited
+
+                return result, info
+
+            except asyncio.CancelledError:
+                with self._lock:
+                    self.stats["cancelled"] += 1
+                raise
+
+            except Exception as e:
+                attempt += 1
+                if attempt > config.llm_request_max_retries:
+                    with self._lock:
+                        self.stats["failures"] += 1
+                    logger.error(f"Request failed after {attempt} attempts: {e}")
+                    raise
+
+                delay = random.uniform(0, min(config.llm_retry_max_delay, config.llm_retry_base_delay * 2 ** (attempt - 1)))
+                with self._lock:
+                    self.stats["retries"] += 1
+                logger.warn(f"Request failed: {e}, retrying in {delay:.2f}s ({attempt}/{config.llm_request_max_retries})")
+
+                await asyncio.sleep(delay)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+
+        with self._lock:
+            stats = dict(self.stats)
+        stats["latency"] = {label: histogram.summary() for label, histogram in self.histograms.items()}
+
+        return stats
+
+
+    def log_stats(self) -> None:
+
+        stats = self.get_stats()
+        logger.write(f'Request scheduler: {stats["requests"]} requests, {stats["retries"]} retries, '
+                     f'{stats["failures"]} failures, {stats["cancelled"]} cancelled, '
+                     f'{stats["rate_limited_seconds"]:.2f}s waiting for rate limits')
+
+        for label, summary in stats["latency"].items():
+            logger.write(f'  {label} latency: mean {summary["mean"]:.2f}s, p50 {summary["p50"]}s, '
+                         f'p90 {summary["p90"]}s, p99 {summary["p99"]}s, max {summary["max"]:.2f}s')
+
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+
+        # Semaphores are bound to the loop they are first used in
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._semaphores:
+                self._semaphores[loop] = asyncio.Semaphore(config.llm_max_concurrent_requests)
+            return self._semaphores[loop]
+
+
+    def _get_buckets(self, llm_provider: Any) -> Tuple[TokenBucket, TokenBucket]:
+
+        key = id(llm_provider)
+        with self._lock:
+            if key not in self._buckets:
+                provider_cfg = getattr(llm_provider, "provider_cfg", None) or {}
+                rpm_limit = provider_cfg.get(PROVIDER_SETTING_RPM_LIMIT, config.llm_rpm_limit)
+                tpm_limit = provider_cfg.get(PROVIDER_SETTING_TPM_LIMIT, config.llm_tpm_limit)
+
+                self._buckets[key] = (TokenBucket(rpm_limit), TokenBucket(tpm_limit))
+
+            return self._buckets[key]
+
+
+    def _get_histogram(self, llm_provider: Any) -> LatencyHistogram:
+
+        label = f"{llm_provider.__class__.__name__}:{getattr(llm_provider, 'llm_model', '')}"
+        with self._lock:
+            if label not in self.histograms:
+                self.histograms[label] = LatencyHistogram()
+            return self.histograms[label]
@@ -14,6 +14,7 @@ import json
 import re
 import io
 import asyncio
+import time
 
 import backoff
 import tiktoken
@@ -27,7 +28,8 @@ from cradle.config import Config
 from cradle.log import Logger
 from cradle.utils.json_utils import load_json
 from cradle.utils.file_utils import assemble_project_path
-from cradle.utils.encoding_utils import encode_data_to_base64_path
+from cradle.provider.llm.completion_cache import CompletionCache
+from cradle.provider.llm.image_preprocessor import ImagePreprocessor
 from cradle.provider.llm.restful_claude_client import RestfulClaudeClient
 
 config = Config()
@@ -43,6 +45,8 @@ PROVIDER_SETTING_AK = "ak_var"
 PROVIDER_SETTING_SK = "sk_var"
 PROVIDER_SETTING_COMP_MODEL = "comp_model"
 
+IMAGE_MAX_DIMENSION = 1568 # longest image side the API accepts without downscaling it on its side
+
 
 class RestfulClaudeProvider(LLMProvider):
     """A class that wraps a given model"""
@@ -70,10 +74,12 @@ class RestfulClaudeProvider(LLMProvider):
             None
         """
         self.retries = 5
+        self.completion_cache = CompletionCache()
 
 
     def init_provider(self, provider_cfg ) -> None:
         self.provider_cfg = self._parse_config(provider_cfg)
+        self.image_preprocessor = ImagePreprocessor("RestfulClaude", self.provider_cfg, default_max_dimension=IMAGE_MAX_DIMENSION)
 
 
     def _parse_config(self, provider_cfg) -> dict:
@@ -137,6 +143,11 @@ class RestfulClaudeProvider(LLMProvider):
         if model is None:
             model = self.llm_model
 
+        cache_key = self.completion_cache.make_key(messages, model, temperature, seed, max_tokens)
+        cached_completion = self.completion_cache.get(cache_key)
+        if cached_completion is not None:
+            return cached_completion
+
         if config.debug_mode:
             logger.debug(f"Creating chat completion with model {model}, temperature {temperature}, max_tokens {max_tokens}")
         else:
@@ -190,7 +201,8 @@ class RestfulClaudeProvider(LLMProvider):
 
             return message, info
 
-        return _generate_response_with_retry(
+        request_start = time.perf_counter()
+        message, info = _generate_response_with_retry(
             messages,
             model,
             temperature,
@@ -198,6 +210,12 @@ class RestfulClaudeProvider(LLMProvider):
             max_tokens,
         )
 
+        logger.write(f"{model} request latency: {time.perf_counter() - request_start:.2f}s")
+
+        self.completion_cache.put(cache_key, message, info, model=model)
+
+        return message, info
+
 
     async def create_completion_async(
             self,
@@ -211,6 +229,11 @@ class RestfulClaudeProvider(LLMProvider):
         if model is None:
             model = self.llm_model
 
+        cache_key = self.completion_cache.make_key(messages, model, temperature, seed, max_tokens)
+        cached_completion = self.completion_cache.get(cache_key)
+        if cached_completion is not None:
+            return cached_completion
+
         if config.debug_mode:
             logger.debug(
                 f"Creating chat completion with model {model}, temperature {temperature}, max_tokens {max_tokens}")
@@ -239,7 +262,7 @@ class RestfulClaudeProvider(LLMProvider):
                     break
 
             """Send a request to the Claude API."""
-            response = self.client.create(
+            response = await self.client.create_async(
                            messages=messages,
                            system=system_content,
                            temperature=temperature,
@@ -260,7 +283,8 @@ class RestfulClaudeProvider(LLMProvider):
 
             return message, info
 
-        return await _generate_response_with_retry_async(
+        request_start = time.perf_counter()
+        message, info = await _generate_response_with_retry_async(
             messages,
             model,
             temperature,
@@ -268,6 +292,12 @@ class RestfulClaudeProvider(LLMProvider):
             max_tokens,
         )
 
+        logger.write(f"{model} request latency: {time.perf_counter() - request_start:.2f}s")
+
+        self.completion_cache.put(cache_key, message, info, model=model)
+
+        return message, info
+
 
     def num_tokens_from_messages(self, messages, model):
         """Return the number of tokens used by a list of messages.
@@ -326,6 +356,8 @@ class RestfulClaudeProvider(LLMProvider):
         <image introduction>
         <user message part 2 after image introduction>
         """
+        self.image_preprocessor.start_request()
+
         pattern = re.compile(r"(.+?)(?=\n\n|$)", re.DOTALL)
 
         paragraphs = re.findall(pattern, template_str)
@@ -428,11 +460,9 @@ class RestfulClaudeProvider(LLMProvider):
                     }
 
                     if path is not None and path != "":
-                        media_type = f"image/jpeg"
-                        encoded_images = encode_data_to_base64_path(path)
-
+                        encoded_images = self.image_preprocessor.encode(path)
 
-                        for encoded_image in encoded_images:
+                        for _, media_type, encoded_image in encoded_images:
                             msg_content = {
                                     "type": "image",
                                     "source":
@@ -500,6 +530,8 @@ class RestfulClaudeProvider(LLMProvider):
         # merge messages with the same role
         messages = self._merge_messages(messages)
 
+        self.image_preprocessor.finish_request()
+
         return messages
 
 
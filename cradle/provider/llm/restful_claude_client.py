@@ -1,10 +1,17 @@
 from urllib.parse import quote
+import asyncio
+import base64
 import datetime
 import hashlib
 import hmac
 import http.client
 import json
-from typing import List, Dict
+import queue
+import struct
+import threading
+import weakref
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import dataclasses
 
@@ -16,6 +23,10 @@ SERVICE = 'bedrock'
 SIGNED_HEADERS = 'host;x-amz-date'
 CANONICAL_QUERY_STRING = ''
 ALGORITHM = 'AWS4-HMAC-SHA256'
+ANTHROPIC_VERSION = 'bedrock-2023-05-31'
+
+# Errors of a kept-alive connection the server already closed, the request is sent again on a new one
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionResetError, BrokenPipeError)
 
 
 @dataclasses.dataclass
@@ -30,17 +41,158 @@ class RestfulClaudeClientResponse:
     usage: Dict[str, int] # The usage of the model
 
 
+class EventStreamDecoder():
+    """
+    Incremental decoder of the application/vnd.amazon.eventstream framing used by invoke-with-response-stream.
+
+    Each message is a 12-byte prelude (total length, headers length, prelude CRC), typed headers, the payload and a
+    message CRC. Bytes are fed as they arrive and complete messages are returned as (headers, payload).
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+
+    def feed(self, data: bytes) -> List[Tuple[Dict[str, Any], bytes]]:
+
+        self.buffer += data
+
+        messages = []
+        while len(self.buffer) >= 12:
+            total_length, headers_length, prelude_crc = struct.unpack('>III', self.buffer[:12])
+            if zlib.crc32(self.buffer[:8]) != prelude_crc:
+                raise ValueError('Corrupted event stream prelude.')
+
+            if len(self.buffer) < total_length:
+                break
+
+            message = bytes(self.buffer[:total_length])
+            del self.buffer[:total_length]
+
+            if zlib.crc32(message[:-4]) != struct.unpack('>I', message[-4:])[0]:
+                raise ValueError('Corrupted event stream message.')
+
+            headers = self._parse_headers(message[12:12 + headers_length])
+            payload = message[12 + headers_length:-4]
+            messages.append((headers, payload))
+
+        return messages
+
+
+    def _parse_headers(self, data: bytes) -> Dict[str, Any]:
+
+        headers = {}
+        i = 0
+        while i < len(data):
+            name_length = data[i]
+            name = data[i + 1:i + 1 + name_length].decode('utf-8')
+            i += 1 + name_length
+
+            value_type = data[i]
+            i += 1
+
+            if value_type in (0, 1):
+                value = value_type == 0
+            elif value_type in (2, 3, 4, 5, 8):
+                size, fmt = {2: (1, '>b'), 3: (2, '>h'), 4: (4, '>i'), 5: (8, '>q'), 8: (8, '>q')}[value_type]
+                value = struct.unpack(fmt, data[i:i + size])[0]
+                i += size
+            elif value_type in (6, 7):
+                value_length = struct.unpack('>H', data[i:i + 2])[0]
+                value = data[i + 2:i + 2 + value_length]
+                if value_type == 7:
+                    value = value.decode('utf-8')
+                i += 2 + value_length
+            elif value_type == 9:
+                value = data[i:i + 16]
+                i += 16
+            else:
+                raise ValueError(f'Unknown event stream header type {value_type}.')
+
+            headers[name] = value
+
+        return headers
+
+
+class StreamedMessage():
+    """Builds the response message from the Claude streaming events, as they are decoded."""
+
+    def __init__(self, on_text: Optional[Callable[[str], None]] = None):
+
+        self.message = None
+        self.on_text = on_text
+        self.done = False
+
+
+    def add_event(self, headers: Dict[str, Any], payload: bytes) -> None:
+
+        if headers.get(':message-type') == 'exception':
+            raise RuntimeError(f"Claude stream error {headers.get(':exception-type')}: {payload.decode('utf-8', errors='replace')}")
+
+        if headers.get(':event-type') != 'chunk':
+            return
+
+        event = json.loads(base64.b64decode(json.loads(payload)['bytes']))
+        event_type = event['type']
+
+        if event_type == 'message_start':
+            self.message = event['message']
+        elif event_type == 'content_block_start':
+            self.message['content'].append(event['content_block'])
+        elif event_type == 'content_block_delta':
+            delta = event['delta']
+            if delta.get('type') == 'text_delta':
+                self.message['content'][event['index']]['text'] += delta['text']
+                if self.on_text is not None:
+                    self.on_text(delta['text'])
+        elif event_type == 'message_delta':
+            self.message['stop_reason'] = event['delta'].get('stop_reason')
+            self.message['stop_sequence'] = event['delta'].get('stop_sequence')
+            self.message['usage'].update(event.get('usage', {}))
+        elif event_type == 'message_stop':
+            self.done = True
+
+
+    def check_done(self) -> None:
+
+        if not self.done:
+            state = 'no message' if self.message is None else f'{sum([len(block.get("text", "")) for block in self.message["content"]])} characters'
+            raise RuntimeError(f"Claude stream ended before message_stop, after {state}")
+
+
 class RestfulClaudeClient():
+    """
+    Client of the Claude models on Bedrock, signing requests with SigV4.
+
+    Connections are kept alive in a pool of up to pool_size idle connections, and the signing key, which only
+    depends on the date, is derived once a day. Streamed responses are decoded as the events arrive, and a stream
+    ending before message_stop raises. create_async does the same over an aiohttp session per event loop. host, port
+    and use_tls allow pointing the client to a local server.
+    """
 
-    def __init__(self, llm_model, ak_val, sk_val):
+    def __init__(self, llm_model, ak_val, sk_val, host=HOST, port=None, use_tls=True, pool_size=4, timeout=600):
         self.llm_model = llm_model
         self.ak_val = ak_val
         self.sk_val = sk_val
 
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.pool_size = pool_size
+        self.timeout = timeout
+
         self.model_id = f'anthropic.{self.llm_model}-v1:0'
         self.model_id = quote(self.model_id, safe='')
-        self.bedrock_endpoint_url = f'https://{HOST}/model/{self.model_id}/invoke'
-        self.bedrock_endpoint_stream_url = f'https://{HOST}/model/{self.model_id}/invoke-with-response-stream'
+        self.bedrock_endpoint_url = f'https://{host}/model/{self.model_id}/invoke'
+        self.bedrock_endpoint_stream_url = f'https://{host}/model/{self.model_id}/invoke-with-response-stream'
+
+        self._signing_key = None # (date, key)
+        self._signing_lock = threading.Lock()
+
+        self._idle_connections = queue.LifoQueue(maxsize=pool_size)
+
+        # aiohttp sessions are bound to the event loop they were created in, so there is one per loop
+        self._async_sessions = weakref.WeakKeyDictionary()
 
 
     def sign(self, key, msg):
@@ -68,7 +220,7 @@ class RestfulClaudeClient():
 
 
     def construct_canonical_headers(self, time):
-        canonical_headers = f'host:{HOST}\nx-amz-date:{time}\n'
+        canonical_headers = f'host:{self.host}\nx-amz-date:{time}\n'
         return canonical_headers
 
 
@@ -105,8 +257,11 @@ class RestfulClaudeClient():
 
 
     def get_signing_key(self, date):
-        key = self.construct_signature_key(self.sk_val, date, REGION, SERVICE)
-        return key
+        # The key chain only depends on the date, so it is derived once a day
+        with self._signing_lock:
+            if self._signing_key is None or self._signing_key[0] != date:
+                self._signing_key = (date, self.construct_signature_key(self.sk_val, date, REGION, SERVICE))
+            return self._signing_key[1]
 
 
     def get_signature(self, key, string_to_sign):
@@ -157,30 +312,130 @@ class RestfulClaudeClient():
                temperature=1.0,
                max_tokens=1000,
                stream=False,
+               on_text=None,
                ):
-
-        conn = http.client.HTTPSConnection(HOST)
-
-        PAYLOAD_0 = json.dumps({
+        """Send a request, streamed if stream is True, in which case on_text is called with each text delta."""
+
+        path, payload, headers = self._prepare_request(messages, system, temperature, max_tokens, stream)
+
+        conn, reused = self._get_connection()
+        try:
+            try:
+                conn.request(METHOD, path, payload, headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                conn.close()
+                conn, reused = self._new_connection(), False
+                conn.request(METHOD, path, payload, headers)
+                response = conn.getresponse()
+
+            if response.status != 200:
+                raise RuntimeError(f'Claude request failed with status {response.status}: {response.read().decode("utf-8", errors="replace")}')
+
+            if stream:
+                streamed_message = StreamedMessage(on_text)
+                decoder = EventStreamDecoder()
+                while not streamed_message.done:
+                    data = response.read1(64 * 1024)
+                    if not data:
+                        break
+                    for event_headers, event_payload in decoder.feed(data):
+                        streamed_message.add_event(event_headers, event_payload)
+                streamed_message.check_done()
+                response.read()
+                resp_body = streamed_message.message
+            else:
+                resp_body = json.loads(response.read().decode())
+
+        except Exception:
+            conn.close()
+            raise
+
+        self._release_connection(conn, response)
+
+        return self._to_response(resp_body)
+
+
+    async def create_async(self,
+                           messages,
+                           system,
+                           temperature=1.0,
+                           max_tokens=1000,
+                           stream=False,
+                           on_text=None,
+                           ):
+        """Same as create, on a pooled aiohttp session of the running event loop."""
+
+        path, payload, headers = self._prepare_request(messages, system, temperature, max_tokens, stream)
+        session = self._get_async_session()
+
+        scheme = 'https' if self.use_tls else 'http'
+        port = f':{self.port}' if self.port is not None else ''
+
+        async with session.post(f'{scheme}://{self.host}{port}{path}', data=payload.encode('utf-8'), headers=headers) as response:
+            if response.status != 200:
+                raise RuntimeError(f'Claude request failed with status {response.status}: {await response.text()}')
+
+            if stream:
+                streamed_message = StreamedMessage(on_text)
+                decoder = EventStreamDecoder()
+                async for data in response.content.iter_any():
+                    for event_headers, event_payload in decoder.feed(data):
+                        streamed_message.add_event(event_headers, event_payload)
+                streamed_message.check_done()
+                resp_body = streamed_message.message
+            else:
+                resp_body = json.loads(await response.read())
+
+        return self._to_response(resp_body)
+
+
+    def close(self):
+
+        while True:
+            try:
+                self._idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+        for loop, session in list(self._async_sessions.items()):
+            if session.closed or loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(session.close(), loop)
+            else:
+                loop.run_until_complete(session.close())
+
+        self._async_sessions.clear()
+
+
+    def _prepare_request(self, messages, system, temperature, max_tokens, stream):
+
+        payload = json.dumps({
             "system": system,
             "messages": messages,
-            "anthropic_version": "bedrock-2023-05-31",
+            "anthropic_version": ANTHROPIC_VERSION,
             "max_tokens": max_tokens,
             "stop_sequences": ["\n\nHuman:", "\n\nAssistant"],
             "top_p": 0.999,
             "temperature": temperature,
         })
 
-        payload_hash = self.get_payload_hash(PAYLOAD_0)
+        payload_hash = self.get_payload_hash(payload)
+        headers = self.authorize(payload, payload_hash, stream=stream)
+        headers['Content-Type'] = CONTENT_TYPE
+
+        action = 'invoke-with-response-stream' if stream else 'invoke'
+        path = f'/model/{self.model_id}/{action}'
 
-        headers = self.authorize(PAYLOAD_0, payload_hash, stream=stream)
+        return path, payload, headers
 
-        conn.request('POST', f'/model/{self.model_id}/invoke', PAYLOAD_0, headers)
 
-        response = conn.getresponse()
-        resp_body = json.loads(response.read().decode())
+    def _to_response(self, resp_body):
 
-        response_data = RestfulClaudeClientResponse(
+        return RestfulClaudeClientResponse(
             id=resp_body['id'],
             type=resp_body['type'],
             role=resp_body['role'],
@@ -191,5 +446,44 @@ class RestfulClaudeClient():
             usage=resp_body['usage'],
         )
 
-        conn.close()
-        return response_data
+
+    def _new_connection(self):
+
+        if self.use_tls:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+
+    def _get_connection(self):
+        """Return an idle connection, or a new one, and whether it was reused."""
+
+        try:
+            return self._idle_connections.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+
+    def _release_connection(self, conn, response):
+
+        if response.will_close:
+            conn.close()
+            return
+
+        try:
+            self._idle_connections.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+    def _get_async_session(self):
+
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._async_sessions[loop] = session
+
+        return session
@@ -36,6 +36,10 @@ class SelfReflectionProvider(BaseModuleProvider):
                  *args,
                  **kwargs):
 
+        if self.memory.working_area.get("skip_self_reflection", False):
+            logger.write("Frames of the last action are unchanged, skipping self-reflection")
+            return {}
+
         params = deepcopy(self.memory.working_area)
 
         self._check_input_keys(params)
@@ -75,6 +79,10 @@ class RDR2SelfReflectionProvider(BaseProvider):
 
     def __call__(self, *args, **kwargs):
 
+        if self.memory.working_area.get("skip_self_reflection", False):
+            logger.write("Frames of the last action are unchanged, skipping self-reflection")
+            return {}
+
         params = deepcopy(self.memory.working_area)
 
         data = self.planner.self_reflection(input=params)
@@ -103,6 +111,10 @@ class StardewSelfReflectionProvider(BaseProvider):
 
     def __call__(self, *args, **kwargs):
 
+        if self.memory.working_area.get("skip_self_reflection", False):
+            logger.write("Frames of the last action are unchanged, skipping self-reflection")
+            return {}
+
         params = deepcopy(self.memory.working_area)
 
         data = self.planner.self_reflection(input=params)
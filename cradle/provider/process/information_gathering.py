@@ -153,7 +153,7 @@ class RDR2InformationGatheringPreprocessProvider(BaseProvider):
                                  "Others"]
         }
 
-        video_clip_path = self.video_recorder.get_video(start_frame_id, end_frame_id)
+        video_clip_path = self.video_recorder.get_clip(start_frame_id, end_frame_id)
         task_description = self.task_guidance.get_task_guidance(use_last=False)
 
         get_text_image_introduction = [
@@ -221,7 +221,7 @@ class StardewInformationGatheringPreprocessProvider(BaseProvider):
 
         # Gather information preparation
         logger.write(f'Gather Information Start Frame ID: {start_frame_id}, End Frame ID: {end_frame_id}')
-        video_clip_path = self.video_recorder.get_video(start_frame_id, end_frame_id)
+        video_clip_path = self.video_recorder.get_clip(start_frame_id, end_frame_id)
 
         # Configure the test
         # if you want to test with a pre-defined screenshot, you can replace the cur_screenshot_path with the path to the screenshot
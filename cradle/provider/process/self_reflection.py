@@ -7,6 +7,7 @@ from cradle.config import Config
 from cradle.memory import LocalMemory
 from cradle.provider import BaseProvider
 from cradle.provider import VideoRecordProvider
+from cradle.provider.video.frame_selector import FrameSelector
 from cradle.utils.check import is_valid_value
 from cradle import constants
 
@@ -31,6 +32,8 @@ class SelfReflectionPreprocessProvider(BaseProvider):
         self.use_screenshot_augmented = use_screenshot_augmented
         self.use_video = use_video
 
+        self.frame_selector = FrameSelector()
+
     def __call__(self):
 
         if not self.use_video:
@@ -64,7 +67,8 @@ class SelfReflectionPreprocessProvider(BaseProvider):
                         })
 
             processed_params = {
-                "image_introduction": image_introduction
+                "image_introduction": image_introduction,
+                "skip_self_reflection": False
             }
 
         else:
@@ -72,15 +76,10 @@ class SelfReflectionPreprocessProvider(BaseProvider):
             start_frame_id = self.memory.get_recent_history("start_frame_id", k=1)
             end_frame_id = self.memory.get_recent_history("end_frame_id", k=1)
 
-            action_frames = []
             video_frames = self.video_recorder.get_frames(start_frame_id, end_frame_id)
-
-            if len(video_frames) <= config.max_images_in_self_reflection * config.duplicate_frames + 1:
-                action_frames = [frame[1] for frame in video_frames[1::config.duplicate_frames]]
-            else:
-                for i in range(config.max_images_in_self_reflection):
-                    step = len(video_frames) // config.max_images_in_self_reflection * i + 1
-                    action_frames.append(video_frames[step][1])
+            selected_frames, selection_report = self.frame_selector.select(video_frames, config.max_images_in_self_reflection)
+            # Frames are views into the frame buffer, overwritten once evicted, so the few selected ones are copied
+            action_frames = [frame[1].copy() for frame in selected_frames]
 
             image_introduction = [
                 {
@@ -105,7 +104,8 @@ class SelfReflectionPreprocessProvider(BaseProvider):
             processed_params = {
                 "image_introduction": image_introduction,
                 "actions": action_str,
-                "action_code": action_code
+                "action_code": action_code,
+                "skip_self_reflection": selection_report["skipped"]
             }
 
         self.memory.working_area.update(processed_params)
@@ -124,6 +124,7 @@ class RDR2SelfReflectionPreprocessProvider(BaseProvider):
         self.gm = gm
         self.memory = LocalMemory()
         self.video_recorder = VideoRecordProvider(os.path.join(config.work_dir, 'video.mp4'))
+        self.frame_selector = FrameSelector()
 
 
     def __call__(self):
@@ -145,19 +146,15 @@ class RDR2SelfReflectionPreprocessProvider(BaseProvider):
             "skill_library": skill_library,
             "exec_info": exec_info,
             "pre_action": pre_action,
-            "pre_decision_making_reasoning": pre_decision_making_reasoning
+            "pre_decision_making_reasoning": pre_decision_making_reasoning,
+            "skip_self_reflection": False
         }
 
         if start_frame_id > -1:
-            action_frames = []
             video_frames = self.video_recorder.get_frames(start_frame_id, end_frame_id)
-
-            if len(video_frames) <= config.max_images_in_self_reflection * config.duplicate_frames + 1:
-                action_frames = [frame[1] for frame in video_frames[1::config.duplicate_frames]]
-            else:
-                for i in range(config.max_images_in_self_reflection):
-                    step = len(video_frames) // config.max_images_in_self_reflection * i + 1
-                    action_frames.append(video_frames[step][1])
+            selected_frames, selection_report = self.frame_selector.select(video_frames, config.max_images_in_self_reflection)
+            # Frames are views into the frame buffer, overwritten once evicted, so the few selected ones are copied
+            action_frames = [frame[1].copy() for frame in selected_frames]
 
             image_introduction = [
                 {
@@ -190,7 +187,8 @@ class RDR2SelfReflectionPreprocessProvider(BaseProvider):
                 "previous_reasoning": pre_decision_making_reasoning,
                 "previous_action": previous_action,
                 "action_code": action_code,
-                "executing_action_error": executing_action_error
+                "executing_action_error": executing_action_error,
+                "skip_self_reflection": selection_report["skipped"]
             })
 
         self.memory.working_area.update(processed_params)
@@ -212,6 +210,7 @@ class StardewSelfReflectionPreprocessProvider(BaseProvider):
         self.video_recorder = VideoRecordProvider(os.path.join(config.work_dir, 'video.mp4'))
 
         self.augment_methods = augment_methods
+        self.frame_selector = FrameSelector()
 
 
     def augment_image(self, image):
@@ -254,15 +253,18 @@ class StardewSelfReflectionPreprocessProvider(BaseProvider):
             "previous_toolbar_information": previous_toolbar_information,
             "history_summary": history_summary,
             "subtask_description": subtask_description,
-            "subtask_reasoning": subtask_reasoning
+            "subtask_reasoning": subtask_reasoning,
+            "skip_self_reflection": False
         }
 
         if start_frame_id > -1:
-            action_frames = []
             video_frames = self.video_recorder.get_frames(start_frame_id, end_frame_id)
 
-            action_frames.append(self.augment_image(video_frames[0][1]))
-            action_frames.append(self.augment_image(video_frames[-1][1]))
+            # The first and the last frames, unless nothing changed in between
+            selected_frames, selection_report = self.frame_selector.select(video_frames, 2)
+
+            # Frames are read-only views into the frame buffer, augment methods may draw on them
+            action_frames = [self.augment_image(frame[1].copy()) for frame in selected_frames]
 
             image_introduction = [
                 {
@@ -305,6 +307,7 @@ class StardewSelfReflectionPreprocessProvider(BaseProvider):
                 "action_code": action_code,
                 "executing_action_error": executing_action_error,
                 "previous_reasoning": pre_decision_making_reasoning,
+                "skip_self_reflection": selection_report["skipped"]
             })
 
         self.memory.working_area.update(processed_params)
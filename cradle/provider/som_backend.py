@@ -0,0 +1,305 @@
+import abc
+import gc
+import hashlib
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from cradle import constants
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils.model_registry import ModelRegistry
+from cradle.utils.image_utils import (
+    resize_image,
+    overlay_image_on_background,
+    process_image_for_labels,
+    refine_label_masks,
+    calculate_segment_bounding_boxes,
+)
+
+config = Config()
+logger = Logger()
+
+
+def get_sam_device() -> str:
+    if config.sam_device is not None:
+        return config.sam_device
+
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_sam_model():
+    from segment_anything import (
+        SamAutomaticMaskGenerator,
+        SamPredictor,
+        sam_model_registry,
+    )
+
+    sam_model = sam_model_registry[config.sam_model_name](checkpoint="./cache/sam_vit_h_4b8939.pth").to(get_sam_device())
+    sam_predictor = SamPredictor(sam_model)
+    sam_mask_generator = SamAutomaticMaskGenerator(sam_model, pred_iou_thresh=config.sam_pred_iou_thresh)
+
+    return sam_model, sam_predictor, sam_mask_generator
+
+
+ModelRegistry().register(constants.MODEL_SAM, load_sam_model)
+
+
+def get_sam_model():
+    """Return the SAM (model, predictor, mask generator), loading them on first use."""
+    try:
+        return ModelRegistry().get(constants.MODEL_SAM)
+    except Exception as e:
+        logger.error(f"Failed to load the SAM model. Make sure you follow the instructions on README to download the necessary files.\n{e}")
+        raise
+
+
+def bbox_intersects(bbox: Dict, region: Tuple[int, int, int, int]) -> bool:
+    """Whether a bounding box intersects a (top, left, bottom, right) region."""
+    top, left, bottom, right = region
+    return bbox['top'] < bottom and bbox['top'] + bbox['height'] > top and bbox['left'] < right and bbox['left'] + bbox['width'] > left
+
+
+def bbox_inside(bbox: Dict, region: Tuple[int, int, int, int]) -> bool:
+    """Whether a bounding box lies within a (top, left, bottom, right) region."""
+    top, left, bottom, right = region
+    return bbox['top'] >= top and bbox['top'] + bbox['height'] <= bottom and bbox['left'] >= left and bbox['left'] + bbox['width'] <= right
+
+
+class SOMBackend(abc.ABC):
+    """
+    Proposes the bounding boxes of UI elements for SOM, as dicts with "top", "left", "height" and "width".
+    """
+
+    @abc.abstractmethod
+    def propose(self, image: Image.Image) -> List[Dict]:
+        pass
+
+
+class SamSOMBackend(SOMBackend):
+    """
+    Segments the screenshot with the SAM automatic mask generator, then segments large boxes again on their crop.
+    """
+
+    def propose(self, image: Image.Image) -> List[Dict]:
+
+        image_area = image.size[0] * image.size[1]
+
+        try:
+            image_resized = resize_image(image, resize_ratio=config.sam_resize_ratio)
+        except ValueError as e:
+            logger.warn(f"Failed to resize the image. Error: {str(e)}")
+            return []
+
+        enhancer = ImageEnhance.Contrast(image_resized)
+        contrasted_image = enhancer.enhance(config.sam_contrast_level)
+        array = np.array(contrasted_image)
+        masks = get_sam_model()[2].generate(array)
+
+        del image_resized, enhancer, contrasted_image
+        gc.collect()
+
+        mask_img = overlay_image_on_background(masks, array.shape)
+        if mask_img is None:
+            return []
+
+        labels, _ = process_image_for_labels(mask_img)
+
+        del mask_img
+        gc.collect()
+
+        # Containment is checked within groups of 10 labels, as the former batched mask refinement did
+        segments = refine_label_masks(labels, resize_ratio=1/config.sam_resize_ratio, containment_group_size=10)
+        bounding_boxes = calculate_segment_bounding_boxes(segments)
+
+        del labels, segments
+        gc.collect()
+
+        if not bounding_boxes or not bounding_boxes[0]:
+            return bounding_boxes
+
+        large_bboxes = [bbox for bbox in bounding_boxes if (bbox['height'] * bbox['width'] > config.sam_max_area * image_area and bbox['height'] * bbox['width'] >= config.min_resom_area)]
+
+        # Recursive SOM process for large bounding boxes, on in-memory crops
+        refined_bounding_boxes = []
+        for bbox in large_bboxes:
+            top, left, height, width = bbox['top'], bbox['left'], bbox['height'], bbox['width']
+            cropped_img = image.crop((left, top, left + width, top + height))
+
+            for refined_bbox in self.propose(cropped_img):
+                refined_bbox['top'] += top
+                refined_bbox['left'] += left
+                refined_bounding_boxes.append(refined_bbox)
+
+            del cropped_img
+            gc.collect()
+
+        return bounding_boxes + refined_bounding_boxes
+
+
+class ContourSOMBackend(SOMBackend):
+    """
+    Proposes UI elements from the contours of the image edges, in milliseconds on CPU and without a model.
+
+    Edges are dilated so the strokes of an icon or the letters of a label merge into a single element. Combine it
+    with SAM2SOM_OCR_MODE to also get the text boxes.
+    """
+
+    def __init__(self, canny_thresholds: Tuple[int, int] = (50, 150), dilate_size: int = 5, max_area: float = 0.5):
+
+        self.canny_thresholds = canny_thresholds
+        self.dilate_size = dilate_size
+        self.max_area = max_area # fraction of the image, larger contours are panels or the window itself
+
+
+    def propose(self, image: Image.Image) -> List[Dict]:
+
+        gray = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+        image_area = gray.shape[0] * gray.shape[1]
+
+        edges = cv2.Canny(gray, *self.canny_thresholds)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (self.dilate_size, self.dilate_size))
+        edges = cv2.dilate(edges, kernel)
+
+        contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        bounding_boxes = []
+        for contour in contours:
+            left, top, width, height = cv2.boundingRect(contour)
+            area = width * height
+            if area < config.min_bbox_area or area > self.max_area * image_area:
+                continue
+
+            bounding_boxes.append({
+                "top": float(top),
+                "left": float(left),
+                "height": float(height - 1),
+                "width": float(width - 1),
+            })
+
+        return bounding_boxes
+
+
+class TiledSOMCache():
+    """
+    Re-segments only the screen tiles whose pixels changed since the previous screenshot.
+
+    The screenshot is split into tiles of config.som_tile_size pixels, hashed on each call. Groups of changed tiles,
+    grown by one tile so elements crossing their border are proposed whole, are cropped in memory and proposed by
+    the backend. Cached boxes not within a changed region are kept, and proposals cut by the crop border are dropped
+    when such a box covers them. When most of the screen changed, or its size did, the whole screenshot is proposed
+    again. Backends whose proposals depend on the image size, like SAM with sam_max_area, give different boxes on a
+    crop, so the cache is only enabled by default for the contour backend.
+    """
+
+    def __init__(self, backend: SOMBackend, tile_size: int = 256, max_changed_ratio: float = 0.5):
+
+        self.backend = backend
+        self.tile_size = tile_size
+        self.max_changed_ratio = max_changed_ratio
+
+        self.tile_hashes = None
+        self.image_size = None
+        self.bounding_boxes = []
+
+        self.stats = {
+            "full_runs": 0,
+            "partial_runs": 0,
+            "cached_runs": 0,
+        }
+
+
+    def propose(self, image: Image.Image) -> List[Dict]:
+
+        tile_hashes = self._hash_tiles(np.asarray(image.convert("RGB")))
+
+        if self.tile_hashes is None or image.size != self.image_size:
+            changed = np.ones(tile_hashes.shape, dtype=bool)
+        else:
+            changed = (tile_hashes != self.tile_hashes).astype(bool)
+
+        if changed.mean() > self.max_changed_ratio:
+            self.stats["full_runs"] += 1
+            bounding_boxes = self.backend.propose(image)
+        elif not changed.any():
+            self.stats["cached_runs"] += 1
+            bounding_boxes = self.bounding_boxes
+        else:
+            self.stats["partial_runs"] += 1
+            bounding_boxes = self._propose_changed(image, changed)
+
+        self.tile_hashes = tile_hashes
+        self.image_size = image.size
+        self.bounding_boxes = bounding_boxes
+
+        logger.debug(f"SOM tile cache: {int(changed.sum())}/{changed.size} tiles changed, stats {self.stats}")
+
+        # Callers shift and sort the boxes, so they get copies
+        return [dict(bbox) for bbox in bounding_boxes]
+
+
+    def _propose_changed(self, image: Image.Image, changed: np.ndarray) -> List[Dict]:
+
+        # Grow the changed tiles by one tile, then propose each connected group on its crop
+        grown = cv2.dilate(changed.astype(np.uint8), np.ones((3, 3), dtype=np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(grown, connectivity=8)
+
+        regions = []
+        for i in range(1, count):
+            tile_left, tile_top, tile_width, tile_height = stats[i][:4]
+            top = int(tile_top * self.tile_size)
+            left = int(tile_left * self.tile_size)
+            bottom = min(int((tile_top + tile_height) * self.tile_size), image.size[1])
+            right = min(int((tile_left + tile_width) * self.tile_size), image.size[0])
+            regions.append((top, left, bottom, right))
+
+        # Cached boxes extending outside the changed regions are kept, as a crop only shows part of their element
+        bounding_boxes = [bbox for bbox in self.bounding_boxes if not any([bbox_inside(bbox, region) for region in regions])]
+        spanning_boxes = [bbox for bbox in bounding_boxes if any([bbox_intersects(bbox, region) for region in regions])]
+
+        for top, left, bottom, right in regions:
+            for bbox in self.backend.propose(image.crop((left, top, right, bottom))):
+                bbox['top'] += top
+                bbox['left'] += left
+
+                # Boxes cut by an inner border of the crop are parts of elements the kept boxes already cover
+                cut = ((bbox['top'] <= top and top > 0) or
+                       (bbox['left'] <= left and left > 0) or
+                       (bbox['top'] + bbox['height'] >= bottom and bottom < image.size[1]) or
+                       (bbox['left'] + bbox['width'] >= right and right < image.size[0]))
+                if cut and any([bbox_intersects(bbox, (kept['top'], kept['left'], kept['top'] + kept['height'], kept['left'] + kept['width'])) for kept in spanning_boxes]):
+                    continue
+
+                bounding_boxes.append(bbox)
+
+        return bounding_boxes
+
+
+    def _hash_tiles(self, array: np.ndarray) -> np.ndarray:
+
+        rows = (array.shape[0] + self.tile_size - 1) // self.tile_size
+        cols = (array.shape[1] + self.tile_size - 1) // self.tile_size
+
+        tile_hashes = np.empty((rows, cols), dtype=object)
+        for row in range(rows):
+            for col in range(cols):
+                tile = array[row * self.tile_size:(row + 1) * self.tile_size, col * self.tile_size:(col + 1) * self.tile_size]
+                tile_hashes[row, col] = hashlib.blake2b(np.ascontiguousarray(tile).data, digest_size=16).digest()
+
+        return tile_hashes
+
+
+def create_som_backend(name: str = None) -> SOMBackend:
+
+    if name is None:
+        name = config.som_backend
+
+    if name == constants.SOM_BACKEND_SAM:
+        return SamSOMBackend()
+    elif name == constants.SOM_BACKEND_CONTOUR:
+        return ContourSOMBackend()
+    else:
+        raise ValueError(f"Unknown SOM backend {name}.")
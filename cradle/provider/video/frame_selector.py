@@ -0,0 +1,187 @@
+import math
+import threading
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from cradle import constants
+from cradle.config import Config
+from cradle.log import Logger
+
+config = Config()
+logger = Logger()
+
+HASH_SIZE = 8
+HASH_IMAGE_SIZE = 32
+HISTOGRAM_IMAGE_WIDTH = 64
+HISTOGRAM_BINS = 16
+
+LOW_RESOLUTION_IMAGE_TOKENS = 85
+TILE_IMAGE_TOKENS = 170
+
+
+def perceptual_hash(frame: np.ndarray) -> np.ndarray:
+    """64-bit DCT perceptual hash of a frame, as a bool array."""
+
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    low_frequencies = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].flatten()
+    return low_frequencies > np.median(low_frequencies[1:])
+
+
+def color_histogram(frame: np.ndarray) -> np.ndarray:
+    """Normalized per-channel histogram of a downsampled frame."""
+
+    height, width = frame.shape[:2]
+    small = cv2.resize(frame, (HISTOGRAM_IMAGE_WIDTH, max(int(height * HISTOGRAM_IMAGE_WIDTH / width), 1)), interpolation=cv2.INTER_AREA)
+
+    channels = 1 if small.ndim == 2 else small.shape[2]
+    histogram = np.concatenate([cv2.calcHist([small], [c], None, [HISTOGRAM_BINS], [0, 256]).flatten() for c in range(channels)])
+
+    return histogram / max(histogram.sum(), 1.0)
+
+
+def estimate_image_tokens(frame: np.ndarray, resolution: str = "low") -> int:
+    """Image tokens of a frame sent to the VLM, with the GPT-4V detail rules."""
+
+    if resolution == "low":
+        return LOW_RESOLUTION_IMAGE_TOKENS
+
+    # Fit in 2048x2048, then scale the shortest side down to 768, and count the 512px tiles
+    height, width = frame.shape[:2]
+    scale = min(1.0, 2048 / max(height, width))
+    scale = scale * min(1.0, 768 / (min(height, width) * scale))
+
+    tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+    return LOW_RESOLUTION_IMAGE_TOKENS + TILE_IMAGE_TOKENS * tiles
+
+
+def stride_frames(video_frames: List[Tuple[int, np.ndarray]], k: int) -> List[Tuple[int, np.ndarray]]:
+    """Frames of the last action at a fixed stride, the former self-reflection sampling."""
+
+    if len(video_frames) <= k * config.duplicate_frames + 1:
+        return video_frames[1::config.duplicate_frames]
+
+    return [video_frames[len(video_frames) // k * i + 1] for i in range(k)]
+
+
+class FrameSelector():
+    """
+    Picks the frames of the last action sent to self-reflection by content instead of by stride.
+
+    One frame per capture is compared, as perceptual hashes or color histograms of downsampled copies. The first
+    and the last frames are kept, then the frame farthest from the kept ones is added until there are k
+    frames or the remaining ones are all within config.self_reflection_change_threshold of a kept frame. With
+    skip_unchanged, when every frame is the same as the first one, no frames are returned so the step can be
+    skipped. It is off by default, as unchanged frames are often the sign of a failed action. The image tokens saved
+    against stride sampling are logged per turn.
+    """
+
+    def __init__(self, method: str = None, change_threshold: float = None):
+
+        self.method = method if method is not None else config.self_reflection_frame_selector
+        self.change_threshold = change_threshold if change_threshold is not None else config.self_reflection_change_threshold
+
+        self.stats = {
+            "turns": 0,
+            "skipped_turns": 0,
+            "selected_frames": 0,
+            "saved_tokens": 0,
+        }
+
+        self.lock = threading.Lock()
+
+
+    def select(self,
+               video_frames: List[Tuple[int, np.ndarray]],
+               k: int,
+               resolution: str = "low",
+               skip_unchanged: bool = None) -> Tuple[List[Tuple[int, np.ndarray]], Dict[str, Any]]:
+        """
+        Select up to k (frame id, frame) pairs, in temporal order.
+
+        Returns:
+            The selected frames, empty when the step should be skipped, and the report of the turn.
+        """
+
+        if skip_unchanged is None:
+            skip_unchanged = config.self_reflection_skip_unchanged
+
+        baseline = stride_frames(video_frames, k)
+
+        if self.method == constants.FRAME_SELECTOR_STRIDE or len(video_frames) == 0:
+            selected = baseline
+            max_distance = None
+        else:
+            candidates = video_frames[::config.duplicate_frames]
+            if candidates[-1][0] != video_frames[-1][0]:
+                candidates.append(video_frames[-1])
+
+            distances = self._distance_matrix([frame for _, frame in candidates])
+            max_distance = float(distances[0].max())
+
+            if skip_unchanged and max_distance < self.change_threshold:
+                selected = []
+            else:
+                selected = [candidates[i] for i in self._farthest_points(distances, k)]
+
+        tokens_per_image = estimate_image_tokens(video_frames[0][1], resolution) if len(video_frames) > 0 else 0
+        report = {
+            "candidates": len(video_frames),
+            "baseline_frames": len(baseline),
+            "selected_frames": len(selected),
+            "skipped": len(video_frames) > 0 and len(selected) == 0,
+            "max_distance": max_distance,
+            "saved_tokens": (len(baseline) - len(selected)) * tokens_per_image,
+        }
+
+        with self.lock:
+            self.stats["turns"] += 1
+            self.stats["skipped_turns"] += int(report["skipped"])
+            self.stats["selected_frames"] += len(selected)
+            self.stats["saved_tokens"] += report["saved_tokens"]
+            total_saved_tokens = self.stats["saved_tokens"]
+
+        logger.write(f'Self-reflection frames: {len(selected)} of {len(baseline)} stride frames, '
+                     f'{report["saved_tokens"]} image tokens saved this turn, {total_saved_tokens} in total'
+                     + (', frames unchanged, skipping self-reflection' if report["skipped"] else ''))
+
+        return selected, report
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.stats)
+
+
+    def _distance_matrix(self, frames: List[np.ndarray]) -> np.ndarray:
+        """Pairwise frame distances, from 0 for the same content to 1."""
+
+        if self.method == constants.FRAME_SELECTOR_HISTOGRAM:
+            histograms = np.stack([color_histogram(frame) for frame in frames])
+            # Total variation distance between the color distributions
+            return np.abs(histograms[:, None, :] - histograms[None, :, :]).sum(axis=2) / 2
+        elif self.method == constants.FRAME_SELECTOR_PHASH:
+            hashes = np.stack([perceptual_hash(frame) for frame in frames])
+            return (hashes[:, None, :] != hashes[None, :, :]).mean(axis=2)
+        else:
+            raise ValueError(f"Unknown frame selector {self.method}.")
+
+
+    def _farthest_points(self, distances: np.ndarray, k: int) -> List[int]:
+
+        last = len(distances) - 1
+        selected = [last] if last == 0 or k == 1 else [0, last]
+
+        min_distances = distances[selected].min(axis=0)
+        while len(selected) < k:
+            index = int(np.argmax(min_distances))
+            if min_distances[index] < self.change_threshold:
+                break
+
+            selected.append(index)
+            min_distances = np.minimum(min_distances, distances[index])
+
+        return sorted(selected)
@@ -0,0 +1,183 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, List, Tuple
+
+import cv2
+import numpy as np
+
+from cradle.log import Logger
+from cradle.utils.frame_source import FrameHandle
+
+logger = Logger()
+
+THUMBNAIL_WIDTH = 160
+PIXEL_CHANGE_THRESHOLD = 25 # grey level difference for a thumbnail pixel to count as changed
+
+
+def format_timestamp(seconds: float) -> str:
+    """Format as H_MM_SS_mmm, the 11-character timestamp prefix of the VideoSubFinderWXW frame files."""
+
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+
+    return f"{hours}_{minutes:02d}_{seconds:02d}_{milliseconds:03d}"
+
+
+def make_thumbnail(frame: np.ndarray, roi: Tuple[float, float, float, float]) -> np.ndarray:
+    """Small blurred grey crop of the ROI, compared between frames."""
+
+    height, width = frame.shape[:2]
+    x1, y1, x2, y2 = roi
+    crop = frame[int(y1 * height):int(y2 * height), int(x1 * width):int(x2 * width)]
+
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    thumbnail_height = max(int(gray.shape[0] * THUMBNAIL_WIDTH / max(gray.shape[1], 1)), 1)
+    thumbnail = cv2.resize(gray, (THUMBNAIL_WIDTH, thumbnail_height), interpolation=cv2.INTER_AREA)
+
+    return cv2.GaussianBlur(thumbnail, (3, 3), 0)
+
+
+def _read_thumbnails(video_path: str, start: int, end: int, roi: Tuple[float, float, float, float]) -> np.ndarray:
+    """Decode frames [start, end) of a video file into thumbnails, in a worker process."""
+
+    capture = cv2.VideoCapture(video_path)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    thumbnails = []
+    try:
+        for _ in range(start, end):
+            success, frame = capture.read()
+            if not success:
+                break
+            thumbnails.append(make_thumbnail(frame, roi))
+    finally:
+        capture.release()
+
+    return np.stack(thumbnails) if len(thumbnails) > 0 else np.zeros((0, 1, THUMBNAIL_WIDTH), dtype=np.uint8)
+
+
+class KeyframeExtractor():
+    """
+    Picks the informative frames of a video, in process, as a replacement for VideoSubFinderWXW.
+
+    Frames are reduced to thumbnails of the ROI. The video is split into segments where the fraction of changed
+    thumbnail pixels, against the first frame of the segment, stays below change_threshold, so both cuts and slow
+    changes such as a dialogue line being typed start a new segment. The middle frame of each segment is kept, away
+    from transitions. Video files are decoded in chunks across a process pool, recorder clips are read from memory.
+    """
+
+    def __init__(self,
+                 roi: Tuple[float, float, float, float] = (0.0, 0.0, 1.0, 1.0),
+                 change_threshold: float = 0.02,
+                 min_segment_frames: int = 2,
+                 workers: int = 4):
+
+        self.roi = roi
+        self.change_threshold = change_threshold
+        self.min_segment_frames = min_segment_frames
+        self.workers = workers
+
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keyframe_writer")
+
+
+    def select(self, thumbnails: np.ndarray) -> List[int]:
+        """Return the indices of the keyframes among the thumbnails."""
+
+        if len(thumbnails) == 0:
+            return []
+
+        thumbnails = thumbnails.astype(np.int16)
+
+        segments = []
+        start = 0
+        while start < len(thumbnails):
+            # Changed pixel fraction of all the remaining frames against the segment start, in one pass
+            changed = (np.abs(thumbnails[start + 1:] - thumbnails[start]) > PIXEL_CHANGE_THRESHOLD).mean(axis=(1, 2))
+            boundaries = np.flatnonzero(changed > self.change_threshold)
+            end = start + 1 + int(boundaries[0]) if len(boundaries) > 0 else len(thumbnails)
+
+            segments.append((start, end))
+            start = end
+
+        keyframes = [(start + end - 1) // 2 for start, end in segments if end - start >= self.min_segment_frames]
+        if len(keyframes) == 0:
+            # Only transitions, keep the longest one
+            start, end = max(segments, key=lambda segment: segment[1] - segment[0])
+            keyframes = [(start + end - 1) // 2]
+
+        return keyframes
+
+
+    def extract_from_frames(self, frames: Iterable[Tuple[float, np.ndarray]], output_dir: str) -> List[Tuple[FrameHandle, str]]:
+        """Extract keyframes from in-memory (timestamp in seconds, BGR frame) pairs."""
+
+        timestamps, images = [], []
+        for timestamp, frame in frames:
+            timestamps.append(timestamp)
+            images.append(frame)
+
+        if len(images) == 0:
+            return []
+
+        thumbnails = np.stack([make_thumbnail(frame, self.roi) for frame in images])
+        keyframes = self.select(thumbnails)
+
+        return [self._save_keyframe(images[i], timestamps[i], i, output_dir) for i in keyframes]
+
+
+    def extract_from_file(self, video_path: str, output_dir: str) -> List[Tuple[FrameHandle, str]]:
+        """Extract keyframes from a video file, decoding it in chunks across the process pool."""
+
+        capture = cv2.VideoCapture(video_path)
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = capture.get(cv2.CAP_PROP_FPS) or 1.0
+        capture.release()
+
+        if frame_count <= 0:
+            return []
+
+        workers = max(min(self.workers, frame_count // 100), 1)
+        chunk_size = (frame_count + workers - 1) // workers
+        chunks = [(start, min(start + chunk_size, frame_count)) for start in range(0, frame_count, chunk_size)]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(_read_thumbnails, [video_path] * len(chunks), [start for start, _ in chunks],
+                                      [end for _, end in chunks], [self.roi] * len(chunks)))
+        else:
+            parts = [_read_thumbnails(video_path, start, end, self.roi) for start, end in chunks]
+
+        parts = [part for part in parts if len(part) > 0]
+        if len(parts) == 0:
+            logger.warn(f"No frames could be decoded from {video_path}.")
+            return []
+
+        thumbnails = np.concatenate(parts)
+        keyframes = self.select(thumbnails)
+
+        results = []
+        capture = cv2.VideoCapture(video_path)
+        try:
+            for i in keyframes:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, i)
+                success, frame = capture.read()
+                if success:
+                    results.append(self._save_keyframe(frame, i / fps, i, output_dir))
+        finally:
+            capture.release()
+
+        return results
+
+
+    def _save_keyframe(self, frame: np.ndarray, timestamp: float, index: int, output_dir: str) -> Tuple[FrameHandle, str]:
+
+        timestamp = format_timestamp(timestamp)
+        path = os.path.join(output_dir, f"{timestamp}__{index:06d}.jpg")
+
+        # The JPEG is written in the background, consumers with a handle use the pixels directly
+        handle = FrameHandle(path, np.ascontiguousarray(frame), source="keyframe", writer=self._writer)
+        handle.save_async()
+
+        return handle, timestamp
@@ -0,0 +1,186 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict
+
+import numpy as np
+
+from cradle import constants
+from cradle.log import Logger
+from cradle.config import Config
+from cradle.utils.model_registry import ModelRegistry
+
+logger = Logger()
+config = Config()
+
+MAX_CACHED_VECTORS = 256
+
+
+def load_spacy_model():
+    import spacy
+    return spacy.load("en_core_web_lg")
+
+
+ModelRegistry().register(constants.MODEL_SPACY, load_spacy_model)
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def edit_similarity(text1: str, text2: str) -> float:
+    """1 - Levenshtein distance / length of the longer text, so 1.0 for equal texts."""
+
+    if text1 == text2:
+        return 1.0
+
+    if len(text1) < len(text2):
+        text1, text2 = text2, text1
+
+    if len(text2) == 0:
+        return 0.0
+
+    previous = list(range(len(text2) + 1))
+    for i, char1 in enumerate(text1, 1):
+        current = [i]
+        for j, char2 in enumerate(text2, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char1 != char2)))
+        previous = current
+
+    return 1.0 - previous[-1] / len(text1)
+
+
+class OCRChangeDetector():
+    """
+    Checks whether the text in the OCR crop region changed, for the recorder OCR stage.
+
+    Frames are sampled every config.ocr_sample_interval seconds, and frames whose crop has the same pixels as the
+    last checked one are skipped without running OCR. Texts are first compared by normalized edit distance, and only
+    ambiguous pairs fall back to spaCy, with the document vectors of recent texts cached. Changes are published by
+    setting config.ocr_text_changed, an event the composite skills poll and clear.
+    """
+
+    def __init__(self, ocr_extractor):
+
+        self.ocr_extractor = ocr_extractor
+
+        self.pre_text = None
+        self.pre_crop_hash = None
+        self.last_sample_time = None
+
+        self.vectors = OrderedDict()
+
+        self.stats = {
+            "sampled_frames": 0,
+            "unchanged_frames": 0,
+            "edit_decisions": 0,
+            "vector_decisions": 0,
+            "text_changes": 0,
+        }
+
+        self.lock = threading.Lock()
+
+
+    def should_sample(self, frame_time: float) -> bool:
+        """Whether the frame captured at frame_time is due for a check."""
+
+        with self.lock:
+            if self.last_sample_time is not None and frame_time - self.last_sample_time < config.ocr_sample_interval:
+                return False
+
+            self.last_sample_time = frame_time
+            return True
+
+
+    def reset(self) -> None:
+        """Forget the previous text, e.g. when OCR is disabled, so the next check starts over."""
+
+        with self.lock:
+            self.pre_text = None
+            self.pre_crop_hash = None
+            self.last_sample_time = None
+
+
+    def process(self, frame: np.ndarray) -> bool:
+        """Check a BGR frame and publish a change. Return whether the text differs from the previous one."""
+
+        crop_hash = self._hash_crop(frame)
+
+        with self.lock:
+            self.stats["sampled_frames"] += 1
+            if crop_hash == self.pre_crop_hash:
+                self.stats["unchanged_frames"] += 1
+                return False
+            pre_text = self.pre_text
+
+        cur_text = self.ocr_extractor.extract_text(frame, return_full=0)
+        cur_text = " ".join(cur_text[0])
+
+        is_different = pre_text is not None and self.is_different_text(pre_text, cur_text)
+
+        with self.lock:
+            self.pre_text = cur_text
+            self.pre_crop_hash = crop_hash
+            if is_different:
+                self.stats["text_changes"] += 1
+
+        if is_different:
+            config.ocr_text_changed.set()
+
+        return is_different
+
+
+    def is_different_text(self, text1: str, text2: str) -> bool:
+
+        text1 = normalize_text(text1)
+        text2 = normalize_text(text2)
+
+        similarity = edit_similarity(text1, text2)
+        if similarity >= config.ocr_edit_same_threshold or similarity <= config.ocr_edit_different_threshold:
+            with self.lock:
+                self.stats["edit_decisions"] += 1
+            return similarity <= config.ocr_edit_different_threshold
+
+        vector1 = self._get_vector(text1)
+        vector2 = self._get_vector(text2)
+
+        # Same as Doc.similarity, texts without vectors are not similar
+        norm = np.linalg.norm(vector1) * np.linalg.norm(vector2)
+        score = float(np.dot(vector1, vector2) / norm) if norm > 0 else 0.0
+
+        with self.lock:
+            self.stats["vector_decisions"] += 1
+
+        return score < config.ocr_similarity_threshold
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.stats)
+
+
+    def _hash_crop(self, frame: np.ndarray) -> bytes:
+
+        crop = frame
+        if self.ocr_extractor.crop_region is not None:
+            x1, y1, x2, y2 = self.ocr_extractor.crop_region
+            crop = frame[y1:y2, x1:x2]
+
+        return hashlib.blake2b(np.ascontiguousarray(crop).data, digest_size=16).digest()
+
+
+    def _get_vector(self, text: str) -> np.ndarray:
+
+        vector = self.vectors.get(text)
+        if vector is not None:
+            self.vectors.move_to_end(text)
+            return vector
+
+        vector = ModelRegistry().get(constants.MODEL_SPACY)(text).vector
+
+        self.vectors[text] = vector
+        if len(self.vectors) > MAX_CACHED_VECTORS:
+            self.vectors.popitem(last=False)
+
+        return vector
@@ -32,7 +32,7 @@ class VideoClipProvider(BaseProvider):
             screenshot_path = self.gm.capture_screen()
             time.sleep(2)
             end_frame_id = self.video_recorder.get_current_frame_id()
-            video_clip_path = self.video_recorder.get_video(start_frame_id, end_frame_id)
+            video_clip_path = self.video_recorder.get_clip(start_frame_id, end_frame_id)
 
             logger.write(f"Initiate video clip path from the screen shot by frame id ({start_frame_id}, {end_frame_id}).")
 
@@ -46,7 +46,7 @@ class VideoClipProvider(BaseProvider):
         else:
             start_frame_id = self.memory.get_recent_history("start_frame_id")[-1]
             end_frame_id = self.memory.get_recent_history("end_frame_id")[-1]
-            video_clip_path = self.video_recorder.get_video(start_frame_id, end_frame_id)
+            video_clip_path = self.video_recorder.get_clip(start_frame_id, end_frame_id)
 
             logger.write(f"Get video clip path from the memory by frame id ({start_frame_id}, {end_frame_id}).")
 
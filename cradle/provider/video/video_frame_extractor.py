@@ -3,9 +3,12 @@ import os
 import subprocess
 import shutil
 
+from cradle import constants
 from cradle.log import Logger
 from cradle.config import Config
 from cradle.provider import BaseProvider
+from cradle.provider.video.video_segments import VideoClip
+from cradle.provider.video.keyframe_extractor import KeyframeExtractor
 
 logger = Logger()
 config = Config()
@@ -17,23 +20,30 @@ class VideoFrameExtractorProvider(BaseProvider):
 
         super(VideoFrameExtractorProvider, self).__init__()
 
+        self.backend = config.frame_extractor_backend
         self.path_vsf = config.VideoFrameExtractor_path
 
-        # Copy the placeholder file to the work_dir
-        run_placeholderfile_path = os.path.join(config.work_dir, 'test.srt')
-
-        if not os.path.exists(run_placeholderfile_path):
-            shutil.copy(config.VideoFrameExtractor_placeholderfile_path, run_placeholderfile_path)
-
-        self.vsf_subtitle = run_placeholderfile_path
         self.frame_output_dir = os.path.join(config.work_dir, 'frame_output_dir')
         self.extracted_frame_folder = os.path.join(self.frame_output_dir, "RGBImages")
 
         os.makedirs(self.extracted_frame_folder, exist_ok=True)
 
-        # If self.path_vsf does not exist, throw a non-exist error
-        if not os.path.exists(self.path_vsf):
-            raise Exception(f"VideoSubFinderWXW does not exist! Please install it according to the README.md.")
+        if self.backend == constants.FRAME_EXTRACTOR_NATIVE:
+            self.keyframe_extractor = KeyframeExtractor(roi=config.keyframe_roi,
+                                                        change_threshold=config.keyframe_change_threshold,
+                                                        workers=config.keyframe_workers)
+        else:
+            # Copy the placeholder file to the work_dir
+            run_placeholderfile_path = os.path.join(config.work_dir, 'test.srt')
+
+            if not os.path.exists(run_placeholderfile_path):
+                shutil.copy(config.VideoFrameExtractor_placeholderfile_path, run_placeholderfile_path)
+
+            self.vsf_subtitle = run_placeholderfile_path
+
+            # If self.path_vsf does not exist, throw a non-exist error
+            if not os.path.exists(self.path_vsf):
+                raise Exception(f"VideoSubFinderWXW does not exist! Please install it according to the README.md.")
 
         # Create a folder to store the extracted frames
         if not os.path.exists(self.frame_output_dir):
@@ -106,6 +116,13 @@ class VideoFrameExtractorProvider(BaseProvider):
 
 
     def extract(self,video_path):
+
+        if self.backend == constants.FRAME_EXTRACTOR_NATIVE:
+            return self.extract_keyframes(video_path)
+
+        # Clips from the recorder are only encoded when an extractor needs the file
+        if isinstance(video_path, VideoClip):
+            video_path = video_path.path
         video_path = os.path.normpath(video_path)
         self.run_sub_finder(self.path_vsf, video_path, self.frame_output_dir, self.vsf_subtitle)
 
@@ -115,3 +132,29 @@ class VideoFrameExtractorProvider(BaseProvider):
                                  file.endswith('.jpeg') or file.endswith('.jpg')]
 
         return extracted_frame_paths
+
+
+    def extract_keyframes(self, video_path):
+        """
+        Extract keyframes in process, as (frame, timestamp) pairs where frames are FrameHandles saved in the background
+        """
+
+        clip_name = os.path.splitext(os.path.basename(video_path))[0]
+        output_dir = os.path.join(self.extracted_frame_folder, clip_name)
+        os.makedirs(output_dir, exist_ok=True)
+
+        logger.write(f"Extracting Informative Frames from {video_path} .....")
+
+        if isinstance(video_path, VideoClip):
+            # One frame per capture, duplicated frame ids hold the same frame
+            start_frame_id = video_path.start_frame_id
+            frames = (((frame_id - start_frame_id) / video_path.recorder.fps, frame)
+                      for frame_id, frame in video_path.iter_frames()
+                      if (frame_id - start_frame_id) % config.duplicate_frames == 0)
+            extracted_frame_paths = self.keyframe_extractor.extract_from_frames(frames, output_dir)
+        else:
+            extracted_frame_paths = self.keyframe_extractor.extract_from_file(os.path.normpath(video_path), output_dir)
+
+        logger.write(f"Frame Extraction Completed! Total Frames: {len(extracted_frame_paths)}")
+
+        return extracted_frame_paths
@@ -4,30 +4,43 @@ import time
 
 import numpy as np
 import cv2
-import easyocr
 import PIL
 from PIL import Image
 
 # Hack to avoid EasyOCR crash
 PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
 
+from cradle import constants
 from cradle.log import Logger
 from cradle.config import Config
 from cradle.provider import BaseProvider
 from cradle.utils.encoding_utils import decode_image
 from cradle.utils.file_utils import assemble_project_path
+from cradle.utils.model_registry import ModelRegistry
 
 logger = Logger()
 config = Config()
 
 
+def load_easyocr_reader():
+    import easyocr
+    return easyocr.Reader(['en'])
+
+
+ModelRegistry().register(constants.MODEL_EASYOCR, load_easyocr_reader)
+
+
 class VideoOCRExtractorProvider(BaseProvider):
 
     def __init__(self):
         super(VideoOCRExtractorProvider, self).__init__()
 
         self.crop_region = config.DEFAULT_OCR_CROP_REGION
-        self.reader = easyocr.Reader(['en'])
+
+
+    @property
+    def reader(self):
+        return ModelRegistry().get(constants.MODEL_EASYOCR)
 
 
     def to_images(self, data: Any) -> Any:
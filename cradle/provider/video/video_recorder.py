@@ -1,75 +1,230 @@
 import threading
 import os
 import time
+import queue
+from collections import OrderedDict
 
-import spacy
 import numpy as np
 import cv2
 import mss
 
+from cradle import constants
 from cradle.log import Logger
 from cradle.config import Config
 from cradle.provider import BaseProvider
 from cradle.provider.video.video_ocr_extractor import VideoOCRExtractorProvider
+from cradle.provider.video.ocr_change_detector import OCRChangeDetector
+from cradle.provider.video.video_segments import VideoSegmentIndex, VideoClip
+from cradle.utils.frame_source import FrameSource
 
 config = Config()
 logger = Logger()
 
 
 class FrameBuffer():
+    """
+    Fixed-capacity ring buffer of captured frames, preallocated as one NumPy array on the first frame.
 
-    def __init__(self):
-        self.queue = []
+    Frame ids must increase. Consecutive ids added with the same frame object, as the recorder does to duplicate
+    frames, are aliases of one slot instead of copies. Lookups go through a ring over frame ids, so they take
+    constant time. Once the buffer is full, the oldest frame and its aliases are evicted. Frames are returned as
+    read-only views into the buffer, valid until they are evicted; pass copy=True to keep them longer.
+    """
+
+    def __init__(self, max_frames: int = None, max_bytes: int = None):
+
+        self.max_frames = max_frames if max_frames is not None else config.frame_buffer_max_frames
+        self.max_bytes = max_bytes if max_bytes is not None else config.frame_buffer_max_bytes
         self.lock = threading.Lock()
 
+        self.frames = None # (capacity, *frame shape), allocated on the first frame
+        self.capacity = 0
+        self.slot_first_ids = None # first frame id of each slot
+        self.head = 0 # slot of the oldest frame
+        self.count = 0 # slots in use
+
+        self.id_slots = None # slot of each frame id, indexed by frame id modulo its length, -1 for no frame
+        self.oldest_id = None
+        self.newest_id = None
+        self.newest_slot = None
+        self.last_frame = None # frame object added last, to detect duplicates
+
+        self.stats = {
+            "frames_added": 0,
+            "aliases_added": 0,
+            "frames_evicted": 0,
+            "missed_lookups": 0,
+        }
+
 
     def add_frame(self, frame_id, frame):
         with self.lock:
-            self.queue.append((frame_id, frame))
+            if self.frames is None or self.frames.shape[1:] != frame.shape or self.frames.dtype != frame.dtype:
+                self._allocate(frame)
+
+            if self.newest_id is not None and frame_id <= self.newest_id:
+                raise ValueError(f"Frame id {frame_id} is not after the latest frame id {self.newest_id}.")
+
+            if frame is self.last_frame and frame_id == self.newest_id + 1:
+                slot = self.newest_slot
+                self.stats["aliases_added"] += 1
+            else:
+                if self.count == self.capacity:
+                    self._evict_oldest()
+
+                slot = (self.head + self.count) % self.capacity
+                np.copyto(self.frames[slot], frame)
+                self.slot_first_ids[slot] = frame_id
+                self.count += 1
+                self.last_frame = frame
+                self.stats["frames_added"] += 1
+
+            if self.newest_id is not None:
+                # Ids skipped since the latest frame have no frame
+                gap_ids = np.arange(self.newest_id + 1, frame_id)[-len(self.id_slots):]
+                self.id_slots[gap_ids % len(self.id_slots)] = -1
+
+            self.id_slots[frame_id % len(self.id_slots)] = slot
+            self.newest_id = frame_id
+            self.newest_slot = slot
 
+            if self.oldest_id is None:
+                self.oldest_id = frame_id
 
-    def get_last_frame(self):
+            # Keep all live ids addressable in the id ring
+            while self.count > 1 and self.newest_id - self.oldest_id + 1 > len(self.id_slots):
+                self._evict_oldest()
+
+
+    def get_last_frame(self, copy=False):
         with self.lock:
-            if len(self.queue) == 0:
+            if self.count == 0:
                 return None
             else:
-                return self.queue[-1]
+                return (self.newest_id, self._get_view(self.newest_slot, copy))
 
 
-    def get_frame_by_frame_id(self, frame_id):
+    def get_frame_by_frame_id(self, frame_id, copy=False):
         with self.lock:
-            for frame in self.queue:
-                if frame[0] == frame_id:
-                    return frame
+            slot = self._lookup(frame_id)
+            if slot is None:
+                self.stats["missed_lookups"] += 1
+                return None
+            return (frame_id, self._get_view(slot, copy))
 
-        return None
 
+    def get_frames_to_latest(self, frame_id, before_frame_nums=5, copy=False):
+        return self.get_frames(frame_id - before_frame_nums, frame_id, copy=copy)
 
-    def get_frames_to_latest(self, frame_id, before_frame_nums=5):
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.count = 0
+            self.oldest_id = None
+            self.newest_id = None
+            self.newest_slot = None
+            self.last_frame = None
+            if self.id_slots is not None:
+                self.id_slots.fill(-1)
+
+
+    def get_frames(self, start_frame_id, end_frame_id=None, copy=False):
         frames = []
         with self.lock:
-            for frame in self.queue:
-                if frame[0] >= frame_id - before_frame_nums and frame[0] <= frame_id:
-                    frames.append(frame)
+            if self.count == 0:
+                return frames
+
+            evicted_count = 0
+            if start_frame_id < self.oldest_id:
+                self.stats["missed_lookups"] += 1
+                evicted_count = self.oldest_id - start_frame_id
+
+            first_id = max(start_frame_id, self.oldest_id)
+            last_id = self.newest_id if end_frame_id is None else min(end_frame_id, self.newest_id)
+
+            for frame_id in range(first_id, last_id + 1):
+                slot = self._lookup(frame_id)
+                if slot is not None:
+                    frames.append((frame_id, self._get_view(slot, copy)))
+
+        if evicted_count > 0:
+            logger.warn(f"Frames {start_frame_id} to {start_frame_id + evicted_count - 1} were evicted from the frame buffer, "
+                        f"returning frames from {first_id}")
 
         return frames
 
 
-    def clear(self):
+    def get_stats(self):
         with self.lock:
-            self.queue.clear()
+            stats = dict(self.stats)
+            stats.update({
+                "capacity": self.capacity,
+                "frames": self.count,
+                "bytes": self.frames.nbytes if self.frames is not None else 0,
+                "oldest_frame_id": self.oldest_id,
+                "newest_frame_id": self.newest_id,
+            })
+            return stats
 
 
-    def get_frames(self, start_frame_id, end_frame_id=None):
-        frames = []
-        with self.lock:
-            for frame in self.queue:
-                if frame[0] >= start_frame_id:
-                    if end_frame_id is not None and frame[0] > end_frame_id:
-                        break
-                    frames.append(frame)
+    def _allocate(self, frame):
 
-        return frames
+        if self.frames is not None:
+            logger.warn(f"Frame shape changed from {self.frames.shape[1:]} to {frame.shape}, clearing the frame buffer.")
+
+        self.capacity = max(1, min(self.max_frames, self.max_bytes // max(frame.nbytes, 1)))
+        self.frames = np.empty((self.capacity, ) + frame.shape, dtype=frame.dtype)
+        self.slot_first_ids = np.zeros(self.capacity, dtype=np.int64)
+
+        # Room for every frame to be duplicated as the recorder does, with some slack for irregular ids
+        self.id_slots = np.full(self.capacity * max(config.duplicate_frames, 1) * 2, -1, dtype=np.int64)
+
+        self.head = 0
+        self.count = 0
+        self.oldest_id = None
+        self.newest_id = None
+        self.newest_slot = None
+        self.last_frame = None
+
+        logger.debug(f"Frame buffer allocated for {self.capacity} frames of shape {frame.shape}, {self.frames.nbytes / 1024 ** 2:.1f} MiB")
+
+
+    def _evict_oldest(self):
+
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+        self.stats["frames_evicted"] += 1
+
+        if self.count > 0:
+            self.oldest_id = int(self.slot_first_ids[self.head])
+        else:
+            self.oldest_id = None
+            self.newest_id = None
+            self.newest_slot = None
+            self.last_frame = None
+
+
+    def _lookup(self, frame_id):
+
+        if self.count == 0 or frame_id < self.oldest_id or frame_id > self.newest_id:
+            return None
+
+        slot = int(self.id_slots[frame_id % len(self.id_slots)])
+        return slot if slot >= 0 else None
+
+
+    def _get_view(self, slot, copy=False):
+
+        if copy:
+            return self.frames[slot].copy()
+
+        view = self.frames[slot].view()
+        view.flags.writeable = False
+        return view
+
+
+MAX_CACHED_CLIPS = 8
 
 
 class VideoRecordProvider(BaseProvider):
@@ -93,7 +248,11 @@ class VideoRecordProvider(BaseProvider):
 
         self.current_frame_id = -1
         self.current_frame = None
+        self.current_frame_time = None
         self.frame_buffer = FrameBuffer()
+        self.segment_index = VideoSegmentIndex()
+        self.clips = OrderedDict() # (start frame id, end frame id) -> VideoClip, so each range is encoded at most once
+        self.clips_lock = threading.Lock()
         self.thread_flag = True
 
         self.thread = threading.Thread(
@@ -103,35 +262,61 @@ class VideoRecordProvider(BaseProvider):
         )
         self.thread.daemon = True
 
+        # Encoding and OCR run in their own workers, fed by bounded queues, so capture keeps its cadence
+        self.encode_queue = queue.Queue(maxsize=config.video_encode_queue_size)
+        self.ocr_queue = queue.Queue(maxsize=1)
+        self.encode_thread = threading.Thread(target=self.encode_frames, name='Video Encode')
+        self.encode_thread.daemon = True
+        self.ocr_thread = threading.Thread(target=self.check_ocr_text, name='Video OCR')
+        self.ocr_thread.daemon = True
+
+        self.stats_lock = threading.Lock()
+        self.stage_stats = {stage: {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0} for stage in ["capture", "encode", "ocr"]}
+        self.dropped_frames = 0
+
         self.video_path_dir = os.path.join(os.path.dirname(self.video_path), 'videos')
         os.makedirs(self.video_path_dir, exist_ok=True)
         self.video_splits_dir = os.path.join(os.path.dirname(self.video_path), 'video_splits')
         os.makedirs(self.video_splits_dir, exist_ok=True)
 
-        self.nlp = spacy.load("en_core_web_lg")
-        self.pre_text = None
-
+        # The OCR reader and spaCy model are only loaded once OCR is enabled
         self.video_ocr_extractor = VideoOCRExtractorProvider()
+        self.ocr_detector = OCRChangeDetector(self.video_ocr_extractor)
 
 
-    def get_frames(self, start_frame_id, end_frame_id = None):
-        return self.frame_buffer.get_frames(start_frame_id, end_frame_id)
+    def get_frames(self, start_frame_id, end_frame_id = None, copy = False):
+        return self.frame_buffer.get_frames(start_frame_id, end_frame_id, copy = copy)
 
 
-    def get_frames_to_latest(self, frame_id, before_frame_nums = 5):
-        return self.frame_buffer.get_frames_to_latest(frame_id, before_frame_nums)
+    def get_frames_to_latest(self, frame_id, before_frame_nums = 5, copy = False):
+        return self.frame_buffer.get_frames_to_latest(frame_id, before_frame_nums, copy = copy)
 
 
-    def get_video(self, start_frame_id, end_frame_id = None):
-        path = os.path.join(self.video_splits_dir, 'video_{:06d}.mp4'.format(start_frame_id))
-        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, self.frame_size)
+    def get_clip(self, start_frame_id, end_frame_id = None):
+        """
+        Get the clip of a frame id range, without encoding it until its file is needed
+        """
+        key = (start_frame_id, end_frame_id)
 
-        frames = self.get_frames(start_frame_id, end_frame_id)
-        for frame in frames:
-            writer.write(frame[1])
-        writer.release()
+        with self.clips_lock:
+            if key in self.clips:
+                self.clips.move_to_end(key)
+                return self.clips[key]
 
-        return path
+            path = os.path.join(self.video_splits_dir, 'video_{:06d}.mp4'.format(start_frame_id))
+            clip = VideoClip(path, self, start_frame_id, end_frame_id)
+
+            # Clips without an end id grow with the recording, they cannot be reused
+            if end_frame_id is not None:
+                self.clips[key] = clip
+                if len(self.clips) > MAX_CACHED_CLIPS:
+                    self.clips.popitem(last=False)
+
+        return clip
+
+
+    def get_video(self, start_frame_id, end_frame_id = None):
+        return self.get_clip(start_frame_id, end_frame_id).path
 
 
     def clear_frame_buffer(self):
@@ -152,15 +337,24 @@ class VideoRecordProvider(BaseProvider):
         return self.current_frame_id
 
 
+    def get_latest_frame(self):
+        """
+        Get the current frame with its capture time and screen region, for the frame source
+        """
+        frame, frame_time = self.current_frame, self.current_frame_time
+        if frame is None:
+            return None
+        return frame, frame_time, self.screen_region
+
+
     def capture_screen(self, frame_buffer: FrameBuffer):
+        """
+        Capture stage: grab frames at the configured cadence and hand them to the encode and OCR stages
+        """
         logger.write('Screen capture started')
 
-        video_name = os.path.split(self.video_path)[1].split('.')[0]
-        video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
-        video_writer = cv2.VideoWriter(video_slice_path,
-                                       cv2.VideoWriter_fourcc(*'mp4v'),
-                                       self.fps,
-                                       self.frame_size)
+        interval = config.duplicate_frames / config.video_fps
+        next_capture_time = time.perf_counter()
 
         with mss.mss() as sct:
             region = self.screen_region
@@ -173,53 +367,39 @@ class VideoRecordProvider(BaseProvider):
 
             while self.thread_flag:
                 try:
+                    start = time.perf_counter()
+
                     frame = sct.grab(region)
-                    frame = np.array(frame) # Convert to numpy array
+                    frame_time = time.time()
+                    frame = cv2.cvtColor(np.asarray(frame), cv2.COLOR_BGRA2BGR)
 
-                    # if config.ocr_enabled is true, start ocr and check whether the text is different from the previous one
-                    if config.ocr_enabled:
-                        cur_text = self.video_ocr_extractor.extract_text(frame, return_full=0)
-                        cur_text = cur_text[0]
-                        cur_text = " ".join(cur_text)
-
-                        if self.pre_text is None:
-                            self.pre_text = cur_text
-                        else:
-                            emb1 = self.nlp(self.pre_text)
-                            emb2 = self.nlp(cur_text)
-
-                            score = emb1.similarity(emb2)
-
-                            if score < config.ocr_similarity_threshold:
-                                config.ocr_different_previous_text = True
-                            else:
-                                config.ocr_different_previous_text = False
-                            self.pre_text = cur_text
-
-                    # if config.ocr_enabled is false, the ocr is not enabled, so the pre_text should be None
-                    if not config.ocr_enabled and self.pre_text is not None:
-                        self.pre_text = None
-
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
-                    video_writer.write(frame)
-                    self.frames_count += 1
-
-                    if self.frames_count % self.frames_per_slice == 0:
-                        # Release the previous video writer
-                        video_writer.release()
-
-                        # Create a new video writer
-                        video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
-                        video_writer = cv2.VideoWriter(video_slice_path,
-                                                       cv2.VideoWriter_fourcc(*'mp4v'),
-                                                       self.fps,
-                                                       self.frame_size)
+                    first_frame_id = self.current_frame_id + 1
 
                     self.current_frame = frame
+                    self.current_frame_time = frame_time
                     for i in range(config.duplicate_frames):
                         self.current_frame_id += 1
                         frame_buffer.add_frame(self.current_frame_id, frame)
-                    time.sleep(config.duplicate_frames / config.video_fps - 0.05) # 0.05: time for taking a screenshots
+
+                    self._put_frame(self.encode_queue, (frame, first_frame_id, self.current_frame_id), config.video_encode_backpressure)
+
+                    # OCR only needs the latest sampled frame
+                    if config.ocr_enabled:
+                        if self.ocr_detector.should_sample(frame_time):
+                            self._put_frame(self.ocr_queue, frame, constants.VIDEO_BACKPRESSURE_DROP_OLDEST, count_drops=False)
+                    else:
+                        # the ocr is not enabled, so the previous text should be forgotten
+                        self.ocr_detector.reset()
+
+                    self._record_stage_time("capture", time.perf_counter() - start)
+
+                    # Sleep until the next capture is due, so slow steps do not shift the cadence
+                    next_capture_time += interval
+                    delay = next_capture_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_capture_time = time.perf_counter()
 
                     # Check the flag at regular intervals
                     if not self.thread_flag:
@@ -229,17 +409,128 @@ class VideoRecordProvider(BaseProvider):
                     logger.write('Screen capture interrupted')
                     self.finish_capture()
 
-            video_writer.release()
+
+    def encode_frames(self):
+        """
+        Encode stage: write the captured frames to the video slices
+        """
+        video_name = os.path.split(self.video_path)[1].split('.')[0]
+        video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
+        video_writer = cv2.VideoWriter(video_slice_path,
+                                       cv2.VideoWriter_fourcc(*'mp4v'),
+                                       self.fps,
+                                       self.frame_size)
+
+        while True:
+            item = self.encode_queue.get()
+            if item is None:
+                break
+
+            start = time.perf_counter()
+
+            frame, first_frame_id, last_frame_id = item
+            video_writer.write(frame)
+            self.segment_index.add_frame(video_slice_path, first_frame_id, last_frame_id)
+            self.frames_count += 1
+
+            if self.frames_count % self.frames_per_slice == 0:
+                # Release the previous video writer
+                video_writer.release()
+                self.segment_index.close_segment(video_slice_path)
+
+                # Create a new video writer
+                video_slice_path = os.path.join(self.video_path_dir, video_name + '_slice_{:06d}.mp4'.format(self.frames_count // self.frames_per_slice))
+                video_writer = cv2.VideoWriter(video_slice_path,
+                                               cv2.VideoWriter_fourcc(*'mp4v'),
+                                               self.fps,
+                                               self.frame_size)
+
+            self._record_stage_time("encode", time.perf_counter() - start)
+
+        video_writer.release()
+        self.segment_index.close_segment(video_slice_path)
+
+
+    def check_ocr_text(self):
+        """
+        OCR stage: check whether the text on the latest sampled frame differs from the previous one
+        """
+        while True:
+            frame = self.ocr_queue.get()
+            if frame is None:
+                break
+
+            # OCR may have been disabled since the frame was queued
+            if not config.ocr_enabled:
+                continue
+
+            start = time.perf_counter()
+            self.ocr_detector.process(frame)
+            self._record_stage_time("ocr", time.perf_counter() - start)
+
+
+    def get_stage_stats(self):
+        """
+        Get the per-stage timings and the frames dropped by backpressure
+        """
+        with self.stats_lock:
+            stats = {stage: dict(timings) for stage, timings in self.stage_stats.items()}
+            stats["dropped_frames"] = self.dropped_frames
+            stats["encode_queue_size"] = self.encode_queue.qsize()
+            return stats
+
+
+    def _put_frame(self, frame_queue, item, backpressure, count_drops=True):
+
+        if backpressure == constants.VIDEO_BACKPRESSURE_BLOCK:
+            frame_queue.put(item)
+            return
+
+        while True:
+            try:
+                frame_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    frame_queue.get_nowait()
+                    if count_drops:
+                        with self.stats_lock:
+                            self.dropped_frames += 1
+                except queue.Empty:
+                    pass
+
+
+    def _record_stage_time(self, stage, seconds):
+
+        with self.stats_lock:
+            timings = self.stage_stats[stage]
+            timings["count"] += 1
+            timings["total_seconds"] += seconds
+            timings["max_seconds"] = max(timings["max_seconds"], seconds)
 
 
     def start_capture(self):
+        self.encode_thread.start()
+        self.ocr_thread.start()
         self.thread.start()
+        FrameSource().attach_recorder(self)
 
 
     def finish_capture(self):
         if not self.thread.is_alive():
             logger.write('Screen capture thread is not executing')
         else:
+            FrameSource().detach_recorder(self)
             self.thread_flag = False  # Set the flag to False to signal the thread to stop
             self.thread.join()  # Now we wait for the thread to finish
+
+            # Let the encoder drain its queue, the OCR stage can stop right away
+            self.encode_queue.put(None)
+            self._put_frame(self.ocr_queue, None, constants.VIDEO_BACKPRESSURE_DROP_OLDEST, count_drops=False)
+            self.encode_thread.join()
+            self.ocr_thread.join()
+
             logger.write('Screen capture finished')
+            logger.write(f'Frame buffer stats: {self.frame_buffer.get_stats()}')
+            logger.write(f'Recorder stage stats: {self.get_stage_stats()}')
+            logger.write(f'OCR change detector stats: {self.ocr_detector.get_stats()}')
@@ -0,0 +1,220 @@
+import bisect
+import threading
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from cradle.log import Logger
+from cradle.utils.frame_source import LazyPath
+
+logger = Logger()
+
+
+@dataclass
+class VideoSegment:
+
+    path: str
+    first_ids: List[int] = field(default_factory=list) # first frame id of each written frame, in file order
+    last_frame_id: int = -1
+    closed: bool = False # the writer is released, so the file can be read
+
+
+class VideoSegmentIndex():
+    """
+    Maps frame ids to the slice files the recorder has already encoded.
+
+    The recorder writes each captured frame once and gives it duplicate_frames consecutive frame ids, so every
+    written frame covers a range of ids. The position of a frame in its file is kept instead of a byte offset, as
+    the mp4 container written by OpenCV only has its index at the end of the file, and positions are what
+    cv2.VideoCapture seeks by. Segments can only be read once closed.
+    """
+
+    def __init__(self):
+
+        self.segments: List[VideoSegment] = []
+        self.segment_first_ids: List[int] = []
+        self.lock = threading.Lock()
+
+
+    def add_frame(self, path: str, first_frame_id: int, last_frame_id: int) -> None:
+
+        with self.lock:
+            if len(self.segments) == 0 or self.segments[-1].path != path:
+                self.segments.append(VideoSegment(path))
+                self.segment_first_ids.append(first_frame_id)
+
+            segment = self.segments[-1]
+            segment.first_ids.append(first_frame_id)
+            segment.last_frame_id = last_frame_id
+
+
+    def close_segment(self, path: str) -> None:
+
+        with self.lock:
+            for segment in reversed(self.segments):
+                if segment.path == path:
+                    segment.closed = True
+                    break
+
+
+    def find_frame(self, frame_id: int) -> Optional[Tuple[VideoSegment, int]]:
+        """Return the segment holding the frame id and the frame position in its file, or None."""
+
+        with self.lock:
+            i = bisect.bisect_right(self.segment_first_ids, frame_id) - 1
+            if i < 0 or frame_id > self.segments[i].last_frame_id:
+                return None
+
+            segment = self.segments[i]
+            position = bisect.bisect_right(segment.first_ids, frame_id) - 1
+
+            return segment, position
+
+
+    def next_closed_frame_id(self, frame_id: int) -> Optional[int]:
+        """Return the first frame id of the first closed segment starting after frame_id, or None."""
+
+        with self.lock:
+            i = bisect.bisect_right(self.segment_first_ids, frame_id)
+            for segment in self.segments[i:]:
+                if segment.closed:
+                    return segment.first_ids[0]
+
+            return None
+
+
+    def get_segments(self, start_frame_id: int, end_frame_id: int) -> List[Tuple[str, int, int]]:
+        """List the (path, first position, last position) of the written frames covering the id range."""
+
+        with self.lock:
+            segments = []
+            for segment in self.segments:
+                if segment.last_frame_id < start_frame_id or segment.first_ids[0] > end_frame_id:
+                    continue
+
+                first = max(bisect.bisect_right(segment.first_ids, start_frame_id) - 1, 0)
+                last = bisect.bisect_right(segment.first_ids, end_frame_id) - 1
+                segments.append((segment.path, first, last))
+
+            return segments
+
+
+class VideoClip(LazyPath):
+    """
+    Frame-id range of the recording, usable wherever a video clip path is expected.
+
+    The string value is the path of the clip file, which is only encoded when `path` is first read, e.g. by an
+    external frame extractor. Consumers that work on frames use iter_frames instead, which reads the frame buffer
+    and falls back to decoding the slice files already written by the recorder for evicted frames. Frames evicted
+    from the buffer while their slice is still open cannot be recovered, as the mp4 index is only written when the
+    slice is closed, so they are skipped with a warning.
+    """
+
+    def __new__(cls, path: str, recorder, start_frame_id: int, end_frame_id: int):
+
+        clip = super().__new__(cls, path)
+
+        clip.recorder = recorder
+        clip.start_frame_id = start_frame_id
+        clip.end_frame_id = end_frame_id
+
+        clip._lock = threading.Lock()
+        clip._encoded = False
+
+        return clip
+
+
+    def _materialize(self) -> None:
+
+        with self._lock:
+            if not self._encoded:
+                self._encode()
+                self._encoded = True
+
+
+    def get_segments(self) -> List[Tuple[str, int, int]]:
+        """The (path, first position, last position) of the already written slice frames covering the clip."""
+        end_frame_id = self.end_frame_id if self.end_frame_id is not None else self.recorder.get_current_frame_id()
+        return self.recorder.segment_index.get_segments(self.start_frame_id, end_frame_id)
+
+
+    def iter_frames(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yield the (frame id, BGR frame) of the clip, one per frame id as in the encoded clip."""
+
+        end_frame_id = self.end_frame_id if self.end_frame_id is not None else self.recorder.get_current_frame_id()
+
+        frame_id = self.start_frame_id
+        while frame_id <= end_frame_id:
+
+            frames = self.recorder.get_frames(frame_id, end_frame_id)
+            if len(frames) > 0 and frames[0][0] == frame_id:
+                # Frames still in the buffer are served until the first gap
+                for buffered_id, frame in frames:
+                    if buffered_id != frame_id:
+                        break
+                    yield buffered_id, frame
+                    frame_id += 1
+                continue
+
+            # Decode up to the first buffered frame, if any
+            decode_end_id = frames[0][0] - 1 if len(frames) > 0 else end_frame_id
+            decoded = self._decode_frames(frame_id, decode_end_id)
+            if len(decoded) == 0:
+                # Neither buffered nor in a closed slice, e.g. before the recording started, or evicted from the
+                # buffer while their slice is still being written. Skip to the next frame that can be read.
+                next_frame_id = decode_end_id + 1
+                next_closed_frame_id = self.recorder.segment_index.next_closed_frame_id(frame_id)
+                if next_closed_frame_id is not None:
+                    next_frame_id = min(next_frame_id, next_closed_frame_id)
+
+                logger.warn(f"Frames {frame_id} to {next_frame_id - 1} of the clip are neither buffered nor in a closed "
+                            f"slice, skipping {next_frame_id - frame_id} frame ids")
+                frame_id = next_frame_id
+                continue
+
+            for decoded_id, frame in decoded:
+                yield decoded_id, frame
+            frame_id = decoded[-1][0] + 1
+
+
+    def _decode_frames(self, start_frame_id: int, end_frame_id: int) -> List[Tuple[int, np.ndarray]]:
+        """Decode the frames from start_frame_id to the end of its closed segment, or to end_frame_id."""
+
+        location = self.recorder.segment_index.find_frame(start_frame_id)
+        if location is None or not location[0].closed:
+            return []
+
+        segment, position = location
+        capture = cv2.VideoCapture(segment.path)
+        capture.set(cv2.CAP_PROP_POS_FRAMES, position)
+
+        frames = []
+        frame_id = start_frame_id
+        try:
+            while frame_id <= end_frame_id and position < len(segment.first_ids):
+                success, frame = capture.read()
+                if not success:
+                    break
+
+                next_first_id = segment.first_ids[position + 1] if position + 1 < len(segment.first_ids) else segment.last_frame_id + 1
+                while frame_id < next_first_id and frame_id <= end_frame_id:
+                    frames.append((frame_id, frame))
+                    frame_id += 1
+
+                position += 1
+        finally:
+            capture.release()
+
+        return frames
+
+
+    def _encode(self) -> None:
+
+        writer = cv2.VideoWriter(str(self), cv2.VideoWriter_fourcc(*'mp4v'), self.recorder.fps, self.recorder.frame_size)
+        for _, frame in self.iter_frames():
+            writer.write(frame)
+        writer.release()
+
+        logger.debug(f"Encoded video clip {str(self)} for frames ({self.start_frame_id}, {self.end_frame_id})")
@@ -1,4 +1,5 @@
 import os
+import threading
 import time
 from copy import deepcopy
 from typing import Dict, Any, List
@@ -11,9 +12,11 @@ from cradle.environment.ui_control_factory import UIControlFactory
 from cradle.log import Logger
 from cradle.module.executor import Executor
 from cradle.planner.planner import Planner
+from cradle.runner.stage_scheduler import StageScheduler
 from cradle.config import Config
 from cradle.memory import LocalMemory
 from cradle.provider.llm.llm_factory import LLMFactory
+from cradle.provider.llm.completion_cache import CompletionCache
 from cradle.provider.sam_provider import SamProvider
 from cradle.gameio.io_env import IOEnvironment
 from cradle.gameio.game_manager import GameManager
@@ -134,6 +137,40 @@ class PipelineRunner():
         self.checkpoint_path = os.path.join(config.work_dir, './checkpoints')
         os.makedirs(self.checkpoint_path, exist_ok=True)
 
+        # Init turn scheduler
+        self.working_area_lock = threading.Lock()
+        self.turn_scheduler = self.build_turn_scheduler()
+
+
+    def build_turn_scheduler(self) -> StageScheduler:
+
+        if not config.pipelined_turns:
+            scheduler = StageScheduler(concurrent=False)
+            scheduler.add_stage("information_gathering", lambda: self.run_information_gathering(debug=False))
+            scheduler.add_stage("self_reflection", self.run_self_reflection, depends_on=["information_gathering"])
+            scheduler.add_stage("task_inference", self.run_task_inference, depends_on=["self_reflection"])
+            scheduler.add_stage("skill_curation", self.run_skill_curation, depends_on=["task_inference"])
+            scheduler.add_stage("action_planning", self.run_action_planning, depends_on=["skill_curation"])
+            scheduler.add_stage("execution", self.execute_actions, depends_on=["action_planning"])
+            return scheduler
+
+        # Self-reflection only waits for information gathering if its prompt uses the current image description
+        self_reflection_template = kget(self.planner.templates, constants.SELF_REFLECTION_MODULE, default=constants.EMPTY_STRING)
+        needs_image_description = f"<${constants.CURRENT_IMAGE_DESCRIPTION}$>" in self_reflection_template
+
+        scheduler = StageScheduler(concurrent=True)
+        scheduler.add_stage("screen_change", self.screen_change_preprocess)
+        scheduler.add_stage("som_augmentation", self.som_augmentation_preprocess, depends_on=["screen_change"])
+        scheduler.add_stage("information_gathering", self.run_pipelined_information_gathering, depends_on=["som_augmentation"])
+        scheduler.add_stage("self_reflection", self.run_pipelined_self_reflection,
+                            depends_on=["information_gathering"] if needs_image_description else ["screen_change"])
+        scheduler.add_stage("task_inference", self.run_task_inference, depends_on=["information_gathering", "self_reflection"])
+        scheduler.add_stage("skill_curation", self.run_skill_curation, depends_on=["task_inference"])
+        scheduler.add_stage("action_planning", self.run_action_planning, depends_on=["skill_curation"])
+        scheduler.add_stage("execution", self.execute_actions, depends_on=["action_planning"], in_thread=False)
+
+        return scheduler
+
 
     def run(self):
 
@@ -150,7 +187,7 @@ class PipelineRunner():
         start_frame_id = self.video_recorder.get_current_frame_id()
 
         # First sense
-        cur_screenshot_path = self.gm.capture_screen()
+        cur_screenshot_path = self.gm.capture_frame()
         mouse_x, mouse_y = io_env.get_mouse_position()
 
         time.sleep(2)
@@ -186,23 +223,8 @@ class PipelineRunner():
                 logger.write(f'>>> Overall Task Description: {self.task_description}')
                 logger.write(f'>>> Agent loop #{self.count_turns}')
 
-                # Information gathering
-                self.run_information_gathering(debug=False)
-
-                # Self-reflection
-                self.run_self_reflection()
-
-                # Task inference
-                self.run_task_inference()
-
-                # Skill Curation
-                self.run_skill_curation()
-
-                # Action planning
-                self.run_action_planning()
-
-                # Skill execution
-                self.execute_actions()
+                # Information gathering, self-reflection, task inference, skill curation, action planning and skill execution
+                self.turn_scheduler.run_turn()
 
                 # self.gm.store_skills()
                 self.memory.save()
@@ -229,6 +251,11 @@ class PipelineRunner():
     def pipeline_shutdown(self):
         self.gm.cleanup_io()
         self.video_recorder.finish_capture()
+        self.turn_scheduler.close()
+        self.memory.close()
+        logger.write(f'Mean stage wall times: {self.turn_scheduler.get_timing_summary()}')
+        if CompletionCache().enabled:
+            logger.write(f'Completion cache: {CompletionCache().get_stats()}')
         logger.write('>>> Bye.')
 
 
@@ -244,6 +271,31 @@ class PipelineRunner():
         self.information_gathering_postprocess(response)
 
 
+    def run_pipelined_information_gathering(self):
+
+        # Publish the module input and take a private copy, as self-reflection may be updating the working area
+        with self.working_area_lock:
+            self.memory.working_area.update(self.planner.information_gathering_.input_map)
+            input = self.memory.working_area.copy()
+
+        response = self.information_gathering(debug=False, input=input)
+
+        with self.working_area_lock:
+            self.information_gathering_postprocess(response)
+
+
+    def run_pipelined_self_reflection(self):
+
+        with self.working_area_lock:
+            self.self_reflection_preprocess()
+            input = self.memory.working_area.copy()
+
+        response = self.self_reflection(input=input)
+
+        with self.working_area_lock:
+            self.self_reflection_postprocess(response)
+
+
     def run_self_reflection(self):
 
         # 1. Prepare the parameters to call llm api
@@ -286,6 +338,17 @@ class PipelineRunner():
 
     def information_gathering_preprocess(self):
 
+        # Screen change detection and mouse overlay
+        self.screen_change_preprocess()
+
+        # SOM augmentation of the current screenshot
+        self.som_augmentation_preprocess()
+
+        self.memory.working_area.update(self.planner.information_gathering_.input_map)
+
+
+    def screen_change_preprocess(self):
+
         # > Pre-processing
         params = self.memory.working_area.copy()
 
@@ -326,7 +389,7 @@ class PipelineRunner():
         # Compare current screenshot with the previous to determine changes
         if mouse_position and previous_augmentation:
             previous_screenshot_path = previous_augmentation[constants.AUG_BASE_IMAGE_PATH]
-            count_same_of_pic = calculate_pixel_diff(previous_screenshot_path, cur_screenshot_path)
+            count_same_of_pic = calculate_pixel_diff(previous_screenshot_path, cur_screenshot_path, stop_above=config.pixel_diff_threshold)
             image_same_flag = count_same_of_pic <= config.pixel_diff_threshold
             mouse_position_same_flag = (
                 current_augmentation[constants.AUG_MOUSE_X] == previous_augmentation[constants.AUG_MOUSE_X] and
@@ -348,6 +411,26 @@ class PipelineRunner():
                 current_augmentation[constants.AUG_MOUSE_IMG_PATH] = draw_mouse_pointer_file(cur_screenshot_path, mouse_x, mouse_y)
             input[constants.IMAGES_INPUT_TAG_NAME][0][constants.IMAGE_PATH_TAG_NAME] = current_augmentation[constants.AUG_MOUSE_IMG_PATH]
 
+        # SOM results are added to the same augmentation entry by som_augmentation_preprocess
+        self.memory.add_recent_history_kv(constants.AUGMENTED_IMAGES_MEM_BUCKET, current_augmentation)
+
+
+    def som_augmentation_preprocess(self):
+
+        params = self.memory.working_area.copy()
+        input = self.planner.information_gathering_.input_map
+
+        previous_augmentation = params[constants.PREVIOUS_AUGMENTATION_INFO]
+        current_augmentation = self.memory.get_recent_history(constants.AUGMENTED_IMAGES_MEM_BUCKET, k=1)[-1]
+
+        cur_screenshot_path = current_augmentation[constants.AUG_BASE_IMAGE_PATH]
+        image_same_flag = current_augmentation[constants.IMAGE_SAME_FLAG]
+        mouse_position_same_flag = current_augmentation[constants.MOUSE_POSITION_SAME_FLAG]
+
+        mouse_position = kget(params, constants.MOUSE_POSITION)
+        if mouse_position:
+            mouse_x, mouse_y = mouse_position
+
         if config.use_sam_flag:
 
             logger.write(f'Starting SOM augmentation.')
@@ -379,11 +462,6 @@ class PipelineRunner():
                     current_augmentation[constants.AUG_SOM_MOUSE_IMG_PATH] = draw_mouse_pointer_file(current_augmentation[constants.AUG_SOM_IMAGE_PATH], mouse_x, mouse_y)
                 input[constants.IMAGES_INPUT_TAG_NAME][0][constants.IMAGE_PATH_TAG_NAME] = current_augmentation[constants.AUG_SOM_MOUSE_IMG_PATH]
 
-        if previous_augmentation is None:
-            previous_augmentation = current_augmentation.copy()
-
-        self.memory.add_recent_history_kv(constants.AUGMENTED_IMAGES_MEM_BUCKET, current_augmentation)
-
         subtask_description = constants.EMPTY_STRING
         if constants.SUBTASK_DESCRIPTION in params.keys():
             subtask_description = params[constants.SUBTASK_DESCRIPTION]
@@ -399,12 +477,13 @@ class PipelineRunner():
         }
         input[constants.GATHER_INFORMATION_CONFIGURATIONS] = gather_information_configurations
 
-        self.memory.working_area.update(input)
 
-
-    def information_gathering(self, debug):
+    def information_gathering(self, debug, input: Dict[str, Any] = None):
         logger.write(f'>> Calling INFORMATION GATHERING')
 
+        if input is None:
+            input = self.memory.working_area
+
         if debug:
             # Do not call GPT-4V, just take the screenshot
             response = {
@@ -413,7 +492,7 @@ class PipelineRunner():
                 }
             }
         else:
-            response = self.planner.information_gathering(input=self.memory.working_area)
+            response = self.planner.information_gathering(input=input)
 
         return response
 
@@ -467,8 +546,13 @@ class PipelineRunner():
         task_description = params[constants.TASK_DESCRIPTION]
         pre_action = params[constants.PRE_ACTION]
 
-        previous_augmentation = params[constants.PREVIOUS_AUGMENTATION_INFO]
-        current_augmentation = params[constants.CURRENT_AUGMENTATION_INFO]
+        # Read the augmentations from memory rather than from the information gathering response,
+        # so self-reflection can run while SOM augmentation and information gathering are in progress
+        current_augmentation = self.memory.get_recent_history(constants.AUGMENTED_IMAGES_MEM_BUCKET, k=1)[-1]
+        if self.count_turns == 0:
+            previous_augmentation = current_augmentation.copy()
+        else:
+            previous_augmentation = self.memory.get_recent_history(constants.AUGMENTED_IMAGES_MEM_BUCKET, k=2)[0]
 
         pre_decision_making_reasoning = params[constants.PRE_DECISION_MAKING_REASONING]
         exec_info = params[constants.EXEC_INFO]
@@ -499,7 +583,7 @@ class PipelineRunner():
                 }]
 
             input[constants.IMAGES_INPUT_TAG_NAME] = image_introduction
-            input[constants.CURRENT_IMAGE_DESCRIPTION] = current_augmentation[constants.IMAGE_DESCRIPTION]
+            input[constants.CURRENT_IMAGE_DESCRIPTION] = kget(current_augmentation, constants.IMAGE_DESCRIPTION, default=constants.EMPTY_STRING)
 
             input[constants.TASK_DESCRIPTION] = task_description
             input[constants.SKILL_LIBRARY] = self.skill_library
@@ -540,12 +624,15 @@ class PipelineRunner():
             self.memory.working_area.update(input)
 
 
-    def self_reflection(self):
+    def self_reflection(self, input: Dict[str, Any] = None):
+
+        if input is None:
+            input = self.memory.working_area
 
         if self.use_self_reflection and self.count_turns > 0:
             # >> Calling SELF REFLECTION
             logger.write(f'>> Calling SELF REFLECTION')
-            response = self.planner.self_reflection(input=self.memory.working_area)
+            response = self.planner.self_reflection(input=input)
 
         else:
             logger.write(f'No self-reflection in turn #{self.count_turns}')
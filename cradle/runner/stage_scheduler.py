@@ -0,0 +1,142 @@
+import asyncio
+import time
+from typing import Callable, Dict, List
+
+from cradle.log import Logger
+
+logger = Logger()
+
+
+class StageScheduler():
+    """
+    Run the stages of one agent turn following their dependency graph.
+
+    In concurrent mode, a stage starts as soon as all the stages it depends on have finished, so stages with no
+    dependency between them overlap on a long-lived asyncio loop. Otherwise, stages run one after another in the
+    order they were added. Wall times are recorded per stage and per turn in both modes, so the end-to-end turn
+    latency of the two can be compared.
+    """
+
+    def __init__(self, concurrent: bool = False):
+
+        self.concurrent = concurrent
+
+        self.stages: Dict[str, Dict] = {}
+        self.stage_timings: Dict[str, List[float]] = {}
+        self.turn_timings: List[float] = []
+
+        self.loop = None
+
+
+    def add_stage(self, name: str, func: Callable, depends_on: List[str] = None, in_thread: bool = True) -> None:
+        """
+        Add a stage to the graph. Dependencies must be added first, which keeps the graph acyclic.
+
+        Args:
+            name: Unique stage name.
+            func: Callable with no arguments running the stage.
+            depends_on: Names of the stages that must finish before this one starts.
+            in_thread: In concurrent mode, run the stage in a worker thread. Stages that must stay on the
+                main thread (e.g. keyboard and mouse control) should set it to False.
+        """
+
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already registered.")
+
+        depends_on = list(depends_on) if depends_on else []
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}. Stages must be added after their dependencies.")
+
+        self.stages[name] = {
+            "func": func,
+            "depends_on": depends_on,
+            "in_thread": in_thread,
+        }
+        self.stage_timings[name] = []
+
+
+    def run_turn(self) -> Dict[str, float]:
+        """Run all stages once and return the wall time of each stage in this turn."""
+
+        turn_timings = {}
+        start = time.perf_counter()
+
+        if self.concurrent:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self._run_graph(turn_timings))
+        else:
+            for name, stage in self.stages.items():
+                self._run_stage(name, stage, turn_timings)
+
+        turn_time = time.perf_counter() - start
+        self.turn_timings.append(turn_time)
+
+        stages_time = sum(turn_timings.values())
+        stage_report = ", ".join([f"{name}: {elapsed:.2f}s" for name, elapsed in turn_timings.items()])
+        logger.write(f"Turn wall time: {turn_time:.2f}s, sum of stage times: {stages_time:.2f}s ({stage_report})")
+
+        return turn_timings
+
+
+    def get_timing_summary(self) -> Dict[str, float]:
+        """Mean wall time per stage and per turn over all turns run so far."""
+
+        summary = {name: sum(timings) / len(timings) for name, timings in self.stage_timings.items() if len(timings) > 0}
+
+        if len(self.turn_timings) > 0:
+            summary["turn"] = sum(self.turn_timings) / len(self.turn_timings)
+
+        return summary
+
+
+    def close(self) -> None:
+
+        if self.loop is not None:
+            self.loop.close()
+            self.loop = None
+
+
+    def _run_stage(self, name: str, stage: Dict, turn_timings: Dict[str, float]) -> None:
+
+        start = time.perf_counter()
+        stage["func"]()
+        self._record(name, time.perf_counter() - start, turn_timings)
+
+
+    async def _run_stage_async(self, name: str, stage: Dict, dependencies: List[asyncio.Task], turn_timings: Dict[str, float]) -> None:
+
+        if len(dependencies) > 0:
+            await asyncio.gather(*dependencies)
+
+        start = time.perf_counter()
+
+        if stage["in_thread"]:
+            await asyncio.to_thread(stage["func"])
+        else:
+            stage["func"]()
+
+        self._record(name, time.perf_counter() - start, turn_timings)
+
+
+    async def _run_graph(self, turn_timings: Dict[str, float]) -> None:
+
+        tasks = {}
+        for name, stage in self.stages.items():
+            dependencies = [tasks[dependency] for dependency in stage["depends_on"]]
+            tasks[name] = asyncio.ensure_future(self._run_stage_async(name, stage, dependencies, turn_timings))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+
+    def _record(self, name: str, elapsed: float, turn_timings: Dict[str, float]) -> None:
+
+        self.stage_timings[name].append(elapsed)
+        turn_timings[name] = elapsed
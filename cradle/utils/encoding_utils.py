@@ -1,18 +1,95 @@
 import base64
+import hashlib
 import os
-from typing import Any, List
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
 import io
 
 import numpy as np
 import cv2
 from PIL import Image
 
+from cradle.config import Config
 from cradle.log.logger import Logger
 from cradle.utils.file_utils import assemble_project_path
+from cradle.utils.frame_source import FrameHandle
 from cradle.utils.string_utils import hash_text_sha256
 
+config = Config()
 logger = Logger()
 
+IMAGE_ENCODING_FORMATS = {
+    "jpeg": "JPEG",
+    "jpg": "JPEG",
+    "webp": "WEBP",
+    "png": "PNG",
+}
+
+
+class EncodedImageCache():
+    """
+    LRU cache of base64-encoded images, bounded by the total length of the encoded strings.
+
+    The same screenshot is usually sent to several modules in a turn, so entries are keyed by the file path and its
+    modification time, or by a digest of the pixels for in-memory images, together with the re-encoding settings.
+    The hash of the encoded string is computed once when an entry is added.
+    """
+
+    def __init__(self, max_bytes: int):
+
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[Tuple, Tuple[str, str, str]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+
+    def get(self, key: Tuple):
+
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return entry
+
+
+    def put(self, key: Tuple, encoded_image: str, image_type: str) -> Tuple[str, str, str]:
+
+        entry = (encoded_image, image_type, hash_text_sha256(encoded_image))
+
+        if len(encoded_image) > self.max_bytes:
+            return entry
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= len(self._entries.pop(key)[0])
+
+            self._entries[key] = entry
+            self._total_bytes += len(encoded_image)
+
+            while self._total_bytes > self.max_bytes:
+                _, (evicted_image, _, _) = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted_image)
+
+        return entry
+
+
+    def clear(self) -> None:
+
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+encoded_image_cache = EncodedImageCache(config.image_encoding_cache_max_bytes)
+
 
 def encode_base64(payload):
 
@@ -31,9 +108,47 @@ def decode_base64(payload):
 
 
 def encode_image_path(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_image = encode_image_binary(image_file.read(), image_path)
-        return encoded_image
+    encoded_image, _ = encode_image_path_cached(image_path)
+    return encoded_image
+
+
+def encode_image_path_cached(image_path, encoding_settings: Tuple = None) -> Tuple[str, str]:
+    """
+    Encode an image file to base64, reusing the result while the file is unchanged.
+
+    The image is re-encoded when an image encoding format is set, or when it has to be cropped or downscaled to the
+    max resolution, see get_image_encoding_settings. Returns the encoded image and its type, e.g. "jpeg".
+    """
+
+    if encoding_settings is None:
+        encoding_settings = get_image_encoding_settings()
+
+    stat = os.stat(image_path)
+    key = ("path", os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size) + encoding_settings
+
+    entry = encoded_image_cache.get(key)
+
+    if entry is None:
+        with open(image_path, "rb") as image_file:
+            image_binary = image_file.read()
+
+        image_type = image_path.split(".")[-1].lower()
+        image_format, quality, max_resolution, crop_region = encoding_settings
+
+        if image_format is not None or max_resolution is not None or crop_region is not None:
+            with Image.open(io.BytesIO(image_binary)) as image:
+                transform = get_image_transform(image.size, encoding_settings)
+                if image_format is not None or transform["size"] != image.size:
+                    if image_format is None:
+                        image_format = image_type if image_type in IMAGE_ENCODING_FORMATS else "jpeg"
+                    image_binary, image_type = _reencode_image(image, image_format, quality, transform)
+
+        entry = encoded_image_cache.put(key, encode_base64(image_binary), image_type)
+
+    encoded_image, image_type, image_hash = entry
+    logger.debug(f'|>. img_hash {image_hash}, path {image_path} .<|')
+
+    return encoded_image, image_type
 
 
 def encode_image_binary(image_binary, image_path=None):
@@ -49,18 +164,19 @@ def decode_image(base64_encoded_image):
     return decode_base64(base64_encoded_image)
 
 
-def encode_data_to_base64_path(data: Any) -> List[str]:
+def encode_data_to_base64_path(data: Any, encoding_settings: Tuple = None) -> List[str]:
     encoded_images = []
 
     if isinstance(data, (str, Image.Image, np.ndarray, bytes)):
         data = [data]
 
     for item in data:
-        if isinstance(item, str):
+        if isinstance(item, FrameHandle):  # in-memory screenshot, no need to wait for its file
+            image = item.array
+        elif isinstance(item, str):
             if os.path.exists(assemble_project_path(item)):
                 path = assemble_project_path(item)
-                encoded_image = encode_image_path(path)
-                image_type = path.split(".")[-1].lower()
+                encoded_image, image_type = encode_image_path_cached(path, encoding_settings)
                 encoded_image = f"data:image/{image_type};base64,{encoded_image}"
                 encoded_images.append(encoded_image)
             else:
@@ -70,22 +186,137 @@ def encode_data_to_base64_path(data: Any) -> List[str]:
 
         elif isinstance(item, bytes):  # mss grab bytes
             image = Image.frombytes('RGB', item.size, item.bgra, 'raw', 'BGRX')
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG")
         elif isinstance(item, Image.Image):  # PIL image
-            buffered = io.BytesIO()
-            item.save(buffered, format="JPEG")
+            image = item
         elif isinstance(item, np.ndarray):  # cv2 image array
-            item = cv2.cvtColor(item, cv2.COLOR_BGR2RGB)  # convert to RGB
-            image = Image.fromarray(item)
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG")
+            image = item
         elif item is None:
             logger.error("Tring to encode None image! Skipping it.")
             continue
 
-        encoded_image = encode_image_binary(buffered.getvalue())
-        encoded_image = f"data:image/jpeg;base64,{encoded_image}"
+        encoded_image, image_type = _encode_image_in_memory(image, encoding_settings)
+        encoded_image = f"data:image/{image_type};base64,{encoded_image}"
         encoded_images.append(encoded_image)
 
     return encoded_images
+
+
+def _encode_image_in_memory(image, encoding_settings: Tuple = None) -> Tuple[str, str]:
+    """Encode a PIL image or a BGR array, keyed in the cache by a digest of its pixels, which is cheaper than encoding it."""
+
+    if encoding_settings is None:
+        encoding_settings = get_image_encoding_settings()
+
+    image_format, quality, max_resolution, crop_region = encoding_settings
+    if image_format is None:
+        image_format = "jpeg"
+        quality = None # keep the encoder default, as before re-encoding was configurable
+
+    if isinstance(image, np.ndarray):
+        pixels = np.ascontiguousarray(image)
+        key = ("array", hashlib.sha1(pixels.data).hexdigest(), pixels.shape, pixels.dtype.str)
+    else:
+        key = ("image", hashlib.sha1(image.tobytes()).hexdigest(), image.size, image.mode)
+    key += (image_format, quality, max_resolution, crop_region)
+
+    entry = encoded_image_cache.get(key)
+
+    if entry is None:
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+        transform = get_image_transform(image.size, encoding_settings)
+        image_binary, image_type = _reencode_image(image, image_format, quality, transform)
+        entry = encoded_image_cache.put(key, encode_base64(image_binary), image_type)
+
+    encoded_image, image_type, image_hash = entry
+    logger.debug(f'|>. img_hash {image_hash}, path <$bin_placeholder$> .<|')
+
+    return encoded_image, image_type
+
+
+def get_image_encoding_settings(image_format: str = None,
+                                quality: int = None,
+                                max_resolution: int = None,
+                                crop_region: Tuple = None) -> Tuple:
+    """
+    Build the settings used to encode images, falling back to the global configuration for unset values.
+
+    Args:
+        image_format: "jpeg", "webp" or "png". None keeps image files in their own format.
+        quality: Encoder quality for lossy formats.
+        max_resolution: Longest side in pixels. Larger images are downscaled, keeping the aspect ratio.
+        crop_region: ((left, top, right, bottom), (width, height)), images of exactly this size are cropped to the
+            box before downscaling, e.g. full-screen captures to the environment window.
+    """
+
+    if image_format is None:
+        image_format = config.image_encoding_format
+    if quality is None:
+        quality = config.image_encoding_quality
+    if max_resolution is None:
+        max_resolution = config.image_encoding_max_resolution
+
+    image_format = image_format.lower() if image_format else None
+    if image_format is not None and image_format not in IMAGE_ENCODING_FORMATS:
+        raise ValueError(f"Unsupported image encoding format: {image_format}")
+
+    if crop_region is not None:
+        crop_region = (tuple(crop_region[0]), tuple(crop_region[1]))
+
+    return image_format, quality, max_resolution, crop_region
+
+
+def get_image_transform(image_size: Tuple[int, int], encoding_settings: Tuple) -> Dict[str, Any]:
+    """
+    Describe how an image of the given size is cropped and scaled by the encoding settings.
+
+    A point (x, y) in the source image maps to ((x - offset[0]) * scale, (y - offset[1]) * scale) in the encoded
+    one. The scale is the same on both axes, so SOM labels and the mouse pointer drawn on the image keep their
+    relative positions.
+    """
+
+    _, _, max_resolution, crop_region = encoding_settings
+
+    box = None
+    width, height = image_size
+    if crop_region is not None and tuple(image_size) == tuple(crop_region[1]):
+        box = crop_region[0]
+        width, height = box[2] - box[0], box[3] - box[1]
+
+    scale = 1.0
+    if max_resolution is not None and max(width, height) > max_resolution:
+        scale = max_resolution / max(width, height)
+
+    return {
+        "source_size": tuple(image_size),
+        "crop_box": box,
+        "offset": (box[0], box[1]) if box is not None else (0, 0),
+        "scale": scale,
+        "size": (max(1, round(width * scale)), max(1, round(height * scale))) if scale != 1.0 else (width, height),
+    }
+
+
+def _reencode_image(image: Image.Image, image_format: str, quality: int = None, transform: Dict[str, Any] = None) -> Tuple[bytes, str]:
+
+    pil_format = IMAGE_ENCODING_FORMATS[image_format]
+
+    if transform is not None:
+        if transform["crop_box"] is not None:
+            image = image.crop(transform["crop_box"])
+        if transform["scale"] != 1.0:
+            image = image.resize(transform["size"], Image.LANCZOS)
+
+    if pil_format != "PNG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    save_kwargs = {}
+    if quality is not None and pil_format != "PNG":
+        save_kwargs["quality"] = quality
+
+    buffered = io.BytesIO()
+    image.save(buffered, format=pil_format, **save_kwargs)
+
+    image_type = "jpeg" if pil_format == "JPEG" else image_format
+
+    return buffered.getvalue(), image_type
@@ -0,0 +1,218 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+import cv2
+import mss
+import numpy as np
+from PIL import Image
+
+from cradle.config import Config
+from cradle.log import Logger
+from cradle.utils import Singleton
+
+config = Config()
+logger = Logger()
+
+
+class LazyPath(str):
+    """
+    Path of a file that is only written when `path` is first read, usable wherever a plain path is expected.
+
+    Subclasses keep the data to write and implement _materialize. They are immutable references, so copies return
+    the same object and pickles keep only the path.
+    """
+
+    @property
+    def path(self) -> str:
+        """Path of the file, writing it or waiting for its write if needed."""
+        self._materialize()
+        return str(self)
+
+
+    def _materialize(self) -> None:
+        raise NotImplementedError
+
+
+    def __copy__(self):
+        return self
+
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+    def __reduce__(self):
+        return (str, (str(self), ))
+
+
+class FrameHandle(LazyPath):
+    """
+    In-memory screenshot, usable wherever a screenshot path is expected.
+
+    The string value is the path the frame is saved to, so handles can be stored in memory, logged and renamed like
+    paths. The pixels are kept in `array`, a read-only BGR array, and consumers that accept handles use it instead of
+    reading the file back. The JPEG is written at most once, in the background, when save_async is called or when
+    `path` is first read; code that opens the file itself must go through `path` (or materialize_frame_path).
+    """
+
+    def __new__(cls, path: str, array: np.ndarray, tid: float = None, source: str = None, writer: ThreadPoolExecutor = None):
+
+        handle = super().__new__(cls, path)
+
+        array.flags.writeable = False
+
+        handle.array = array
+        handle.tid = tid
+        handle.source = source # "recorder" or "grab"
+
+        handle._writer = writer
+        handle._future = None
+        handle._lock = threading.Lock()
+
+        return handle
+
+
+    @property
+    def is_saved(self) -> bool:
+        return self._future is not None and self._future.done()
+
+
+    def save_async(self) -> Future:
+        """Schedule the JPEG write, once."""
+
+        with self._lock:
+            if self._future is None:
+                if self._writer is not None:
+                    self._future = self._writer.submit(self._write)
+                else:
+                    self._future = Future()
+                    self._future.set_result(self._write())
+            return self._future
+
+
+    def to_image(self) -> Image.Image:
+        return Image.fromarray(cv2.cvtColor(self.array, cv2.COLOR_BGR2RGB))
+
+
+    def _materialize(self) -> None:
+        self.save_async().result()
+
+
+    def _write(self) -> str:
+        path = str(self)
+        self.to_image().save(path)
+        return path
+
+
+def materialize_frame_path(item: Any) -> Any:
+    """Return a plain path for a frame handle, once its file exists. Other values are returned unchanged."""
+    if isinstance(item, FrameHandle):
+        return item.path
+    return item
+
+
+def open_frame_image(item: Any) -> Image.Image:
+    """Open a frame handle or an image path as a PIL image, without reading the file back for handles."""
+    if isinstance(item, FrameHandle):
+        return item.to_image()
+    return Image.open(item)
+
+
+class FrameSource(metaclass=Singleton):
+    """
+    Single source of screenshots.
+
+    While the video recorder is capturing the same region, its latest frame is reused if it is recent enough.
+    Otherwise the region is grabbed with an mss instance kept per thread, instead of opening one per screenshot.
+    Frames are returned as FrameHandles, so JPEG encoding only happens when a file is needed.
+    """
+
+    def __init__(self):
+
+        self.max_age = config.frame_source_max_age
+        self.recorder = None
+
+        self.stats = {
+            "recorder_frames": 0,
+            "grab_frames": 0,
+        }
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame_writer")
+
+
+    def attach_recorder(self, recorder) -> None:
+        """Serve frames from a recorder exposing get_latest_frame() -> (BGR frame, capture time, region) or None."""
+        self.recorder = recorder
+
+
+    def detach_recorder(self, recorder) -> None:
+        if self.recorder is recorder:
+            self.recorder = None
+
+
+    def grab(self, tid: float = None, screen_region: Tuple[int, int, int, int] = None) -> FrameHandle:
+
+        if tid is None:
+            tid = time.time()
+
+        if screen_region is None:
+            screen_region = config.env_region
+
+        path = config.work_dir + "/screen_" + str(tid) + ".jpg"
+
+        frame = self._get_recorder_frame(screen_region)
+        if frame is not None:
+            source = "recorder"
+        else:
+            frame = self._grab_region(screen_region)
+            source = "grab"
+
+        with self._lock:
+            self.stats[source + "_frames"] += 1
+
+        return FrameHandle(path, frame, tid=tid, source=source, writer=self._writer)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+
+    def _get_recorder_frame(self, screen_region: Tuple[int, int, int, int]) -> np.ndarray:
+
+        recorder = self.recorder
+        if recorder is None:
+            return None
+
+        latest = recorder.get_latest_frame()
+        if latest is None:
+            return None
+
+        frame, capture_time, region = latest
+        if tuple(region) != tuple(screen_region) or time.time() - capture_time > self.max_age:
+            return None
+
+        return frame
+
+
+    def _grab_region(self, screen_region: Tuple[int, int, int, int]) -> np.ndarray:
+
+        # mss instances hold per-thread OS handles, so each thread keeps its own
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = mss.mss()
+            self._local.sct = sct
+
+        region = {
+            "left": screen_region[0],
+            "top": screen_region[1],
+            "width": screen_region[2],
+            "height": screen_region[3],
+        }
+
+        screen_image = sct.grab(region)
+        return cv2.cvtColor(np.asarray(screen_image), cv2.COLOR_BGRA2BGR)
@@ -4,6 +4,9 @@ import time
 import re
 import random
 import math
+import threading
+from collections import deque
+from functools import lru_cache
 from typing import List, Dict, Tuple
 
 import cv2
@@ -11,15 +14,14 @@ import matplotlib.pyplot as plt
 import mss
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageChops
-from scipy.ndimage import binary_fill_holes
+from scipy.ndimage import binary_fill_holes, find_objects
 import supervision as sv
-import torch
-from torchvision.ops import box_convert
 
 from cradle.constants import COLOURS
 from cradle.config import Config
 from cradle.gameio import IOEnvironment
 from cradle.log import Logger
+from cradle.utils.frame_source import FrameHandle, open_frame_image
 from cradle import constants
 
 config = Config()
@@ -187,7 +189,10 @@ def draw_region_on_image(image_path, coordinates, pic_name):
 
 def draw_mouse_pointer_file_(image_path: str, x, y) -> str:
 
-    image = cv2.imread(image_path)
+    if isinstance(image_path, FrameHandle):
+        image = image_path.array.copy()
+    else:
+        image = cv2.imread(image_path)
 
     # get the size of the image to see whether it is a padding
     height, width, _ = image.shape
@@ -203,36 +208,75 @@ def draw_mouse_pointer_file_(image_path: str, x, y) -> str:
     return draw_mouse_img_path
 
 
-def calculate_image_diff(path_1, path_2):
+def _load_rgb_array(image: Image.Image | str | np.ndarray) -> np.ndarray:
+    """Load an image path, frame handle, PIL image or array as an HxWxC uint8 array without alpha."""
+
+    if isinstance(image, FrameHandle):
+        return cv2.cvtColor(image.array, cv2.COLOR_BGR2RGB)
+
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            logger.error(f"The file at {image} does not exist.")
+            raise FileNotFoundError(f"The file at {image} does not exist.")
+        with Image.open(image) as img:
+            return np.asarray(img.convert("RGB"))
+
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("RGB"))
+
+    image = np.asarray(image)
+    if image.ndim == 2:
+        image = image[:, :, None]
+    elif image.shape[2] == 4:
+        image = image[:, :, :3]
+
+    return image
 
-    if not os.path.exists(path_1):
-        logger.error(f"The file at {path_1} does not exist.")
-        raise FileNotFoundError(f"The file at {path_1} does not exist.")
 
-    if not os.path.exists(path_2):
-        logger.error(f"The file at {path_2} does not exist.")
-        raise FileNotFoundError(f"The file at {path_2} does not exist.")
+def calculate_diff_mask(img1: np.ndarray, img2: np.ndarray, roi_mask: np.ndarray = None, tolerance: int = 0) -> np.ndarray:
+    """
+    Calculate the boolean mask of changed pixels between two in-memory images.
 
-    img1 = Image.open(path_1)
-    img2 = Image.open(path_2)
+    Args:
+        img1, img2: HxWxC uint8 arrays of the same shape.
+        roi_mask: Optional HxW boolean mask, only pixels inside it can be flagged as changed.
+        tolerance: Per-channel absolute difference at or below which a pixel is considered unchanged.
 
-    if img1.size != img2.size:
+    Returns:
+        HxW boolean array, True where any channel differs by more than the tolerance.
+    """
+
+    if img1.shape != img2.shape:
         msg = "Images do not have the same size."
         logger.error(msg)
         raise ValueError(msg)
 
-    diff = ImageChops.difference(img1, img2)
-    diff = diff.convert("RGBA")
+    if tolerance <= 0:
+        changed = np.any(img1 != img2, axis=-1)
+    else:
+        diff = np.abs(img1.astype(np.int16) - img2.astype(np.int16))
+        changed = np.any(diff > tolerance, axis=-1)
+
+    if roi_mask is not None:
+        changed &= roi_mask
+
+    return changed
+
+
+def calculate_image_diff(path_1, path_2):
+
+    img1 = _load_rgb_array(path_1)
+    img2 = _load_rgb_array(path_2)
+
+    if img1.shape != img2.shape:
+        msg = "Images do not have the same size."
+        logger.error(msg)
+        raise ValueError(msg)
 
-    pixels = diff.load()
-    width, height = diff.size
-    for y in range(height):
-        for x in range(width):
-            r, g, b, a = pixels[x, y]
-            if r == g == b == 0:
-                pixels[x, y] = (0, 0, 0, 0)
-            else:
-                pixels[x, y] = (r, g, b, 255)
+    # Unchanged pixels are fully transparent, changed ones keep their absolute difference and are opaque
+    diff = cv2.absdiff(img1, img2)
+    alpha = np.any(diff != 0, axis=-1).astype(np.uint8) * 255
+    diff = Image.fromarray(np.dstack([diff, alpha]), "RGBA")
 
     return diff
 
@@ -252,23 +296,45 @@ def save_image_diff(path_1, path_2):
 
 
 def calculate_pixel_diff_with_diffimage_path(output_path):
-    img = Image.open(output_path).convert("RGBA")
-    pixels = img.load()
-    width, height = img.size
+    with Image.open(output_path) as img:
+        alpha = np.asarray(img.convert("RGBA"))[:, :, 3]
+
+    return int(np.count_nonzero(alpha))
+
+
+def calculate_pixel_diff(path_1, path_2, roi_mask: np.ndarray = None, tolerance: int = None, stop_above: int = None) -> int:
+    """
+    Count the pixels that changed between two images, fully in memory.
+
+    Args:
+        path_1, path_2: The two images to compare, as paths, PIL images or arrays.
+        roi_mask: Optional HxW boolean mask restricting the comparison to a region of interest.
+        tolerance: Per-channel absolute difference considered unchanged. Defaults to config.pixel_diff_tolerance.
+        stop_above: Optional count threshold. If a strided preview of the frames already has more changed pixels
+            than this, the preview count is returned without scanning the full frames. The preview is a subset of
+            the full frame, so any `count <= stop_above` check gives the same answer as with the exact count.
+
+    Returns:
+        int: The number of changed pixels (or a lower bound above stop_above when the fast path triggers).
+    """
+
+    if tolerance is None:
+        tolerance = config.pixel_diff_tolerance
 
-    non_transparent_count = 0
-    for y in range(height):
-        for x in range(width):
-            _, _, _, a = pixels[x, y]
-            if a != 0:
-                non_transparent_count += 1
+    img1 = _load_rgb_array(path_1)
+    img2 = _load_rgb_array(path_2)
 
-    return non_transparent_count
+    if config.debug_mode and isinstance(path_1, str) and isinstance(path_2, str):
+        save_image_diff(path_1, path_2)
 
+    stride = config.pixel_diff_downsample_stride
+    if stop_above is not None and stride > 1:
+        preview_mask = roi_mask[::stride, ::stride] if roi_mask is not None else None
+        preview_count = int(np.count_nonzero(calculate_diff_mask(img1[::stride, ::stride], img2[::stride, ::stride], preview_mask, tolerance)))
+        if preview_count > stop_above:
+            return preview_count
 
-def calculate_pixel_diff(path_1, path_2):
-    diff_image_path = save_image_diff(path_1, path_2)
-    return calculate_pixel_diff_with_diffimage_path(diff_image_path)
+    return int(np.count_nonzero(calculate_diff_mask(img1, img2, roi_mask, tolerance)))
 
 
 def resize_image(image: Image.Image | str | np.ndarray, resize_ratio: float) -> Image.Image:
@@ -340,6 +406,36 @@ def process_image_for_masks(original_image: Image) -> list[np.ndarray]:
     return masks
 
 
+def process_image_for_labels(original_image: Image) -> Tuple[np.ndarray, int]:
+    """
+    Process the image into a single label image, one label per unique colour.
+
+    Labels are assigned in the same order as the masks returned by process_image_for_masks,
+    so label i corresponds to masks[i] without materializing one full-frame mask per colour.
+
+    Args:
+    original_image: A Image object of the original image.
+
+    Returns:
+    A tuple with the HxW int32 label image and the number of labels.
+    """
+    original_image_np = np.array(original_image)
+
+    # Assume the last channel is the alpha channel if the image has 4 channels
+    if original_image_np.shape[2] == 4:
+        original_image_np = original_image_np[:, :, :3]
+
+    # Packing RGB into one integer keeps the lexicographic colour order used by np.unique(axis=0)
+    packed = (original_image_np[:, :, 0].astype(np.uint32) << 16) | \
+             (original_image_np[:, :, 1].astype(np.uint32) << 8) | \
+             original_image_np[:, :, 2].astype(np.uint32)
+
+    _, labels = np.unique(packed.ravel(), return_inverse=True)
+    labels = labels.reshape(packed.shape).astype(np.int32)
+
+    return labels, int(labels.max()) + 1
+
+
 def display_binary_images_grid(images: list[np.ndarray], grid_size = None, margin: int = 10, cell_size = None):
     """
     Display binary ndarrays as images on a grid with clear separation between grid cells,
@@ -480,12 +576,17 @@ def refine_masks(masks: list[np.ndarray]) -> list[np.ndarray]:
     # Fill holes in each mask
     filled_masks = [binary_fill_holes(mask).astype(np.uint8) for mask in masks]
 
-    # Remove masks completely contained within other masks
+    # Remove masks completely contained within other masks, only testing pairs whose bounding boxes nest
+    boxes = [_mask_bbox(mask) for mask in filled_masks]
+
     refined_masks = []
     for i, mask_i in enumerate(filled_masks):
         contained = False
         for j, mask_j in enumerate(filled_masks):
             if i != j:
+                if boxes[i] is not None and (boxes[j] is None or not _bbox_within(boxes[i], boxes[j])):
+                    continue
+
                 # Check if mask_i is completely contained in mask_j
                 if np.array_equal(mask_i & mask_j, mask_i):
                     contained = True
@@ -497,6 +598,165 @@ def refine_masks(masks: list[np.ndarray]) -> list[np.ndarray]:
     return refined_masks
 
 
+def _mask_bbox(mask: np.ndarray) -> Tuple[int, int, int, int] | None:
+    """Inclusive (top, left, bottom, right) of the "on" pixels of a mask, or None if it is empty."""
+
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(np.any(mask, axis=0))
+
+    return int(rows[0]), int(cols[0]), int(rows[-1]), int(cols[-1])
+
+
+def _bbox_within(inner: Tuple[int, int, int, int], outer: Tuple[int, int, int, int]) -> bool:
+    return inner[0] >= outer[0] and inner[1] >= outer[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+def _upscale_label(labels: np.ndarray, label: int, slices: Tuple[slice, slice], out_size: Tuple[int, int]) -> Tuple[np.ndarray, int, int]:
+    """
+    Resize the mask of one label to out_size like resize_image does, but only over the label's neighbourhood.
+
+    The source crop keeps a margin wider than the resampling filter support, so the result matches
+    resizing the full-frame mask and cropping it afterwards.
+
+    Returns:
+        The boolean crop and its (top, left) offset in the output image.
+    """
+    small_h, small_w = labels.shape
+    out_w, out_h = out_size
+
+    if (out_w, out_h) == (small_w, small_h):
+        return labels[slices] == label, slices[0].start, slices[1].start
+
+    scale_x, scale_y = small_w / out_w, small_h / out_h
+    margin = 3
+
+    oy0 = max(0, math.floor((slices[0].start - margin) / scale_y))
+    oy1 = min(out_h, math.ceil((slices[0].stop + margin) / scale_y))
+    ox0 = max(0, math.floor((slices[1].start - margin) / scale_x))
+    ox1 = min(out_w, math.ceil((slices[1].stop + margin) / scale_x))
+
+    sy0 = max(0, math.floor(oy0 * scale_y) - margin)
+    sy1 = min(small_h, math.ceil(oy1 * scale_y) + margin)
+    sx0 = max(0, math.floor(ox0 * scale_x) - margin)
+    sx1 = min(small_w, math.ceil(ox1 * scale_x) + margin)
+
+    source = Image.fromarray((labels[sy0:sy1, sx0:sx1] == label).astype(np.uint8) * 255)
+    box = (ox0 * scale_x - sx0, oy0 * scale_y - sy0, ox1 * scale_x - sx0, oy1 * scale_y - sy0)
+    crop = np.array(source.resize((ox1 - ox0, oy1 - oy0), box=box)) > 0
+
+    return crop, oy0, ox0
+
+
+def refine_label_masks(labels: np.ndarray,
+                       resize_ratio: float = 1.0,
+                       threshold_percent: float = 5.0,
+                       kernel_size: int = 3,
+                       iterations: int = 5,
+                       containment_group_size: int = None) -> List[Tuple[int, int, np.ndarray]]:
+    """
+    Refine the segments of a label image, equivalent to running refine_masks on the per-colour masks.
+
+    Each segment is only processed inside its own (padded) bounding box, so memory scales with the number
+    and size of segments rather than segments x frame size. Containment is only tested exactly between
+    segments whose bounding boxes nest, found through an interval prefilter sorted by the left edge.
+
+    Args:
+        labels: HxW label image, as returned by process_image_for_labels.
+        resize_ratio: Ratio to resize each segment by before refinement, as resize_image would.
+        threshold_percent: Border proximity threshold, see remove_border_masks.
+        kernel_size: Structuring element size, see filter_thin_ragged_masks.
+        iterations: Morphological iterations, see filter_thin_ragged_masks.
+        containment_group_size: If set, containment is only checked between labels in the same
+            consecutive group of this size, matching refine_masks applied in batches.
+
+    Returns:
+        A list of (top, left, mask) tuples, where mask is the tight boolean crop of the refined segment.
+    """
+    small_h, small_w = labels.shape
+    out_w, out_h = int(small_w * resize_ratio), int(small_h * resize_ratio)
+
+    threshold_rows = int(out_h * (threshold_percent / 100))
+    threshold_cols = int(out_w * (threshold_percent / 100))
+
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    pad = iterations * (kernel_size // 2) + 1
+
+    segments = []
+    for label, slices in enumerate(find_objects(labels + 1)):
+
+        if slices is None:
+            continue
+
+        crop, top, left = _upscale_label(labels, label, slices, (out_w, out_h))
+        bbox = _mask_bbox(crop)
+        if bbox is None:
+            continue
+
+        rmin, cmin, rmax, cmax = bbox[0] + top, bbox[1] + left, bbox[2] + top, bbox[3] + left
+
+        # Remove masks whose "on" pixels are close to all four borders
+        if rmin < threshold_rows and rmax >= out_h - threshold_rows and cmin < threshold_cols and cmax >= out_w - threshold_cols:
+            continue
+
+        # Pad the crop so erosion, dilation and hole filling behave as on the full frame
+        y0, y1 = max(0, rmin - pad), min(out_h, rmax + 1 + pad)
+        x0, x1 = max(0, cmin - pad), min(out_w, cmax + 1 + pad)
+        region = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        region[rmin - y0:rmax - y0 + 1, cmin - x0:cmax - x0 + 1] = crop[bbox[0]:bbox[2] + 1, bbox[1]:bbox[3] + 1] * 255
+
+        eroded = cv2.erode(region, kernel, iterations=iterations)
+        opened = cv2.dilate(eroded, kernel, iterations=iterations) > 0
+        filled = binary_fill_holes(opened)
+
+        filled_bbox = _mask_bbox(filled)
+        if filled_bbox is None:
+            continue
+
+        segments.append((label,
+                         y0 + filled_bbox[0],
+                         x0 + filled_bbox[1],
+                         filled[filled_bbox[0]:filled_bbox[2] + 1, filled_bbox[1]:filled_bbox[3] + 1]))
+
+    if len(segments) == 0:
+        return []
+
+    # Inclusive (top, left, bottom, right) boxes and containment groups
+    boxes = np.array([(t, l, t + m.shape[0] - 1, l + m.shape[1] - 1) for _, t, l, m in segments])
+    if containment_group_size:
+        groups = np.array([label // containment_group_size for label, _, _, _ in segments])
+    else:
+        groups = np.zeros(len(segments), dtype=int)
+
+    order = np.argsort(boxes[:, 1], kind="stable")
+    sorted_left = boxes[order, 1]
+
+    refined = []
+    for i, (_, top_i, left_i, mask_i) in enumerate(segments):
+
+        # Candidates start at or left of segment i, then must also enclose its other three edges
+        candidates = order[:np.searchsorted(sorted_left, left_i, side="right")]
+        candidates = candidates[(candidates != i) &
+                                (groups[candidates] == groups[i]) &
+                                (boxes[candidates, 0] <= boxes[i, 0]) &
+                                (boxes[candidates, 2] >= boxes[i, 2]) &
+                                (boxes[candidates, 3] >= boxes[i, 3])]
+
+        contained = False
+        for j in candidates:
+            _, top_j, left_j, mask_j = segments[j]
+            window = mask_j[top_i - top_j:top_i - top_j + mask_i.shape[0], left_i - left_j:left_i - left_j + mask_i.shape[1]]
+            if np.all(window[mask_i]):
+                contained = True
+                break
+
+        if not contained:
+            refined.append((top_i, left_i, mask_i))
+
+    return refined
+
+
 def extract_masked_images(original_image: Image, masks: list[np.ndarray]):
     """
     Apply each mask to the original image and resize the image to fit the mask's bounding box,
@@ -568,6 +828,29 @@ def calculate_bounding_boxes(masks: List[np.ndarray]) -> Tuple[List[Dict], List[
     return sorted_bounding_boxes
 
 
+def calculate_segment_bounding_boxes(segments: List[Tuple[int, int, np.ndarray]]) -> List[Dict]:
+    """
+    Calculate bounding boxes for segments returned by refine_label_masks, in the format of calculate_bounding_boxes.
+
+    Args:
+        segments: A list of (top, left, mask) tuples with tight mask crops.
+
+    Returns:
+        A list containing dictionaries, each containing the "top", "left", "height", "width" of the bounding box for each segment.
+    """
+    bounding_boxes = [{
+        "top": float(top),
+        "left": float(left),
+        "height": float(mask.shape[0] - 1),
+        "width": float(mask.shape[1] - 1),
+    } for top, left, mask in segments]
+
+    # Sort bounding boxes from left to right, top to bottom
+    bounding_boxes.sort(key=lambda bbox: (bbox["top"], bbox["left"]))
+
+    return bounding_boxes
+
+
 def calculate_centroid(bbox: dict) -> tuple:
     """Calculate the centroid of a bounding box.
 
@@ -594,7 +877,7 @@ def plot_som(screenshot_filename, bounding_boxes):
 
 def plot_som_multicolor(screenshot_filename, bounding_boxes):
 
-    org_img = Image.open(screenshot_filename)
+    org_img = open_frame_image(screenshot_filename)
     font_path = "arial.ttf"
     font_size, padding = 20, 2
     font = ImageFont.truetype(font_path, font_size)
@@ -670,7 +953,7 @@ def plot_som_multicolor(screenshot_filename, bounding_boxes):
 
 
 def plot_som_unicolor(screenshot_filename, bounding_boxes):
-    org_img = Image.open(screenshot_filename)
+    org_img = open_frame_image(screenshot_filename)
     font_path = "arial.ttf"
     font_size, padding = 13, 1
     font = ImageFont.truetype(font_path, font_size)
@@ -1202,15 +1485,12 @@ def draw_coordinate_axis_on_screenshot(image,
     return image
 
 
-def clip_minimap(minimap_image_filename):
-
-    image = cv2.imread(minimap_image_filename)
-
-    # Get the dimensions of the image
-    height, width = image.shape[:2]
+@lru_cache(maxsize=8)
+def get_minimap_corner_mask(height: int, width: int) -> np.ndarray:
+    """Boolean mask of the triangular minimap corners to clear, computed once per minimap size."""
 
     # Create a mask of the same size as the image, initialized to white
-    mask = np.ones((height, width, 3), dtype=np.uint8) * 255
+    mask = np.ones((height, width), dtype=np.uint8) * 255
 
     # Define the size of the triangular mask at each corner
     triangle_size = int(180 * config.resolution_ratio)
@@ -1228,11 +1508,21 @@ def clip_minimap(minimap_image_filename):
     # Bottom-right corner
     cv2.fillConvexPoly(mask, np.array([[width, height], [width, height - triangle_size], [width - triangle_size, height]]), 0)
 
+    corner_mask = mask == 0
+    corner_mask.flags.writeable = False
+
+    return corner_mask
+
+
+def clip_minimap(minimap_image_filename):
+
+    image = cv2.imread(minimap_image_filename)
+
     # Apply the mask to the image
-    masked_image = cv2.bitwise_and(image, mask)
+    image[get_minimap_corner_mask(*image.shape[:2])] = 0
 
     # Save the result
-    cv2.imwrite(minimap_image_filename, masked_image)
+    cv2.imwrite(minimap_image_filename, image)
 
 
 def segment_minimap(screenshot_path):
@@ -1260,6 +1550,123 @@ def segment_minimap(screenshot_path):
     return minimap_image_filename
 
 
+class MinimapCapture():
+    """
+    Screen and minimap capture for closed-loop control skills.
+
+    Each capture grabs the screen once into a reused buffer, and cuts the minimap from the same grab, masking its
+    corners with a mask computed once. The returned arrays are views into buffers that the next capture overwrites,
+    so copy them to keep them. Files are only written by save, or on every capture in debug mode. The achieved
+    control-loop frequency is measured between captures.
+    """
+
+    def __init__(self,
+                 screen_region: tuple[int, int, int, int] = None,
+                 minimap_region: tuple[int, int, int, int] = None,
+                 debug: bool = False,
+                 rate_window: int = 50):
+
+        if screen_region is None:
+            screen_region = config.env_region
+
+        if minimap_region is None:
+            minimap_region = config.base_minimap_region
+
+        self.screen_region = tuple(screen_region)
+        self.minimap_region = tuple(minimap_region)
+        self.debug = debug
+
+        # Grab the smallest region containing both, which is the screen region when the minimap is inside it
+        left = min(self.screen_region[0], self.minimap_region[0])
+        top = min(self.screen_region[1], self.minimap_region[1])
+        right = max(self.screen_region[0] + self.screen_region[2], self.minimap_region[0] + self.minimap_region[2])
+        bottom = max(self.screen_region[1] + self.screen_region[3], self.minimap_region[1] + self.minimap_region[3])
+
+        self.grab_region = {
+            "left": left,
+            "top": top,
+            "width": right - left,
+            "height": bottom - top,
+        }
+
+        self.screen_slice = self._get_slice(self.screen_region)
+        self.minimap_slice = self._get_slice(self.minimap_region)
+        self.corner_mask = get_minimap_corner_mask(self.minimap_region[3], self.minimap_region[2])
+
+        self.buffer = np.empty((self.grab_region["height"], self.grab_region["width"], 3), dtype=np.uint8)
+        self.minimap_buffer = np.empty((self.minimap_region[3], self.minimap_region[2], 3), dtype=np.uint8)
+
+        self.sct = None
+        self.tid = None
+        self.capture_times = deque(maxlen=rate_window)
+
+
+    def capture(self, tid: float = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Grab the screen and return the (screen, masked minimap) BGR arrays."""
+
+        if self.sct is None:
+            self.sct = mss.mss()
+
+        screen_image = self.sct.grab(self.grab_region)
+        bgra = np.frombuffer(screen_image.raw, dtype=np.uint8).reshape(screen_image.height, screen_image.width, 4)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=self.buffer)
+
+        np.copyto(self.minimap_buffer, self.buffer[self.minimap_slice])
+        self.minimap_buffer[self.corner_mask] = 0
+
+        self.tid = tid if tid is not None else time.time()
+        self.capture_times.append(time.perf_counter())
+
+        if self.debug:
+            self.save()
+
+        return self.buffer[self.screen_slice], self.minimap_buffer
+
+
+    def save(self, tid: float = None) -> Tuple[str, str]:
+        """Write the last capture to the work dir, for consumers that need files."""
+
+        if tid is None:
+            tid = self.tid
+
+        output_dir = config.work_dir
+
+        screen_image_filename = output_dir + "/screen_" + str(tid) + ".jpg"
+        minimap_image_filename = output_dir + "/minimap_" + str(tid) + ".jpg"
+
+        cv2.imwrite(screen_image_filename, self.buffer[self.screen_slice])
+        cv2.imwrite(minimap_image_filename, self.minimap_buffer)
+
+        return screen_image_filename, minimap_image_filename
+
+
+    def get_frequency(self) -> float:
+        """Captures per second over the recent captures."""
+
+        if len(self.capture_times) < 2:
+            return 0.0
+
+        elapsed = self.capture_times[-1] - self.capture_times[0]
+        return (len(self.capture_times) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+    def close(self) -> None:
+
+        if self.sct is not None:
+            self.sct.close()
+            self.sct = None
+
+
+    def _get_slice(self, region: tuple[int, int, int, int]) -> Tuple[slice, slice]:
+
+        top = region[1] - self.grab_region["top"]
+        left = region[0] - self.grab_region["left"]
+        return slice(top, top + region[3]), slice(left, left + region[2])
+
+
+_minimap_captures = threading.local()
+
+
 def exec_clip_minimap(
         tid : float,
         screen_region : tuple[int, int, int, int] = None,
@@ -1271,42 +1678,20 @@ def exec_clip_minimap(
     if minimap_region is None:
         minimap_region = config.base_minimap_region
 
-    region = screen_region
-    region = {
-        "left": region[0],
-        "top": region[1],
-        "width": region[2],
-        "height": region[3],
-    }
-
-    output_dir = config.work_dir
-
-    # Save screenshots
-    screen_image_filename = output_dir + "/screen_" + str(tid) + ".jpg"
+    # Reuse one capture per thread and regions, mss instances are not shared across threads
+    captures = getattr(_minimap_captures, "captures", None)
+    if captures is None:
+        captures = {}
+        _minimap_captures.captures = captures
 
-    with mss.mss() as sct:
-        screen_image = sct.grab(region)
-        image = Image.frombytes("RGB", screen_image.size, screen_image.bgra, "raw", "BGRX")
-        image.save(screen_image_filename)
+    key = (tuple(screen_region), tuple(minimap_region))
+    if key not in captures:
+        captures[key] = MinimapCapture(screen_region, minimap_region)
 
-    minimap_image_filename = output_dir + "/minimap_" + str(tid) + ".jpg"
+    capture = captures[key]
+    capture.capture(tid)
 
-    mm_region = minimap_region
-    mm_region = {
-        "left": mm_region[0],
-        "top": mm_region[1],
-        "width": mm_region[2],
-        "height": mm_region[3],
-    }
-
-    with mss.mss() as sct:
-        minimap_image = sct.grab(mm_region)
-        mm_image = Image.frombytes("RGB", minimap_image.size, minimap_image.bgra, "raw", "BGRX")
-        mm_image.save(minimap_image_filename)
-
-    clip_minimap(minimap_image_filename)
-
-    return screen_image_filename, minimap_image_filename
+    return capture.save(tid)
 
 
 def convert_ocr_bbox_format(data):
@@ -1371,6 +1756,9 @@ def filter_intersecting_rectangles(rectangles1, rectangles2, padding=5):
 
 
 def annotate_with_coordinates(image_source, boxes, logits, phrases):
+    import torch
+    from torchvision.ops import box_convert
+
     h, w, _ = image_source.shape
     boxes = boxes * torch.Tensor([w, h, w, h])
     xyxy = box_convert(boxes=boxes, in_fmt="cxcywh", out_fmt="xyxy").numpy()
@@ -1392,6 +1780,7 @@ def annotate_with_coordinates(image_source, boxes, logits, phrases):
 
 
 def save_annotate_frame(image_source, boxes, logits, phrases, text_prompt, cur_screenshot_path):
+    import torch
 
     # Remove the main character itself from boxes
     if "person" in text_prompt.lower():
@@ -1524,6 +1913,8 @@ def segement_inventory(toolbarshot_path):
     return filenames
 
 def process_minimap_targets(image_path):
+    import torch
+    from torchvision.ops import box_convert
 
     minimap_image, boxes, logits, phrases = groundingdino_detect(image_path=segment_minimap(image_path),
                                                             text_prompt=constants.GD_PROMPT,
@@ -1,12 +1,11 @@
 import json
 import re
+import sys
 from typing import Optional, Tuple, Dict
 from collections import OrderedDict
 from collections.abc import Mapping, Iterable
 from datetime import datetime
 
-import torch
-
 from cradle import constants
 from cradle.utils.string_utils import contains_punctuation, is_numbered_bullet_list_item
 
@@ -20,9 +19,12 @@ def load_json(file_path):
 def serialize_data(item):
     """Recursively convert non-serializable items in the dictionary."""
 
+    # Tensors can only exist once torch is imported, so it is not imported here
+    torch = sys.modules.get("torch")
+
     if isinstance(item, (str, int, float, bool)):
         return item
-    elif isinstance(item, torch.Tensor):
+    elif torch is not None and isinstance(item, torch.Tensor):
         # Check if the tensor is 0-d (a scalar)
         if item.dim() == 0:
             # Convert scalar tensor to a Python number
@@ -0,0 +1,125 @@
+import time
+import threading
+import importlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from cradle.log import Logger
+from cradle.utils import Singleton
+
+logger = Logger()
+
+
+class ModelRegistry(metaclass=Singleton):
+    """
+    Loads heavy models (spaCy, EasyOCR, SAM, GroundingDINO) on first use instead of at import or construction.
+
+    Providers register a loader per model name, which also does the heavy imports, and call get() where the model
+    is needed. Models can be prewarmed in a background thread, and import and load times are kept per component for
+    the --profile-startup report.
+    """
+
+    def __init__(self):
+
+        self.loaders: Dict[str, Callable[[], Any]] = {}
+        self.models: Dict[str, Any] = {}
+
+        self.import_times: Dict[str, float] = {}
+        self.load_times: Dict[str, float] = {}
+
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._prewarmer = None
+
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+
+        with self._lock:
+            self.loaders[name] = loader
+            if name not in self._locks:
+                self._locks[name] = threading.Lock()
+
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self.models
+
+
+    def get(self, name: str) -> Any:
+        """Return the model, loading it on first use. Concurrent callers wait for a single load."""
+
+        if name in self.models:
+            return self.models[name]
+
+        if name not in self.loaders:
+            raise KeyError(f"Model {name} is not registered.")
+
+        with self._locks[name]:
+            if name not in self.models:
+                start = time.perf_counter()
+                model = self.loaders[name]()
+                self.load_times[name] = time.perf_counter() - start
+                self.models[name] = model
+
+                logger.write(f"Loaded model {name} in {self.load_times[name]:.2f}s")
+
+        return self.models[name]
+
+
+    def prewarm(self, names: List[str] = None) -> List[Future]:
+        """Load models in a background thread, all registered ones if names is None."""
+
+        if names is None:
+            names = list(self.loaders.keys())
+
+        with self._lock:
+            if self._prewarmer is None:
+                self._prewarmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model_prewarm")
+
+        futures = []
+        for name in names:
+            if name not in self.loaders:
+                logger.warn(f"Model {name} is not registered, it will not be prewarmed.")
+                continue
+            futures.append(self._prewarmer.submit(self._prewarm_model, name))
+
+        return futures
+
+
+    def import_module(self, module_name: str) -> Any:
+        """Import a module, recording the time it added to startup. Modules already imported cost nothing."""
+
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self.import_times.setdefault(module_name, time.perf_counter() - start)
+
+        return module
+
+
+    def get_profile(self) -> Dict[str, Dict[str, Any]]:
+
+        profile = {}
+        for module_name, seconds in self.import_times.items():
+            profile[module_name] = {"import_seconds": seconds}
+        for name in self.loaders.keys():
+            profile[name] = {"load_seconds": self.load_times.get(name), "loaded": self.is_loaded(name)}
+
+        return profile
+
+
+    def log_profile(self) -> None:
+
+        logger.write("Startup profile:")
+        for module_name, seconds in self.import_times.items():
+            logger.write(f"  import {module_name}: {seconds:.2f}s")
+        for name in self.loaders.keys():
+            if self.is_loaded(name):
+                logger.write(f"  load {name}: {self.load_times[name]:.2f}s")
+            else:
+                logger.write(f"  load {name}: not loaded")
+
+
+    def _prewarm_model(self, name: str) -> None:
+        try:
+            self.get(name)
+        except Exception as e:
+            logger.error(f"Failed to prewarm model {name}: {e}")
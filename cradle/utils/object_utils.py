@@ -1,27 +1,34 @@
 
-import torch
 import math
 import cv2
 import numpy as np
 
-try:
-    from groundingdino.util.inference import load_model, load_image
-except:
-    pass
-
+from cradle import constants
 from cradle.utils.singleton import Singleton
+from cradle.utils.model_registry import ModelRegistry
 from cradle.config import Config
 
 config = Config()
 
+
+def load_grounding_dino_model():
+    from groundingdino.util.inference import load_model
+    return load_model("./cache/GroundingDINO_SwinB_cfg.py", "./cache/groundingdino_swinb_cogcoor.pth")
+
+
+ModelRegistry().register(constants.MODEL_GROUNDING_DINO, load_grounding_dino_model)
+
+
 def unique_predict(
         model,
-        image: torch.Tensor,
+        image: "torch.Tensor",
         caption: str,
         box_threshold: float,
         device: str = "cuda",
 ):
 
+    import torch
+
     caption = caption.lower().strip()
     if not caption.endswith("."):
         caption = caption + " ."
@@ -65,9 +72,10 @@ class GroundingDINO(metaclass=Singleton):
 
         super(GroundingDINO, self).__init__()
 
-        self.detect_model = None
 
-        self.detect_model = load_model("./cache/GroundingDINO_SwinB_cfg.py", "./cache/groundingdino_swinb_cogcoor.pth")
+    @property
+    def detect_model(self):
+        return ModelRegistry().get(constants.MODEL_GROUNDING_DINO)
 
 
     def detect(self,
@@ -77,6 +85,8 @@ class GroundingDINO(metaclass=Singleton):
                device='cuda',
                ):
 
+        from groundingdino.util.inference import load_image
+
         image_source, image = load_image(image_path)
 
         boxes, logits, phrases = unique_predict(
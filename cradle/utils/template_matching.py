@@ -1,7 +1,10 @@
+import glob
 import math
 import os
+import threading
 import time
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
 
 import cv2
 from MTM import matchTemplates, drawBoxesOnRGB
@@ -11,6 +14,7 @@ from PIL import Image
 from cradle.config import Config
 from cradle.gameio.lifecycle.ui_control import take_screenshot
 from cradle.log import Logger
+from cradle.utils import Singleton
 from cradle.utils.file_utils import assemble_project_path
 from cradle.utils.json_utils import save_json
 
@@ -55,6 +59,174 @@ def get_mtm_match(image: np.ndarray, template: np.ndarray, scales: list):
     return detection
 
 
+def get_template_scales(scale: Union[str, List[float]]) -> List[float]:
+
+    scales = scale
+    if scales == 'small':
+        scales = [0.1, 0.2, 0.3, 0.4, 0.5]
+    elif scales == 'mid':
+        scales = [0.3, 0.4, 0.5, 0.6, 0.7]
+    elif scales == 'normal':
+        scales = [0.8, 0.9, 1.0, 1.1, 1.2]
+    elif scales == 'full':
+        scales = [0.5,0.75,1.0,1.5,2]
+    elif not isinstance(scales, list):
+        raise ValueError('scales must be a list of float numbers or one of "small", "mid", "normal", "full"')
+
+    return scales
+
+
+def get_template_resize_ratio() -> Tuple[float, float]:
+
+    # Resize template according to resolution ratio
+    if config.env_name == 'Stardew Valley': # @TODO move to env
+        return 1, 1
+    else:
+        return config.resolution_ratio, config.resolution_ratio
+
+
+class TemplateLibrary(metaclass=Singleton):
+    """
+    Cache of decoded, resolution-scaled templates and their scale pyramids.
+
+    Templates are keyed by path, modification time and resize ratio, so each file is only read and resized
+    once per run. The icons of an environment (res/<env>/icons) can be preloaded and matched together
+    against a single decoded screenshot.
+    """
+
+    def __init__(self):
+        self._templates = {}
+        self._pyramids = {}
+        self._lock = threading.Lock()
+
+
+    def get_template(self, template_file: str) -> np.ndarray:
+        """Return the template image, resized by the environment resolution ratio."""
+
+        path = assemble_project_path(template_file)
+        fx, fy = get_template_resize_ratio()
+        key = (path, os.path.getmtime(path), fx, fy)
+
+        template = self._templates.get(key)
+        if template is None:
+            template = cv2.imread(path)
+            template = cv2.resize(template, (0, 0), fx=fx, fy=fy)
+            with self._lock:
+                self._templates[key] = template
+
+        return template
+
+
+    def get_pyramid(self, template_file: str, scale: Union[str, List[float]] = 'full') -> List[Tuple[float, np.ndarray]]:
+        """Return the (scale, scaled template) pairs used for multi-scale matching of a template."""
+
+        path = assemble_project_path(template_file)
+        fx, fy = get_template_resize_ratio()
+        scales = tuple(get_template_scales(scale))
+        key = (path, os.path.getmtime(path), fx, fy, scales)
+
+        pyramid = self._pyramids.get(key)
+        if pyramid is None:
+            template = self.get_template(template_file)
+            pyramid = [(s, cv2.resize(template, (0, 0), fx=s, fy=s)) for s in scales]
+            with self._lock:
+                self._pyramids[key] = pyramid
+
+        return pyramid
+
+
+    def get_icon_file(self, icon: str, env_sub_path: str = None) -> str:
+
+        if env_sub_path is None:
+            env_sub_path = config.env_sub_path
+
+        return f'./res/{env_sub_path}/icons/{icon}.png'
+
+
+    def load_icons(self, env_sub_path: str = None, scale: Union[str, List[float]] = 'full') -> List[str]:
+        """Preload and pre-scale all icons of an environment, returning the icon names."""
+
+        if env_sub_path is None:
+            env_sub_path = config.env_sub_path
+
+        directory = assemble_project_path(f'./res/{env_sub_path}/icons')
+        icons = [os.path.splitext(os.path.basename(file))[0] for file in glob.glob(os.path.join(directory, "*.png"))]
+
+        for icon in icons:
+            self.get_pyramid(self.get_icon_file(icon, env_sub_path), scale)
+
+        return icons
+
+
+    def match(self, image: np.ndarray, template_file: str, scale: Union[str, List[float]] = 'full') -> Dict:
+        """
+        Find the best match of a template over its scale pyramid, like get_mtm_match with N_object=1.
+
+        Returns:
+            A dict with the "bounding_box" (x, y, w, h) and "confidence" of the best match, or None if no scale fits in the image.
+        """
+
+        best = None
+        for _, scaled_template in self.get_pyramid(template_file, scale):
+
+            height, width = scaled_template.shape[:2]
+            if height > image.shape[0] or width > image.shape[1]:
+                continue
+
+            corr_map = cv2.matchTemplate(image, scaled_template, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(corr_map)
+
+            if best is None or max_val > best["confidence"]:
+                best = {
+                    "bounding_box": (max_loc[0], max_loc[1], width, height),
+                    "confidence": max_val,
+                }
+
+        return best
+
+
+    def match_icons(self,
+                    icon_list: List[str],
+                    image: np.ndarray,
+                    confidence_threshold: float = 0.90,
+                    scale: Union[str, List[float]] = 'full',
+                    max_workers: int = None) -> List[Dict]:
+        """
+        Match all icons against one decoded screenshot.
+
+        Args:
+            icon_list: Icon names under res/<env>/icons.
+            image: The decoded screenshot, in BGR.
+            confidence_threshold: Minimum confidence for an icon to be reported.
+            scale: Template scales, see get_template_scales.
+            max_workers: If larger than 1, icons are matched in a thread pool. OpenCV releases the GIL while matching.
+
+        Returns:
+            A list of bounding box dicts with "left", "top", "width" and "height", in icon_list order.
+        """
+
+        icon_files = [self.get_icon_file(icon) for icon in icon_list]
+
+        if max_workers is not None and max_workers > 1 and len(icon_files) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda file: self.match(image, file, scale), icon_files))
+        else:
+            results = [self.match(image, file, scale) for file in icon_files]
+
+        matches = []
+        for result in results:
+            if result is not None and result["confidence"] >= confidence_threshold:
+                bb = result["bounding_box"]
+                matches.append({
+                    "left": math.ceil(bb[0]),
+                    "top": math.ceil(bb[1]),
+                    "width": math.ceil(bb[2]),
+                    "height": math.ceil(bb[3]),
+                })
+
+        return matches
+
+
 def match_template_image(src_file: str, template_file: str, debug = False, output_bb = False, save_matches = False, scale = "normal", rotate_angle : float = 0) -> List[dict]:
     '''
     Multi-scale template matching
@@ -73,30 +245,10 @@ def match_template_image(src_file: str, template_file: str, debug = False, outpu
     output_dir = config.work_dir
     tid = time.time()
 
-    scales = scale
-    if scales == 'small':
-        scales = [0.1, 0.2, 0.3, 0.4, 0.5]
-    elif scales == 'mid':
-        scales = [0.3, 0.4, 0.5, 0.6, 0.7]
-    elif scales == 'normal':
-        scales = [0.8, 0.9, 1.0, 1.1, 1.2]
-    elif scales == 'full':
-        scales = [0.5,0.75,1.0,1.5,2]
-    elif not isinstance(scales, list):
-        raise ValueError('scales must be a list of float numbers or one of "small", "mid", "normal", "full"')
+    scales = get_template_scales(scale)
 
     image = cv2.imread(assemble_project_path(src_file))
-    template = cv2.imread(assemble_project_path(template_file))
-
-    # Resize template according to resolution ratio
-    if config.env_name == 'Stardew Valley': # @TODO move to env
-        fx=1
-        fy=1
-    else:
-        fx=config.resolution_ratio
-        fy=config.resolution_ratio
-
-    template = cv2.resize(template, (0, 0), fx=fx, fy=fy)
+    template = TemplateLibrary().get_template(template_file)
 
     if rotate_angle != 0:
         h, w, c = image.shape
@@ -146,35 +298,18 @@ def match_template_image(src_file: str, template_file: str, debug = False, outpu
     return objects_list
 
 
-def icons_match(icon_list: List[str], image_path = None) -> bool:
+def icons_match(icon_list: List[str], image_path = None, max_workers: int = None) -> List[dict]:
 
     confidence_threshold = 0.90
 
-    matches = []
-
     if image_path is None:
         screenshot = take_screenshot(time.time(), include_minimap=False)[0]
     else:
         screenshot = image_path
 
-    for icon in icon_list:
-
-        # Multiple-scale-template-matching icon
-        icon_template_file = f'./res/{config.env_sub_path}/icons/{icon}.png'
-
-        match_info = match_template_image(screenshot, icon_template_file, save_matches=False, scale='full')
-        match_info.sort(key=lambda bb: (bb['confidence']))
-
-        if match_info[0]['confidence'] >= confidence_threshold:
-
-            bb = match_info[0]['bounding_box']
-            bb_dict = {
-                "left": math.ceil(bb[0]),
-                "top": math.ceil(bb[1]),
-                "width": math.ceil(bb[2]),
-                "height": math.ceil(bb[3]),
-            }
-            matches.append(bb_dict)
+    # Decode the screenshot once and match all icons against it, with cached template pyramids
+    image = cv2.imread(assemble_project_path(screenshot))
+    matches = TemplateLibrary().match_icons(icon_list, image, confidence_threshold=confidence_threshold, scale='full', max_workers=max_workers)
 
     if image_path is None:
         os.remove(screenshot)
@@ -1,13 +1,21 @@
 import argparse
-import importlib
 
 from cradle.config import Config
 from cradle.gameio import GameManager
 from cradle.log import Logger
+from cradle.utils.model_registry import ModelRegistry
 
 config = Config()
 logger = Logger()
 
+# Heavy components imported one by one for --profile-startup, each time excludes the modules imported before it
+PROFILED_MODULES = [
+    'cradle.utils.object_utils',
+    'cradle.utils.image_utils',
+    'cradle.provider.video.video_recorder',
+    'cradle.provider.sam_provider',
+]
+
 
 def main(args):
 
@@ -18,9 +26,26 @@ def main(args):
         runner_key = config.env_short_name.lower()
 
     # Load the runner module
-    runner_module = importlib.import_module(f'cradle.runner.{runner_key}_runner')
+    model_registry = ModelRegistry()
+    if args.profile_startup:
+        for module_name in PROFILED_MODULES:
+            try:
+                model_registry.import_module(module_name)
+            except ImportError as e:
+                logger.warn(f'Could not import {module_name} for the startup profile: {e}')
+
+    runner_module = model_registry.import_module(f'cradle.runner.{runner_key}_runner')
     entry = getattr(runner_module, 'entry')
 
+    # Heavy models load on first use, unless prewarmed in the background
+    model_registry.prewarm(config.prewarm_models)
+
+    if args.profile_startup:
+        # Also time the models not loaded yet, then report before the first turn
+        for future in model_registry.prewarm():
+            future.result()
+        model_registry.log_profile()
+
     # Run the entry
     entry(args)
 
@@ -31,6 +56,7 @@ def get_args_parser():
     parser.add_argument("--llmProviderConfig", type=str, default="./conf/openai_config.json", help="The path to the LLM provider config file")
     parser.add_argument("--embedProviderConfig", type=str, default="./conf/openai_config.json", help="The path to the embedding model provider config file")
     parser.add_argument("--envConfig", type=str, default="./conf/env_config_rdr2_main_storyline.json", help="The path to the environment config file")
+    parser.add_argument("--profile-startup", dest="profile_startup", action="store_true", default=False, help="Log import and model load times per component before the first turn")
     return parser
 
 